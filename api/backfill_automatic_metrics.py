@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Backfill de métricas automáticas - AquaLytics API
+Calcula y guarda las métricas automáticas de las pruebas históricas que no las tienen,
+procesando los registros por bloques de nadadores.
+
+Uso:
+    python backfill_automatic_metrics.py [--chunk-size 50] [--nadador-id 12] [--dry-run]
+"""
+
+import sys
+import time
+import argparse
+import logging
+from typing import Dict, List, Any, Optional
+
+from utils.supabase_client import SupabaseClient
+from utils.automatic_metrics import (
+    MANUAL_INPUTS, automatic_metric_ids, build_automatic_records, load_reference
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('backfill_automatic_metrics')
+
+PAGE_SIZE = 1000
+INSERT_BATCH = 500
+
+
+def _fetch_rows(client: SupabaseClient, swimmer_ids: List[int], metric_ids: List[int]) -> List[Dict[str, Any]]:
+    """Registros manuales y automáticos de un bloque de nadadores (paginado)"""
+    rows: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        page = client.client.table('registros') \
+            .select('registro_id, id_nadador, prueba_id, metrica_id, valor, segmento, fecha, competencia_id, fase_id') \
+            .in_('id_nadador', swimmer_ids) \
+            .in_('metrica_id', metric_ids) \
+            .order('registro_id') \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+def backfill(client: SupabaseClient, chunk_size: int = 50, dry_run: bool = False,
+             swimmer_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Completa las métricas automáticas faltantes; idempotente (no duplica las existentes)"""
+    start = time.perf_counter()
+    prueba_ids = [p['id'] for p in client.client.table('pruebas').select('id').execute().data or []]
+    metric_names, distances = load_reference(client, prueba_ids)
+    manual_names = {name for name, _ in MANUAL_INPUTS}
+    auto_ids = set(automatic_metric_ids(metric_names))
+    metric_ids = sorted(auto_ids | {i for i, name in metric_names.items() if name in manual_names})
+    if not auto_ids:
+        logger.error("No hay métricas automáticas en la tabla 'metricas' (¿faltan las migraciones 003/006?)")
+        return {'success': False, 'inserted': 0}
+
+    if swimmer_ids is None:
+        swimmer_ids = sorted(
+            n['id_nadador'] for n in client.client.table('nadadores').select('id_nadador').execute().data or []
+        )
+
+    stats = {'success': True, 'swimmers': len(swimmer_ids), 'rows_read': 0, 'inserted': 0, 'dry_run': dry_run}
+    for chunk_start in range(0, len(swimmer_ids), chunk_size):
+        chunk = swimmer_ids[chunk_start:chunk_start + chunk_size]
+        rows = _fetch_rows(client, chunk, metric_ids)
+        existing = {
+            ((r['id_nadador'], r['prueba_id'], str(r['fecha'])), r['metrica_id'])
+            for r in rows if r['metrica_id'] in auto_ids
+        }
+        records = build_automatic_records(rows, metric_names, distances, existing)
+        if not dry_run:
+            for i in range(0, len(records), INSERT_BATCH):
+                result = client.insert_metric_records(records[i:i + INSERT_BATCH])
+                if not result['success']:
+                    logger.error(f"Error insertando métricas automáticas: {result['errors']}")
+                    stats['success'] = False
+                    return stats
+        stats['rows_read'] += len(rows)
+        stats['inserted'] += len(records)
+        logger.info(
+            f"Nadadores {chunk_start + len(chunk)}/{len(swimmer_ids)}: "
+            f"{len(rows)} registros leídos, {len(records)} métricas automáticas"
+            f"{' (simulación)' if dry_run else ''}"
+        )
+
+    stats['duration_s'] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill de métricas automáticas por bloques de nadadores')
+    parser.add_argument('--chunk-size', type=int, default=50, help='Nadadores por bloque (default: 50)')
+    parser.add_argument('--nadador-id', type=int, action='append', help='Limitar a uno o más nadadores')
+    parser.add_argument('--dry-run', action='store_true', help='Calcular sin insertar')
+    args = parser.parse_args()
+
+    stats = backfill(SupabaseClient(), args.chunk_size, args.dry_run, args.nadador_id)
+    logger.info(f"Backfill terminado: {stats}")
+    sys.exit(0 if stats['success'] else 1)
+
+
+if __name__ == "__main__":
+    main()
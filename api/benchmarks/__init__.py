@@ -0,0 +1,5 @@
+"""
+Benchmarks - AquaLytics API
+Generador de datos sintéticos, backend en memoria y suites de rendimiento
+(se ejecutan con `python -m benchmarks.<suite>` desde api/).
+"""
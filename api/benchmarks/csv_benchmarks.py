@@ -0,0 +1,363 @@
+"""
+CSV Benchmarks - AquaLytics API
+Throughput y memoria de la carga masiva por CSV, etapa por etapa: detección de
+encoding/delimitador, parseo, normalización de columnas, validación,
+transformación a formato largo y escritura (métricas automáticas + insert por
+lotes en el backend en memoria). Los CSV se generan con distintos encodings,
+delimitadores, alias de columnas y una fracción de filas defectuosas.
+
+Uso (desde api/):
+    python -m benchmarks.csv_benchmarks [--rows 1000,10000] [--dirty-rate 0.1]
+        [--scenarios clean,latin1_semicolon] [--repeat 3] [--output reporte.json]
+        [--compare reporte_anterior.json]
+    python -m benchmarks.csv_benchmarks --check-route [--rows 1000]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Any, Callable, Tuple
+
+os.environ.setdefault('SUPABASE_URL', 'http://offline')
+os.environ.setdefault('SUPABASE_ANON_KEY', 'offline')
+
+import pandas as pd
+
+from benchmarks.offline_backend import OfflineStore, offline_supabase_client
+from benchmarks.synthetic_data import generate_csv
+from ingest import DataIngestionService
+from utils.csv_processor import CSVProcessor
+from utils.supabase_client import MetricRecord
+
+logger = logging.getLogger('csv_benchmarks')
+
+STAGES = ['detect', 'parse', 'normalize', 'validate', 'transform', 'write']
+INSERT_BATCH = 500
+
+
+@dataclass(frozen=True)
+class CSVScenario:
+    """Variante de archivo CSV"""
+    name: str
+    encoding: str
+    delimiter: str
+    aliases: bool
+    dirty: bool
+
+
+SCENARIOS = {
+    'clean': CSVScenario('clean', 'utf-8', ',', aliases=False, dirty=False),
+    'utf8sig_aliases': CSVScenario('utf8sig_aliases', 'utf-8-sig', ',', aliases=True, dirty=True),
+    'latin1_semicolon': CSVScenario('latin1_semicolon', 'latin-1', ';', aliases=True, dirty=True),
+    'cp1252_tab': CSVScenario('cp1252_tab', 'cp1252', '\t', aliases=False, dirty=True),
+}
+
+
+def _reference_data(tables: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Tablas de referencia en el formato de CSVProcessor.transform_to_long_format"""
+    distancias = {d['distancia_id']: d['distancia'] for d in tables['distancias']}
+    estilos = {e['estilo_id']: e['nombre'] for e in tables['estilos']}
+    return {
+        'swimmers': tables['nadadores'],
+        'competitions': tables['competencias'],
+        'phases': tables['fases'],
+        'metrics': tables['metricas'],
+        'tests': [
+            {'distancia': distancias[p['distancia_id']], 'estilo': estilos[p['estilo_id']], 'prueba_id': p['id']}
+            for p in tables['pruebas'] if p['curso'] == 'largo'
+        ],
+    }
+
+
+class CSVPipeline:
+    """
+    Las etapas de CSVProcessor.process_csv_file por separado, más la escritura.
+
+    Cada etapa recibe el estado anterior y devuelve el siguiente, para poder
+    medirlas de forma aislada con el mismo archivo.
+    """
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.processor = CSVProcessor()
+        self.tables = tables
+        self.reference = _reference_data(tables)
+
+    def detect(self, content: bytes) -> Dict[str, Any]:
+        encoding = self.processor.detect_encoding(content)
+        text = content.decode(encoding)
+        return {'encoding': encoding, 'text': text, 'delimiter': self.processor.detect_delimiter(text)}
+
+    def parse(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        df = pd.read_csv(io.StringIO(state['text']), delimiter=state['delimiter'])
+        return {**state, 'df': df, 'rows_in': len(df)}
+
+    def normalize(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {**state, 'df': self.processor.normalize_column_names(state['df'])}
+
+    def validate(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        df_clean, errors, warnings = self.processor.validate_and_clean_data(state['df'])
+        return {**state, 'df_clean': df_clean, 'errors': errors, 'warnings': warnings}
+
+    def transform(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        records, transform_errors = self.processor.transform_to_long_format(state['df_clean'], self.reference)
+        return {**state, 'records': records, 'transform_errors': transform_errors}
+
+    def write(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        MetricRecords de las pruebas transformadas, métricas automáticas y
+        inserción por lotes, como la ingesta CSV (las filas sin prueba se omiten).
+        """
+        service = DataIngestionService()
+        service.supabase_client = offline_supabase_client(OfflineStore(self.tables))
+
+        records: List[MetricRecord] = []
+        for test in state['records']:
+            if test['prueba_id'] is None:
+                continue
+            for metrica in test['metricas']:
+                records.append(MetricRecord(
+                    id_nadador=test['id_nadador'],
+                    prueba_id=test['prueba_id'],
+                    metrica_id=metrica['metrica_id'],
+                    valor=float(metrica['valor']),
+                    fecha=test['fecha'],
+                    segmento=metrica['segmento'],
+                    competencia_id=test['competencia_id'],
+                    fase_id=test['fase_id']
+                ))
+        automatic = service._automatic_records(records)
+        to_insert = records + automatic
+        inserted = 0
+        for i in range(0, len(to_insert), INSERT_BATCH):
+            result = service.supabase_client.insert_metric_records(to_insert[i:i + INSERT_BATCH])
+            inserted += result['inserted']
+        return {**state, 'manual_written': len(records), 'automatic_written': len(automatic), 'written': inserted}
+
+    def run(self, content: bytes, observe: Callable[[str, Callable[[], Any]], Any]) -> Dict[str, Any]:
+        """Ejecuta las etapas en orden; `observe(etapa, fn)` mide cada una"""
+        state = observe('detect', lambda: self.detect(content))
+        for stage in STAGES[1:]:
+            state = observe(stage, lambda stage=stage, state=state: getattr(self, stage)(state))
+        return state
+
+
+def _timed_run(pipeline: CSVPipeline, content: bytes) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    timings: Dict[str, float] = {}
+
+    def observe(stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    return timings, pipeline.run(content, observe)
+
+
+def _memory_run(pipeline: CSVPipeline, content: bytes) -> Dict[str, float]:
+    """Pico de memoria asignada (KB) de cada etapa, aislado con tracemalloc.reset_peak"""
+    peaks: Dict[str, float] = {}
+
+    def observe(stage, fn):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[stage] = round(max(0, peak - current) / 1024, 1)
+        return result
+
+    tracemalloc.start()
+    try:
+        pipeline.run(content, observe)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_scenario(scenario: CSVScenario, n_rows: int, dirty_rate: float, repeat: int, seed: int) -> Dict[str, Any]:
+    """Mediana de `repeat` ejecuciones por etapa, pico de memoria y resultado del pipeline"""
+    aliases = CSVProcessor().column_mappings if scenario.aliases else None
+    content, tables, dirt = generate_csv(
+        n_rows, seed=seed, encoding=scenario.encoding, delimiter=scenario.delimiter,
+        aliases=aliases, dirty_rate=dirty_rate if scenario.dirty else 0.0
+    )
+    pipeline = CSVPipeline(tables)
+
+    # Calentamiento: imports diferidos y cachés de chardet/pandas fuera de la medición
+    _timed_run(pipeline, content)
+    runs, state = [], {}
+    for _ in range(repeat):
+        timings, state = _timed_run(pipeline, content)
+        runs.append(timings)
+    peaks = _memory_run(pipeline, content)
+
+    stages = {}
+    for stage in STAGES:
+        seconds = sorted(run[stage] for run in runs)[len(runs) // 2]
+        stages[stage] = {
+            'seconds': round(seconds, 5),
+            'rows_per_s': round(n_rows / seconds, 1) if seconds > 0 else None,
+            'peak_kb': peaks.get(stage)
+        }
+    total = sum(s['seconds'] for s in stages.values())
+    return {
+        'scenario': scenario.name,
+        'rows': n_rows,
+        'bytes': len(content),
+        'encoding': scenario.encoding,
+        'delimiter': scenario.delimiter,
+        'aliases': scenario.aliases,
+        'injected_dirt': dirt,
+        'stages': stages,
+        'total': {'seconds': round(total, 5), 'rows_per_s': round(n_rows / total, 1) if total > 0 else None},
+        'outcome': {
+            'encoding_detected': state.get('encoding'),
+            'delimiter_detected': state.get('delimiter'),
+            'rows_parsed': state.get('rows_in'),
+            'rows_valid': len(state['df_clean']) if 'df_clean' in state else 0,
+            'tests_transformed': len(state.get('records', [])),
+            'transform_errors': len(state.get('transform_errors', [])),
+            'warnings': state.get('warnings', []),
+            'manual_written': state.get('manual_written', 0),
+            'automatic_written': state.get('automatic_written', 0),
+        }
+    }
+
+
+def run_suite(rows: List[int], scenarios: List[str], dirty_rate: float = 0.1, repeat: int = 3,
+              seed: int = 42) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        'meta': {
+            'dirty_rate': dirty_rate,
+            'repeat': repeat,
+            'seed': seed,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+        },
+        'results': {}
+    }
+    for n_rows in rows:
+        for name in scenarios:
+            result = run_scenario(SCENARIOS[name], n_rows, dirty_rate, repeat, seed)
+            report['results'][f"{name}/{n_rows}"] = result
+            stages = '  '.join(
+                f"{stage}={s['rows_per_s'] or 0:>9.0f}/s" for stage, s in result['stages'].items()
+            )
+            outcome = result['outcome']
+            logger.info(
+                f"{name + '/' + str(n_rows):<24} {stages}  "
+                f"válidas={outcome['rows_valid']}/{outcome['rows_parsed']} "
+                f"escritas={outcome['manual_written'] + outcome['automatic_written']}"
+            )
+    # Pico de RSS del proceso (ru_maxrss en KB en Linux)
+    report['meta']['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def compare(report: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    """Cambio relativo de filas/s y pico de memoria por etapa respecto a otro reporte"""
+    lines = []
+    for key, result in report['results'].items():
+        old = previous.get('results', {}).get(key)
+        if old is None:
+            continue
+        for stage, current in result['stages'].items():
+            before = old['stages'].get(stage)
+            if not before or not before['rows_per_s'] or not current['rows_per_s']:
+                continue
+            speed = current['rows_per_s'] / before['rows_per_s'] - 1
+            memory = (current['peak_kb'] - before['peak_kb']) if before.get('peak_kb') is not None else 0.0
+            lines.append(f"{key:<24} {stage:<10} filas/s {speed:+7.1%}  pico {memory:+10.1f}KB")
+    return lines
+
+
+def check_route(n_rows: int, seed: int = 42) -> List[str]:
+    """
+    Sube un CSV sintético limpio a POST /ingest/csv de la aplicación completa
+    (backend en memoria) y compara lo insertado con el pipeline por etapas.
+    Devuelve las diferencias; vacío si la ruta escribe lo mismo.
+    """
+    from starlette.testclient import TestClient
+    from benchmarks.load_test import install_offline_backend
+    import main as app_main
+
+    content, tables, _ = generate_csv(n_rows, seed=seed)
+    expected = CSVPipeline(tables).run(content, lambda stage, fn: fn())
+
+    store = OfflineStore(tables)
+    install_offline_backend(store)
+    before = len(store.tables['registros'])
+    with TestClient(app_main.app) as client:
+        response = client.post('/ingest/csv', files={'file': ('check.csv', content, 'text/csv')})
+    body = response.json()
+
+    problems = []
+    if response.status_code != 200 or not body.get('success'):
+        problems.append(f"HTTP {response.status_code}: {body.get('message')} {body.get('errors')}")
+    stats = body.get('stats', {})
+    for key, want in (('inserted', expected['manual_written']), ('automatic_inserted', expected['automatic_written'])):
+        if stats.get(key) != want:
+            problems.append(f"{key}: ruta={stats.get(key)} pipeline={want}")
+    written = len(store.tables['registros']) - before
+    if written != expected['written']:
+        problems.append(f"registros escritos: ruta={written} pipeline={expected['written']}")
+    logger.info(
+        f"/ingest/csv con {n_rows} filas: {written} registros "
+        f"({stats.get('automatic_inserted')} automáticos) en {store.calls} consultas al backend"
+    )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput y memoria por etapa de la carga masiva por CSV')
+    parser.add_argument('--rows', default='1000,10000', help='Filas por archivo, separadas por coma')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Escenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument('--dirty-rate', type=float, default=0.1, help='Fracción de filas defectuosas')
+    parser.add_argument('--repeat', type=int, default=3, help='Ejecuciones medidas (se reporta la mediana)')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--output', help='Guardar el reporte JSON en esta ruta')
+    parser.add_argument('--compare', help='Reporte anterior con el que comparar')
+    parser.add_argument('--check-route', action='store_true',
+                        help='Comprobar POST /ingest/csv contra el pipeline por etapas (sale con 1 si difieren)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    for name in ('ingest', 'utils'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(unknown)}")
+    rows = [int(r) for r in args.rows.split(',') if r.strip()]
+
+    if args.check_route:
+        problems = [p for n_rows in rows for p in check_route(n_rows, args.seed)]
+        for problem in problems:
+            logger.error(problem)
+        sys.exit(1 if problems else 0)
+
+    report = run_suite(rows, scenarios, args.dirty_rate, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            # Claves ordenadas para que los reportes de distintos commits se puedan comparar con diff
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+        logger.info(f"Reporte guardado en {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for line in compare(report, previous):
+            logger.info(line)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
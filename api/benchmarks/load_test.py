@@ -0,0 +1,418 @@
+"""
+Load Test - AquaLytics API
+Generador de carga para la aplicación unificada (main:app): usuarios virtuales
+concurrentes que ejecutan sesiones de un mix de escenarios (dashboard, carga
+de datos del entrenador) a través de httpx.ASGITransport en el mismo proceso,
+de un uvicorn local o de una URL externa. Reporta throughput, percentiles de
+latencia por endpoint, tasa de errores y el retraso del event loop, que crece
+cuando las llamadas síncronas a la BD lo bloquean.
+
+Uso (desde api/):
+    python -m benchmarks.load_test [--users 1,10,50] [--duration 10]
+        [--mix dashboard=0.8,coach=0.2] [--best-times 4] [--latency-ms 2]
+        [--no-cache] [--uvicorn | --url http://localhost:8000] [--output reporte.json]
+        [--loop-block-ms 50]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+os.environ.setdefault('SUPABASE_URL', 'http://offline')
+os.environ.setdefault('SUPABASE_ANON_KEY', 'offline')
+
+import httpx
+
+from benchmarks.offline_backend import OfflineStore, offline_supabase_client
+from benchmarks.stats import summarize
+from benchmarks.synthetic_data import generate_dataset, DISTANCIAS, ESTILOS
+
+logger = logging.getLogger('load_test')
+
+# Intervalo del monitor de retraso del event loop
+LAG_INTERVAL_S = 0.01
+
+
+@dataclass
+class RequestSpec:
+    """Un request de una sesión"""
+    name: str
+    method: str
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    json: Optional[Dict[str, Any]] = None
+
+
+class DatasetContext:
+    """Ids y pruebas del dataset sintético para construir requests válidos"""
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        distancias = {d['distancia_id']: d['distancia'] for d in tables['distancias']}
+        estilos = {e['estilo_id']: e['nombre'] for e in tables['estilos']}
+        self.events = [
+            (estilos[p['estilo_id']], distancias[p['distancia_id']], p['curso'], p['id'])
+            for p in tables['pruebas']
+        ]
+        self.swimmers = [(n['id_nadador'], n['nombre']) for n in tables['nadadores']]
+        self.competitions = [c['competencia_id'] for c in tables['competencias']] or [None]
+
+
+def dashboard_session(rnd: random.Random, ctx: DatasetContext, best_times: int) -> List[RequestSpec]:
+    """Carga del dashboard: agregados + mejores tiempos × N + distribución de estilos"""
+    requests = [RequestSpec('aggregate', 'GET', '/query/aggregate',
+                            params={'metrics': 'total_swimmers,active_competitions,total_tests'})]
+    for estilo, distancia, curso, _ in rnd.sample(ctx.events, min(best_times, len(ctx.events))):
+        requests.append(RequestSpec('best-times', 'GET', '/query/best-times',
+                                    params={'style': estilo, 'distance': distancia, 'course': curso}))
+    requests.append(RequestSpec('styles-distribution', 'GET', '/query/styles-distribution'))
+    return requests
+
+
+def coach_session(rnd: random.Random, ctx: DatasetContext, best_times: int) -> List[RequestSpec]:
+    """Carga de datos del entrenador: previsualización y registro individual"""
+    estilo, distancia, _, prueba_id = rnd.choice(ctx.events)
+    id_nadador, nombre = rnd.choice(ctx.swimmers)
+    t_total = round(rnd.uniform(28.0, 75.0), 2)
+    preview = {
+        'distancia_total': distancia,
+        'manual_metrics': {
+            'tiempo_total': t_total,
+            'brazadas_totales': rnd.randint(16, 60),
+            'segments': [
+                {'t15': round(rnd.uniform(6.0, 9.0), 2), 'length': 15, 'f': round(rnd.uniform(5.0, 11.0), 1)},
+                {'t15': round(rnd.uniform(6.5, 9.5), 2), 'length': 15, 'f': round(rnd.uniform(4.0, 9.0), 1)},
+            ]
+        }
+    }
+    record = {
+        'id_nadador': id_nadador,
+        'nadador': nombre,
+        'prueba_id': prueba_id,
+        'competencia_id': rnd.choice(ctx.competitions),
+        'fecha': time.strftime('%Y-%m-%d'),
+        'distancia_id': DISTANCIAS.index(distancia) + 1,
+        'estilo_id': ESTILOS.index(estilo) + 1,
+        'fase_id': 1,
+        'metrica_id': 9,
+        'valor': t_total,
+    }
+    return [
+        RequestSpec('preview', 'POST', '/preview/calculate', json=preview),
+        RequestSpec('ingest-record', 'POST', '/ingest/record', json=record),
+    ]
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, DatasetContext, int], List[RequestSpec]]] = {
+    'dashboard': dashboard_session,
+    'coach': coach_session,
+}
+
+
+@dataclass
+class Recorder:
+    """Resultados de un nivel de carga"""
+    requests: Dict[str, List[float]] = field(default_factory=dict)
+    statuses: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    sessions: Dict[str, List[float]] = field(default_factory=dict)
+    lag: List[float] = field(default_factory=list)
+
+    def request(self, name: str, status: str, elapsed: float) -> None:
+        self.requests.setdefault(name, []).append(elapsed * 1000)
+        counts = self.statuses.setdefault(name, {})
+        counts[status] = counts.get(status, 0) + 1
+
+    def session(self, name: str, elapsed: float) -> None:
+        self.sessions.setdefault(name, []).append(elapsed * 1000)
+
+
+def _status_class(status: int) -> str:
+    # 503 es el rechazo del control de admisión (AQUALYTICS_ADMISSION=1), no un fallo
+    return 'shed' if status == 503 else f"{status // 100}xx"
+
+
+async def _send(client: httpx.AsyncClient, spec: RequestSpec, headers: Dict[str, str],
+                recorder: Recorder) -> float:
+    """Envía el request; retorna el Retry-After (s) si fue rechazado, 0 en otro caso"""
+    start = time.perf_counter()
+    # Con ASGITransport un request sin E/S real no cede el loop: sin este punto de
+    # suspensión cada usuario acapararía el loop hasta terminar sus sesiones. Dentro
+    # de la medición, para que la latencia incluya la espera por el loop ocupado
+    await asyncio.sleep(0)
+    retry_after = 0.0
+    try:
+        response = await client.request(spec.method, spec.path, params=spec.params, json=spec.json, headers=headers)
+        status = _status_class(response.status_code)
+        if status == 'shed':
+            retry_after = float(response.headers.get('retry-after', 1))
+    except Exception as e:
+        status = f"exception:{type(e).__name__}"
+    recorder.request(spec.name, status, time.perf_counter() - start)
+    return retry_after
+
+
+async def _virtual_user(client: httpx.AsyncClient, rnd: random.Random, ctx: DatasetContext,
+                        mix: List[Tuple[str, float]], best_times: int, headers: Dict[str, str],
+                        deadline: float, think_s: float, recorder: Recorder) -> None:
+    names, weights = [m[0] for m in mix], [m[1] for m in mix]
+    while time.perf_counter() < deadline:
+        scenario = rnd.choices(names, weights=weights)[0]
+        start = time.perf_counter()
+        for spec in SCENARIOS[scenario](rnd, ctx, best_times):
+            retry_after = await _send(client, spec, headers, recorder)
+            if retry_after:
+                # Como un cliente real: abandona la sesión y respeta Retry-After
+                await asyncio.sleep(min(retry_after, max(deadline - time.perf_counter(), 0)))
+                break
+        else:
+            recorder.session(scenario, time.perf_counter() - start)
+        if think_s:
+            await asyncio.sleep(think_s)
+
+
+async def _monitor_lag(recorder: Recorder, stop: asyncio.Event) -> None:
+    """Retraso del loop: cuánto tarda en despertar un sleep de LAG_INTERVAL_S"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(LAG_INTERVAL_S)
+        recorder.lag.append(max(0.0, loop.time() - start - LAG_INTERVAL_S) * 1000)
+
+
+async def run_level(client: httpx.AsyncClient, ctx: DatasetContext, users: int, duration: float,
+                    mix: List[Tuple[str, float]], best_times: int, headers: Dict[str, str],
+                    think_s: float, seed: int) -> Dict[str, Any]:
+    """Un nivel de carga: `users` usuarios concurrentes durante `duration` segundos"""
+    recorder = Recorder()
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_lag(recorder, stop))
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        _virtual_user(client, random.Random(seed * 1000 + i), ctx, mix, best_times, headers,
+                      deadline, think_s, recorder)
+        for i in range(users)
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    endpoints = {}
+    all_latencies: List[float] = []
+    totals: Dict[str, int] = {}
+    for name, latencies in sorted(recorder.requests.items()):
+        statuses = recorder.statuses[name]
+        errors = sum(n for s, n in statuses.items() if s == '5xx' or s.startswith('exception'))
+        endpoints[name] = {
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'error_rate': round(errors / len(latencies), 4),
+            'statuses': statuses,
+            'latency_ms': summarize(latencies)
+        }
+        all_latencies.extend(latencies)
+        for status, n in statuses.items():
+            totals[status] = totals.get(status, 0) + n
+
+    total = len(all_latencies)
+    errors = sum(n for s, n in totals.items() if s == '5xx' or s.startswith('exception'))
+    return {
+        'users': users,
+        'duration_s': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'client_error_rate': round(totals.get('4xx', 0) / total, 4) if total else 0.0,
+        'shed_rate': round(totals.get('shed', 0) / total, 4) if total else 0.0,
+        'statuses': totals,
+        'latency_ms': summarize(all_latencies),
+        'loop_lag_ms': summarize(recorder.lag),
+        'endpoints': endpoints,
+        'sessions': {name: summarize(values) for name, values in sorted(recorder.sessions.items())},
+    }
+
+
+def install_offline_backend(store: OfflineStore):
+    """Apunta los servicios globales de la aplicación al backend en memoria"""
+    import query
+    import ingest
+    client = offline_supabase_client(store)
+    query.query_service._supabase_client = client
+    ingest.ingestion_service.supabase_client = client
+    return client
+
+
+async def _serve_uvicorn(app, port: int):
+    """uvicorn en el mismo proceso y event loop (comparte el backend en memoria)"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn no está instalado: usar el transporte ASGI (por defecto) o --url")
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', lifespan='off'))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(args) -> Dict[str, Any]:
+    tables = generate_dataset(args.swimmers, args.competitions, args.registros, seed=args.seed)
+    ctx = DatasetContext(tables)
+    mix = parse_mix(args.mix)
+    headers = {'Cache-Control': 'no-cache'} if args.no_cache else {}
+    users_levels = [int(u) for u in args.users.split(',') if u.strip()]
+
+    server = server_task = None
+    if args.url:
+        mode = 'url'
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout,
+                                   limits=httpx.Limits(max_connections=max(users_levels)))
+    else:
+        install_offline_backend(OfflineStore(tables, latency_ms=args.latency_ms))
+        from main import app
+        if args.loop_block_ms:
+            from utils.loop_monitor import loop_monitor
+            loop_monitor.threshold = args.loop_block_ms / 1000
+        if args.uvicorn:
+            mode = 'uvicorn'
+            server, server_task = await _serve_uvicorn(app, args.port)
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout,
+                                       limits=httpx.Limits(max_connections=max(users_levels)))
+        else:
+            mode = 'asgi'
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://loadtest',
+                                       timeout=args.timeout)
+
+    report: Dict[str, Any] = {
+        'meta': {
+            'mode': mode,
+            'url': args.url,
+            'mix': dict(mix),
+            'best_times': args.best_times,
+            'duration_s': args.duration,
+            'think_ms': args.think_ms,
+            'latency_ms': args.latency_ms,
+            'cache': not args.no_cache,
+            'dataset': {'swimmers': args.swimmers, 'competitions': args.competitions,
+                        'registros': len(tables['registros'])},
+            'seed': args.seed,
+            'loop_block_ms': args.loop_block_ms,
+            'python': platform.python_version(),
+        },
+        'levels': []
+    }
+    try:
+        # Calentamiento: imports diferidos, clientes e índices fuera de la medición
+        await run_level(client, ctx, 1, min(1.0, args.duration), mix, args.best_times, headers, 0.0, args.seed)
+        if args.loop_block_ms and not args.url:
+            loop_monitor.reset()
+        previous = None
+        for users in users_levels:
+            level = await run_level(client, ctx, users, args.duration, mix, args.best_times, headers,
+                                    args.think_ms / 1000, args.seed)
+            # Más usuarios sin más throughput: el worker está saturado
+            level['saturated'] = bool(previous and users > previous['users']
+                                      and level['throughput_rps'] < previous['throughput_rps'] * 1.1)
+            report['levels'].append(level)
+            _log_level(level)
+            previous = level
+        if args.loop_block_ms and not args.url:
+            report['loop_blocks'] = {**loop_monitor.stats(), 'call_sites': loop_monitor.sites(limit=10)}
+            _log_loop_blocks(report['loop_blocks'])
+    finally:
+        await client.aclose()
+        if server is not None:
+            server.should_exit = True
+            await server_task
+    return report
+
+
+def _log_level(level: Dict[str, Any]) -> None:
+    latency, lag = level['latency_ms'], level['loop_lag_ms']
+    logger.info(
+        f"usuarios={level['users']:>4}  {level['throughput_rps']:>8.1f} req/s  "
+        f"p50={latency['p50']:>8.1f}ms p95={latency['p95']:>8.1f}ms p99={latency['p99']:>8.1f}ms  "
+        f"errores={level['error_rate']:.2%} rechazos={level['shed_rate']:.2%}  lag p99={lag['p99']:>7.1f}ms max={lag['max']:>7.1f}ms"
+        f"{'  SATURADO' if level['saturated'] else ''}"
+    )
+    for name, endpoint in level['endpoints'].items():
+        logger.info(
+            f"    {name:<22} {endpoint['requests']:>6} req  p50={endpoint['latency_ms']['p50']:>8.1f}ms "
+            f"p99={endpoint['latency_ms']['p99']:>8.1f}ms  {endpoint['statuses']}"
+        )
+
+
+def _log_loop_blocks(blocks: Dict[str, Any]) -> None:
+    logger.info(f"bloqueos del loop > {blocks['threshold_ms']:.0f}ms: {blocks['blocks']} "
+                f"({blocks['blocked_ms_total']:.0f}ms en total)")
+    for site in blocks['call_sites']:
+        logger.info(f"    {site['call_site']:<60} {site['count']:>6}x  total={site['total_blocked_ms']:>9.1f}ms "
+                    f"max={site['max_blocked_ms']:>7.1f}ms")
+
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    """'dashboard=0.8,coach=0.2' -> [('dashboard', 0.8), ('coach', 0.2)]"""
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Escenario desconocido: {name} ({', '.join(SCENARIOS)})")
+        mix.append((name, float(weight) if weight else 1.0))
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la aplicación unificada')
+    parser.add_argument('--users', default='1,10,50', help='Usuarios concurrentes por nivel, separados por coma')
+    parser.add_argument('--duration', type=float, default=10.0, help='Segundos por nivel')
+    parser.add_argument('--mix', default='dashboard=0.8,coach=0.2', help='Peso de cada escenario')
+    parser.add_argument('--best-times', type=int, default=4, help='Consultas best-times por sesión de dashboard')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='Pausa entre sesiones de cada usuario')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='Latencia simulada por llamada a BD')
+    parser.add_argument('--no-cache', action='store_true', help='Enviar Cache-Control: no-cache')
+    parser.add_argument('--swimmers', type=int, default=300)
+    parser.add_argument('--competitions', type=int, default=40)
+    parser.add_argument('--registros', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--uvicorn', action='store_true', help='Servir con uvicorn local en lugar de ASGITransport')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help='Servidor externo (sin backend en memoria)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Timeout por request (s)')
+    parser.add_argument('--output', help='Guardar el reporte JSON en esta ruta')
+    parser.add_argument('--loop-block-ms', type=float, default=0.0,
+                        help='Registrar bloqueos del event loop mayores a este umbral (ms) por punto de llamada')
+    parser.add_argument('--app-logs', action='store_true', help='Mantener los logs INFO de la aplicación')
+    args = parser.parse_args()
+    try:
+        parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    # Los módulos de la aplicación configuran logging al importarse: se reemplaza el formato
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    if not args.app_logs:
+        for name in ('main', 'query', 'ingest', 'preview', 'operations', 'httpx'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        # Los avisos de N+1 de query_tracing se repiten en cada request
+        logging.getLogger('utils').setLevel(logging.ERROR)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Reporte guardado en {args.output}")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
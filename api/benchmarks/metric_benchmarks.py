@@ -0,0 +1,428 @@
+"""
+Metric Benchmarks - AquaLytics API
+Micro-benchmarks del camino de carga interactiva: cálculo de métricas
+(SwimmingMetricsCalculator.calculate_metrics / calculate_batch), previsualización
+(DataPreviewService.calculate_preview_metrics) y validación
+(SwimmingDataValidator.validate_manual_metrics / validate_batch_columnar y
+_validate_consistency / CompiledSchema.consistency_masks). Mide ns por llamada y
+por registro en batch, memoria asignada por llamada, y comprueba que cada
+implementación batch coincide bit a bit con la escalar.
+
+Uso (desde api/):
+    python -m benchmarks.metric_benchmarks [--n 10000] [--batch-sizes 1,100,10000]
+        [--cases calculate_metrics,validate_manual_metrics] [--dirty-rate 0.1]
+        [--repeat 5] [--output reporte.json] [--compare reporte_anterior.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tracemalloc
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Callable
+
+os.environ.setdefault('SUPABASE_URL', 'http://offline')
+os.environ.setdefault('SUPABASE_ANON_KEY', 'offline')
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_manual_metrics
+from calculations.swimming_metrics import (
+    SwimmingMetricsCalculator, MetricCalculationInput, METRIC_DECIMALS
+)
+from preview import DataPreviewService
+from utils.data_validation import SwimmingDataValidator
+from utils.validation_schema import CONSISTENCY_FIELDS
+
+logger = logging.getLogger('metric_benchmarks')
+
+# Registros por llamada medidos con tracemalloc (la medición es ~10x más lenta)
+ALLOCATION_SAMPLE = 200
+# Diferencias que se listan por caso
+MAX_MISMATCHES = 5
+
+CASES = ['calculate_metrics', 'calculate_preview_metrics', 'validate_manual_metrics',
+         'validate_manual_metrics_frame', '_validate_consistency']
+
+
+@dataclass
+class MicroCase:
+    """
+    Función medida: versión escalar sobre `items` y, si existe, versión batch.
+
+    `to_batch` convierte una porción de `items` al formato de entrada de
+    `batch` (fuera de la medición) y `check` compara la salida escalar de
+    todos los items con la salida batch del conjunto completo.
+    """
+    name: str
+    items: List[Any]
+    scalar: Callable[[Any], Any]
+    batch: Optional[Callable[[Any], Any]] = None
+    to_batch: Optional[Callable[[List[Any]], Any]] = None
+    check: Optional[Callable[[List[Any], Any], List[str]]] = None
+
+
+# === Comparación bit a bit ===
+
+def _same_float(scalar: Optional[float], batch: float) -> bool:
+    """None de la versión escalar equivale a NaN; el resto, mismos bits (incluido el signo de 0.0)"""
+    if scalar is None:
+        return math.isnan(batch)
+    return not math.isnan(batch) and float(scalar).hex() == float(batch).hex()
+
+
+def _check_metrics(scalar_results: List[Any], batch_result: Dict[str, np.ndarray]) -> List[str]:
+    mismatches = []
+    for i, metrics in enumerate(scalar_results):
+        for name in METRIC_DECIMALS:
+            expected, got = getattr(metrics, name), float(batch_result[name][i])
+            if not _same_float(expected, got):
+                mismatches.append(f"[{i}] {name}: escalar={expected!r} batch={got!r}")
+    return mismatches
+
+
+def _check_validity(scalar_results: List[Any], batch_result) -> List[str]:
+    return [
+        f"[{i}] is_valid: escalar={result.is_valid} batch={bool(batch_result.valid_mask[i])} {result.errors}"
+        for i, result in enumerate(scalar_results)
+        if result.is_valid != bool(batch_result.valid_mask[i])
+    ]
+
+
+def _consistency_check(validator: SwimmingDataValidator, items: List[Dict[str, Any]]):
+    """Los mensajes escalares deben ser los de las reglas que marcan las máscaras, en el mismo orden"""
+    rules = validator.schema.rules
+
+    def check(scalar_results: List[List[str]], masks: Dict[str, np.ndarray]) -> List[str]:
+        mismatches = []
+        for i, (errors, data) in enumerate(zip(scalar_results, items)):
+            values = {name: data.get(name, 0) for name in CONSISTENCY_FIELDS}
+            expected = [rule.message(values, data['distance']) for rule in rules if masks[rule.name][i]]
+            if errors != expected:
+                mismatches.append(f"[{i}] escalar={errors} batch={expected}")
+        return mismatches
+    return check
+
+
+# === Casos ===
+
+def _calculation_input(record: Dict[str, Any]) -> MetricCalculationInput:
+    return MetricCalculationInput(**{
+        name: record.get(name) for name in MetricCalculationInput.__dataclass_fields__
+    })
+
+
+def _columns(records: List[Dict[str, Any]], fields: List[str]) -> Dict[str, np.ndarray]:
+    """Columnas float64 (NaN = campo ausente), el formato de entrada de los kernels batch"""
+    return {
+        name: np.array([np.nan if r.get(name) is None else r[name] for r in records], dtype=np.float64)
+        for name in fields
+    }
+
+
+def _preview_payload(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload de /preview/calculate para una prueba de dos tramos"""
+    length = record['distancia_total'] / 2
+    return {
+        'distancia_total': record['distancia_total'],
+        'manual_metrics': {
+            'tiempo_total': record['t_total'],
+            'brazadas_totales': record['brz_total'],
+            'segments': [
+                {'length': length, 'segment_time': record['t25_1'], 't15': record['t15_1'],
+                 'brazadas': record['brz_1'], 'f': record['f1']},
+                {'length': length, 'segment_time': record['t25_2'], 't15': record['t15_2'],
+                 'brazadas': record['brz_2'], 'f': record['f2']},
+            ]
+        }
+    }
+
+
+def _run_coroutine(coro) -> Any:
+    """Ejecuta una corrutina que no espera nada, sin el coste del event loop"""
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError('La corrutina se suspendió: requiere un event loop')
+
+
+def build_cases(n: int, seed: int = 42, dirty_rate: float = 0.1) -> Dict[str, MicroCase]:
+    """Casos sobre `n` registros sintéticos; el cálculo y la previsualización usan solo los válidos"""
+    records, _ = generate_manual_metrics(n, seed=seed, dirty_rate=dirty_rate)
+    validator = SwimmingDataValidator()
+    calculator = SwimmingMetricsCalculator()
+    preview = DataPreviewService()
+
+    valid = [r for r in records if validator.validate_manual_metrics(r).is_valid]
+    # Datos sanitizados de los registros con todos los campos válidos (la entrada de _validate_consistency)
+    sanitized = []
+    for record in records:
+        fields = {}
+        for name, validate in validator.schema.metric_validators.items():
+            if record.get(name) is not None:
+                value, error = validate(record[name])
+                if error:
+                    break
+                fields[name] = value
+        else:
+            sanitized.append(dict(fields, distance=record['distancia_total']))
+
+    calc_fields = list(MetricCalculationInput.__dataclass_fields__)
+    consistency = validator.schema
+
+    return {
+        'calculate_metrics': MicroCase(
+            name='calculate_metrics',
+            items=[_calculation_input(r) for r in valid],
+            scalar=calculator.calculate_metrics,
+            batch=calculator.calculate_batch,
+            to_batch=lambda items: _columns([vars(i) for i in items], calc_fields),
+            check=_check_metrics
+        ),
+        'calculate_preview_metrics': MicroCase(
+            name='calculate_preview_metrics',
+            items=[_preview_payload(r) for r in valid],
+            scalar=lambda payload: _run_coroutine(preview.calculate_preview_metrics(payload))
+        ),
+        'validate_manual_metrics': MicroCase(
+            name='validate_manual_metrics',
+            items=records,
+            scalar=validator.validate_manual_metrics,
+            # Misma entrada que la versión escalar: una lista de diccionarios
+            batch=validator.validate_batch_columnar,
+            to_batch=lambda items: items,
+            check=_check_validity
+        ),
+        'validate_manual_metrics_frame': MicroCase(
+            name='validate_manual_metrics_frame',
+            items=records,
+            scalar=validator.validate_manual_metrics,
+            # DataFrame: un None opcional sube la columna entera a float64 con NaN
+            batch=validator.validate_batch_columnar,
+            to_batch=pd.DataFrame,
+            check=_check_validity
+        ),
+        '_validate_consistency': MicroCase(
+            name='_validate_consistency',
+            items=sanitized,
+            scalar=validator._validate_consistency,
+            batch=lambda batch: consistency.consistency_masks(batch[0], batch[1]),
+            to_batch=lambda items: (
+                _columns(items, CONSISTENCY_FIELDS),
+                np.array([r['distance'] for r in items], dtype=np.float64)
+            ),
+            check=_consistency_check(validator, sanitized)
+        ),
+    }
+
+
+# === Medición ===
+
+def _time_scalar(fn: Callable[[Any], Any], items: List[Any], repeat: int) -> List[float]:
+    """ns por llamada de cada pasada completa sobre `items`"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for item in items:
+            fn(item)
+        timings.append((time.perf_counter_ns() - start) / len(items))
+    return timings
+
+
+def _allocations(fn: Callable[[Any], Any], items: List[Any]) -> Dict[str, float]:
+    """
+    Bytes asignados por llamada: pico transitorio (mediana) y retenido tras
+    la llamada (medio; distinto de cero si algo acumula estado entre llamadas).
+    """
+    peaks = []
+    tracemalloc.start()
+    try:
+        start_current, _ = tracemalloc.get_traced_memory()
+        for item in items:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            result = fn(item)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            del result
+        end_current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_bytes_per_call': statistics.median(peaks),
+        'retained_bytes_per_call': round((end_current - start_current) / len(items), 1)
+    }
+
+
+def _batch_peak(fn: Callable[[Any], Any], batch_input: Any) -> int:
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn(batch_input)
+        _, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def run_case(case: MicroCase, batch_sizes: List[int], repeat: int) -> Dict[str, Any]:
+    """Calentamiento, tiempos escalares y batch, memoria por llamada y equivalencia"""
+    items = case.items
+    scalar_results = [case.scalar(item) for item in items]
+
+    timings = _time_scalar(case.scalar, items, repeat)
+    result: Dict[str, Any] = {
+        'items': len(items),
+        'scalar': {
+            'ns_per_call': round(min(timings), 1),
+            'ns_per_call_median': round(statistics.median(timings), 1),
+            **_allocations(case.scalar, items[:ALLOCATION_SAMPLE])
+        },
+        'batch': None,
+        'equivalence': None
+    }
+    if case.batch is None:
+        return result
+
+    scalar_ns = result['scalar']['ns_per_call']
+    result['batch'] = {}
+    for size in batch_sizes:
+        size = min(size, len(items))
+        chunks = [case.to_batch(items[i:i + size]) for i in range(0, len(items) - size + 1, size)]
+        case.batch(chunks[0])
+        per_record = []
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for chunk in chunks:
+                case.batch(chunk)
+            per_record.append((time.perf_counter_ns() - start) / (len(chunks) * size))
+        ns_per_record = min(per_record)
+        peak = _batch_peak(case.batch, chunks[0])
+        result['batch'][str(size)] = {
+            'ns_per_record': round(ns_per_record, 1),
+            'speedup': round(scalar_ns / ns_per_record, 2) if ns_per_record else None,
+            'peak_bytes': peak,
+            'peak_bytes_per_record': round(peak / size, 1)
+        }
+
+    mismatches = case.check(scalar_results, case.batch(case.to_batch(items)))
+    result['equivalence'] = {
+        'checked': len(items),
+        'identical': not mismatches,
+        'mismatches': len(mismatches),
+        'examples': mismatches[:MAX_MISMATCHES]
+    }
+    return result
+
+
+def run_suite(n: int, batch_sizes: List[int], repeat: int = 5, seed: int = 42,
+              dirty_rate: float = 0.1, cases: Optional[List[str]] = None) -> Dict[str, Any]:
+    all_cases = build_cases(n, seed, dirty_rate)
+    report: Dict[str, Any] = {
+        'meta': {
+            'n': n,
+            'batch_sizes': batch_sizes,
+            'repeat': repeat,
+            'seed': seed,
+            'dirty_rate': dirty_rate,
+            'numpy': np.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {}
+    }
+    for name in cases or CASES:
+        result = run_case(all_cases[name], batch_sizes, repeat)
+        report['results'][name] = result
+        _log_case(name, result)
+    return report
+
+
+def _log_case(name: str, result: Dict[str, Any]) -> None:
+    scalar = result['scalar']
+    logger.info(
+        f"{name:<30} {result['items']:>6} items  escalar={scalar['ns_per_call']:>9.1f}ns/llamada  "
+        f"pico={scalar['peak_bytes_per_call']:>7.0f}B  retenido={scalar['retained_bytes_per_call']:>6.1f}B"
+    )
+    for size, batch in (result['batch'] or {}).items():
+        logger.info(
+            f"    batch {size:>6}  {batch['ns_per_record']:>9.1f}ns/registro  x{batch['speedup']:<7}  "
+            f"pico={batch['peak_bytes_per_record']:>8.1f}B/registro"
+        )
+    equivalence = result['equivalence']
+    if equivalence and not equivalence['identical']:
+        logger.error(f"    DIFERENCIAS batch/escalar: {equivalence['mismatches']}")
+        for example in equivalence['examples']:
+            logger.error(f"      {example}")
+
+
+def compare(report: Dict[str, Any], previous: Dict[str, Any]) -> List[str]:
+    """Cambio relativo de ns por llamada/registro respecto a otro reporte"""
+    lines = []
+    for name, result in report['results'].items():
+        old = previous.get('results', {}).get(name)
+        if old is None:
+            continue
+        change = result['scalar']['ns_per_call'] / old['scalar']['ns_per_call'] - 1
+        lines.append(f"{name:<30} escalar     ns/llamada {change:+7.1%}")
+        for size, batch in (result['batch'] or {}).items():
+            before = (old.get('batch') or {}).get(size)
+            if before:
+                change = batch['ns_per_record'] / before['ns_per_record'] - 1
+                lines.append(f"{name:<30} batch {size:>6} ns/registro {change:+7.1%}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de cálculo y validación de métricas')
+    parser.add_argument('--n', type=int, default=10_000, help='Registros sintéticos')
+    parser.add_argument('--batch-sizes', default='1,10,100,1000,10000', help='Tamaños de batch, separados por coma')
+    parser.add_argument('--cases', help='Casos separados por coma (default: todos)')
+    parser.add_argument('--dirty-rate', type=float, default=0.1, help='Fracción de registros defectuosos')
+    parser.add_argument('--repeat', type=int, default=5, help='Pasadas medidas (se reporta la mejor)')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--output', help='Guardar el reporte JSON en esta ruta')
+    parser.add_argument('--compare', help='Reporte anterior con el que comparar')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    # preview registra cada cálculo en INFO: el formateo se mide, la escritura no
+    for name in ('preview', 'calculations', 'utils'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    cases = [c.strip() for c in args.cases.split(',')] if args.cases else None
+    if cases and any(c not in CASES for c in cases):
+        parser.error(f"Casos disponibles: {', '.join(CASES)}")
+    batch_sizes = [int(s) for s in args.batch_sizes.split(',') if s.strip()]
+
+    report = run_suite(args.n, batch_sizes, args.repeat, args.seed, args.dirty_rate, cases)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+        logger.info(f"Reporte guardado en {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for line in compare(report, previous):
+            logger.info(line)
+
+    # Una implementación batch que no coincide con la escalar es un error
+    identical = all(
+        r['equivalence'] is None or r['equivalence']['identical'] for r in report['results'].values()
+    )
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
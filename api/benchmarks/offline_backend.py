@@ -0,0 +1,273 @@
+"""
+Offline Backend - AquaLytics API
+Imitación en memoria del subconjunto de supabase-py/postgrest que usa la API
+(select con relaciones embebidas, filtros, orden, paginación, insert y rpc),
+para ejecutar benchmarks sin red ni base de datos.
+"""
+
+import re
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Any, Tuple, Callable
+
+from utils.supabase_client import SupabaseClient
+
+# Relaciones embebibles: tabla -> relación -> (columna local, columna remota)
+FOREIGN_KEYS = {
+    'registros': {
+        'nadadores': ('id_nadador', 'id_nadador'),
+        'metricas': ('metrica_id', 'metrica_id'),
+        'pruebas': ('prueba_id', 'id'),
+        'competencias': ('competencia_id', 'competencia_id'),
+        'fases': ('fase_id', 'fase_id'),
+    },
+    'pruebas': {
+        'distancias': ('distancia_id', 'distancia_id'),
+        'estilos': ('estilo_id', 'estilo_id'),
+    },
+}
+PRIMARY_KEYS = {
+    'nadadores': 'id_nadador', 'registros': 'registro_id', 'competencias': 'competencia_id',
+    'pruebas': 'id', 'metricas': 'metrica_id', 'fases': 'fase_id',
+    'distancias': 'distancia_id', 'estilos': 'estilo_id',
+}
+
+_EMBED = re.compile(r'^(\w+)\((.*)\)$')
+
+
+def _split_columns(columns: str) -> List[str]:
+    """Separa 'a, b, rel(x, y)' respetando los paréntesis"""
+    out, depth, current = [], 0, ''
+    for ch in columns:
+        depth += (ch == '(') - (ch == ')')
+        if ch == ',' and depth == 0:
+            out.append(current.strip())
+            current = ''
+        else:
+            current += ch
+    if current.strip():
+        out.append(current.strip())
+    return out
+
+
+class OfflineStore:
+    """
+    Tablas en memoria (listas de dicts) con contador de llamadas.
+
+    `latency_ms` simula la latencia de red de cada llamada (bloqueante, como
+    el cliente síncrono real); `max_rows` reproduce el tope de filas por
+    respuesta de PostgREST (1000 en Supabase por defecto); `rpc_handlers`
+    define el resultado de cada RPC.
+    """
+
+    def __init__(self, tables: Optional[Dict[str, List[Dict[str, Any]]]] = None, latency_ms: float = 0.0,
+                 max_rows: Optional[int] = 1000,
+                 rpc_handlers: Optional[Dict[str, Callable[['OfflineStore', Dict[str, Any]], Any]]] = None):
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.latency_ms = latency_ms
+        self.max_rows = max_rows
+        self.rpc_handlers = rpc_handlers or {}
+        self.calls = 0
+        self._sequences: Dict[str, int] = {}
+        self._indexes: Dict[Tuple[str, str], Tuple[int, Dict[Any, Dict[str, Any]]]] = {}
+        self._groups: Dict[Tuple[str, str], Tuple[int, Dict[Any, List[Dict[str, Any]]]]] = {}
+
+    def next_id(self, table: str) -> int:
+        pk = PRIMARY_KEYS.get(table, 'id')
+        current = self._sequences.get(table)
+        if current is None:
+            current = max((row.get(pk) or 0 for row in self.tables.get(table, [])), default=0)
+        self._sequences[table] = current + 1
+        return current + 1
+
+    def index(self, table: str, key: str) -> Dict[Any, Dict[str, Any]]:
+        """Índice por columna para las relaciones embebidas (se reconstruye si la tabla crece)"""
+        rows = self.tables.get(table, [])
+        cached = self._indexes.get((table, key))
+        if cached is None or cached[0] != len(rows):
+            cached = (len(rows), {row.get(key): row for row in rows})
+            self._indexes[(table, key)] = cached
+        return cached[1]
+
+    def group(self, table: str, column: str) -> Dict[Any, List[Dict[str, Any]]]:
+        """Filas agrupadas por valor (en orden de inserción), como un índice de la BD para los filtros eq"""
+        rows = self.tables.get(table, [])
+        cached = self._groups.get((table, column))
+        if cached is None or cached[0] != len(rows):
+            groups: Dict[Any, List[Dict[str, Any]]] = {}
+            for row in rows:
+                groups.setdefault(row.get(column), []).append(row)
+            cached = (len(rows), groups)
+            self._groups[(table, column)] = cached
+        return cached[1]
+
+    def project(self, table: str, row: Dict[str, Any], columns: str) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for column in _split_columns(columns):
+            embed = _EMBED.match(column)
+            if embed:
+                relation, sub_columns = embed.groups()
+                fk = FOREIGN_KEYS.get(table, {}).get(relation)
+                if fk is None:
+                    continue
+                local, remote = fk
+                target = self.index(relation, remote).get(row.get(local))
+                out[relation] = self.project(relation, target, sub_columns) if target else None
+            elif column == '*':
+                out.update(row)
+            else:
+                out[column] = row.get(column)
+        return out
+
+    def _call(self) -> None:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+
+def _compare(op: str, value: Any, target: Any) -> bool:
+    if value is None:
+        return False
+    if isinstance(value, str) or isinstance(target, str):
+        value, target = str(value), str(target)
+    return {
+        'gt': value > target, 'gte': value >= target,
+        'lt': value < target, 'lte': value <= target,
+    }[op]
+
+
+class OfflineQuery:
+    """Builder encadenable con la API de postgrest"""
+
+    def __init__(self, store: OfflineStore, table: str):
+        self.store = store
+        self.table = table
+        self.columns = '*'
+        self.count_mode: Optional[str] = None
+        self.payload: Optional[Any] = None
+        self.filters: List[Tuple[str, str, Any]] = []
+        self.orders: List[Tuple[str, bool]] = []
+        self._limit: Optional[int] = None
+        self._range: Optional[Tuple[int, int]] = None
+
+    def select(self, columns: str = '*', count: Optional[str] = None) -> 'OfflineQuery':
+        self.columns, self.count_mode = columns, count
+        return self
+
+    def insert(self, data: Any, **kwargs) -> 'OfflineQuery':
+        self.payload = data
+        return self
+
+    upsert = insert
+
+    def _filter(self, op: str, column: str, value: Any) -> 'OfflineQuery':
+        self.filters.append((op, column, value))
+        return self
+
+    def eq(self, column, value): return self._filter('eq', column, value)
+    def neq(self, column, value): return self._filter('neq', column, value)
+    def gt(self, column, value): return self._filter('gt', column, value)
+    def gte(self, column, value): return self._filter('gte', column, value)
+    def lt(self, column, value): return self._filter('lt', column, value)
+    def lte(self, column, value): return self._filter('lte', column, value)
+    def in_(self, column, values): return self._filter('in', column, set(values))
+
+    def order(self, column: str, desc: bool = False) -> 'OfflineQuery':
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int) -> 'OfflineQuery':
+        self._limit = n
+        return self
+
+    def range(self, start: int, end: int) -> 'OfflineQuery':
+        self._range = (start, end)
+        return self
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        for op, column, target in self.filters:
+            value = row.get(column)
+            if op == 'eq':
+                if value != target and str(value) != str(target):
+                    return False
+            elif op == 'neq':
+                if value == target:
+                    return False
+            elif op == 'in':
+                if value not in target:
+                    return False
+            elif self.table == 'competencias' and column == 'periodo':
+                # Rangos de fechas de PostgreSQL: sin semántica de rango en memoria
+                continue
+            elif not _compare(op, value, target):
+                return False
+        return True
+
+    def _candidates(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filas a evaluar: el grupo más pequeño de los filtros eq con valor entero"""
+        best = rows
+        for op, column, target in self.filters:
+            if op == 'eq' and isinstance(target, int) and len(rows) > 1000:
+                bucket = self.store.group(self.table, column).get(target, [])
+                if len(bucket) < len(best):
+                    best = bucket
+        return best
+
+    def execute(self) -> SimpleNamespace:
+        self.store._call()
+        rows = self.store.tables.setdefault(self.table, [])
+        if self.payload is not None:
+            data = self.payload if isinstance(self.payload, list) else [self.payload]
+            pk = PRIMARY_KEYS.get(self.table, 'id')
+            inserted = []
+            for item in data:
+                item = dict(item)
+                item.setdefault(pk, self.store.next_id(self.table))
+                rows.append(item)
+                inserted.append(item)
+            return SimpleNamespace(data=inserted, count=None)
+
+        result = [row for row in self._candidates(rows) if self._matches(row)] if self.filters else list(rows)
+        for column, desc in reversed(self.orders):
+            result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        total = len(result)
+        if self._range:
+            result = result[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            result = result[:self._limit]
+        if self.store.max_rows is not None:
+            result = result[:self.store.max_rows]
+        return SimpleNamespace(
+            data=[self.store.project(self.table, row, self.columns) for row in result],
+            count=total if self.count_mode else None
+        )
+
+
+class OfflineRPC:
+    def __init__(self, store: OfflineStore, name: str, params: Dict[str, Any]):
+        self.store, self.name, self.params = store, name, params
+
+    def execute(self) -> SimpleNamespace:
+        self.store._call()
+        handler = self.store.rpc_handlers.get(self.name)
+        return SimpleNamespace(data=handler(self.store, self.params) if handler else None, count=None)
+
+
+class OfflineClient:
+    """Sustituto de supabase.Client sobre un OfflineStore"""
+
+    def __init__(self, store: OfflineStore):
+        self.store = store
+
+    def table(self, name: str) -> OfflineQuery:
+        return OfflineQuery(self.store, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None, *args, **kwargs) -> OfflineRPC:
+        return OfflineRPC(self.store, name, params or {})
+
+
+def offline_supabase_client(store: OfflineStore) -> SupabaseClient:
+    """SupabaseClient real (caché de ids e instrumentación) sobre el backend en memoria"""
+    return SupabaseClient(client=OfflineClient(store))
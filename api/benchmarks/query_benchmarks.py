@@ -0,0 +1,340 @@
+"""
+Query Benchmarks - AquaLytics API
+Suite de rendimiento de la capa de consultas (DataQueryService) sobre datasets
+sintéticos de varios tamaños y el backend en memoria: latencia (p50/p95/p99),
+llamadas a BD, filas leídas y pico de memoria por consulta, con comparación
+contra un baseline guardado.
+
+Uso (desde api/):
+    python -m benchmarks.query_benchmarks [--sizes small,medium] [--repeat 20]
+        [--backend db|columnar|leaderboard] [--output report.json]
+        [--save-baseline | --check] [--baseline ruta.json] [--threshold 0.25]
+        [--fail-on-latency]
+
+`--check` solo falla por métricas deterministas (llamadas a BD, filas leídas,
+éxito); latencia y memoria dependen de la máquina y se reportan como avisos.
+Con `--fail-on-latency` también fallan: solo tiene sentido con un baseline
+generado en el mismo host (en CI, regenerarlo en el runner de CI).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Callable, Awaitable
+
+os.environ.setdefault('SUPABASE_URL', 'http://offline')
+os.environ.setdefault('SUPABASE_ANON_KEY', 'offline')
+
+from benchmarks.offline_backend import OfflineStore, offline_supabase_client
+from benchmarks.stats import percentile
+from benchmarks.synthetic_data import generate_dataset
+from operations import DataQueryService
+from utils.instrumentation import QueryEvent, add_query_observer
+
+logger = logging.getLogger('query_benchmarks')
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+@dataclass(frozen=True)
+class DatasetSize:
+    """Tamaño de un dataset sintético"""
+    name: str
+    swimmers: int
+    competitions: int
+    registros: int
+
+
+SIZES = {
+    'small': DatasetSize('small', 50, 10, 10_000),
+    'medium': DatasetSize('medium', 300, 40, 100_000),
+    'large': DatasetSize('large', 1500, 120, 500_000),
+}
+
+QueryFn = Callable[[DataQueryService], Awaitable[Dict[str, Any]]]
+
+# Consultas del dashboard
+QUERIES: Dict[str, QueryFn] = {
+    'rankings': lambda service: service.get_rankings(10),
+    'best_times': lambda service: service.get_best_times('Crol', 100, 'largo'),
+    'styles_distribution': lambda service: service.get_styles_distribution(),
+    'performance_progress': lambda service: service.get_performance_progress(30),
+}
+
+# Variables de entorno que activan cada backend de lectura
+BACKENDS = {
+    'db': {},
+    'columnar': {'AQUALYTICS_COLUMNAR': '1'},
+    'leaderboard': {'AQUALYTICS_LEADERBOARD': '1'},
+}
+
+
+@dataclass
+class QueryResult:
+    """Resultado de una consulta en un tamaño de dataset"""
+    size: str
+    query: str
+    success: bool
+    runs: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    min_ms: float
+    db_calls: int
+    db_rows: int
+    peak_kb: float
+    result_items: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.size}/{self.query}"
+
+
+class _DBCallCounter:
+    """Cuenta las consultas a BD y filas devueltas (observador de instrumentation)"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+
+    def __call__(self, event: QueryEvent) -> None:
+        self.calls += 1
+        self.rows += event.rows
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.rows = 0
+
+
+_counter = _DBCallCounter()
+add_query_observer(_counter)
+
+
+def _prepare_backend(backend: str, client) -> Optional[float]:
+    """Construye el índice o almacén en memoria del backend (ms), fuera de las mediciones"""
+    start = time.perf_counter()
+    if backend == 'columnar':
+        from utils.columnar_store import registros_store
+        registros_store.reload(client)
+    elif backend == 'leaderboard':
+        from utils.leaderboard import leaderboard_index
+        leaderboard_index.rebuild(client)
+    else:
+        return None
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def run_query(loop: asyncio.AbstractEventLoop, service: DataQueryService, size: str, name: str,
+              query: QueryFn, repeat: int) -> QueryResult:
+    """Calentamiento, `repeat` ejecuciones medidas y una ejecución con tracemalloc"""
+    response = loop.run_until_complete(query(service))
+
+    timings, calls, rows = [], 0, 0
+    for _ in range(repeat):
+        _counter.reset()
+        start = time.perf_counter()
+        loop.run_until_complete(query(service))
+        timings.append((time.perf_counter() - start) * 1000)
+        calls, rows = max(calls, _counter.calls), max(rows, _counter.rows)
+
+    tracemalloc.start()
+    try:
+        loop.run_until_complete(query(service))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    data = response.get('data')
+    return QueryResult(
+        size=size,
+        query=name,
+        success=bool(response.get('success')),
+        runs=repeat,
+        p50_ms=round(percentile(timings, 50), 3),
+        p95_ms=round(percentile(timings, 95), 3),
+        p99_ms=round(percentile(timings, 99), 3),
+        mean_ms=round(sum(timings) / len(timings), 3),
+        min_ms=round(timings[0], 3),
+        db_calls=calls,
+        db_rows=rows,
+        peak_kb=round(peak / 1024, 1),
+        result_items=len(data) if isinstance(data, list) else 0
+    )
+
+
+def run_suite(sizes: List[str], backend: str = 'db', repeat: int = 20, seed: int = 42,
+              latency_ms: float = 0.0, queries: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Ejecuta todas las consultas en cada tamaño; devuelve el reporte completo"""
+    for env_name in {name for env in BACKENDS.values() for name in env}:
+        os.environ.pop(env_name, None)
+    os.environ.update(BACKENDS[backend])
+
+    loop = asyncio.new_event_loop()
+    report: Dict[str, Any] = {
+        'meta': {
+            'backend': backend,
+            'repeat': repeat,
+            'seed': seed,
+            'latency_ms': latency_ms,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'datasets': {},
+        'results': {}
+    }
+    try:
+        for size_name in sizes:
+            size = SIZES[size_name]
+            start = time.perf_counter()
+            tables = generate_dataset(size.swimmers, size.competitions, size.registros, seed=seed)
+            generate_ms = round((time.perf_counter() - start) * 1000, 2)
+            client = offline_supabase_client(OfflineStore(tables, latency_ms=latency_ms))
+            service = DataQueryService(supabase_client=client)
+            report['datasets'][size_name] = {
+                **asdict(size),
+                'rows': len(tables['registros']),
+                'generate_ms': generate_ms,
+                'backend_setup_ms': _prepare_backend(backend, client)
+            }
+            for name in queries or list(QUERIES):
+                result = run_query(loop, service, size_name, name, QUERIES[name], repeat)
+                report['results'][result.key] = asdict(result)
+                logger.info(
+                    f"{result.key:<32} p50={result.p50_ms:>9.3f}ms p95={result.p95_ms:>9.3f}ms "
+                    f"db={result.db_calls:>3} filas={result.db_rows:>7} pico={result.peak_kb:>9.1f}KB"
+                    f"{'' if result.success else '  ERROR'}"
+                )
+    finally:
+        loop.close()
+    return report
+
+
+# === Baseline ===
+
+# Métricas que no dependen de la máquina: una regresión en ellas siempre falla
+DETERMINISTIC_METRICS = ('db_calls', 'db_rows', 'success')
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.25,
+            min_delta_ms: float = 1.0) -> List[Dict[str, Any]]:
+    """
+    Regresiones respecto al baseline; `deterministic` indica si la métrica
+    es reproducible en cualquier máquina.
+
+    Latencia: p50 más de `threshold` por encima y al menos `min_delta_ms` (para
+    no saltar con consultas de microsegundos). Memoria: pico más de `threshold`
+    por encima y al menos 64KB. Llamadas a BD y filas leídas: cualquier aumento.
+    """
+    regressions = []
+    for key, current in report['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if base is None:
+            continue
+        checks = [
+            ('p50_ms', current['p50_ms'] > base['p50_ms'] * (1 + threshold)
+             and current['p50_ms'] - base['p50_ms'] >= min_delta_ms),
+            ('peak_kb', current['peak_kb'] > base['peak_kb'] * (1 + threshold)
+             and current['peak_kb'] - base['peak_kb'] >= 64),
+            ('db_calls', current['db_calls'] > base['db_calls']),
+            ('db_rows', current['db_rows'] > base['db_rows']),
+            ('success', base['success'] and not current['success']),
+        ]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append({
+                    'key': key,
+                    'metric': metric,
+                    'baseline': base[metric],
+                    'current': current[metric],
+                    'deterministic': metric in DETERMINISTIC_METRICS
+                })
+    return regressions
+
+
+def default_baseline_path(backend: str) -> str:
+    return os.path.join(BASELINE_DIR, f"query_{backend}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks de la capa de consultas con datos sintéticos')
+    parser.add_argument('--sizes', default='small,medium', help=f"Tamaños separados por coma ({', '.join(SIZES)})")
+    parser.add_argument('--queries', help=f"Consultas separadas por coma (default: todas; {', '.join(QUERIES)})")
+    parser.add_argument('--backend', choices=list(BACKENDS), default='db', help='Backend de lectura')
+    parser.add_argument('--repeat', type=int, default=20, help='Ejecuciones medidas por consulta')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Latencia simulada por llamada a BD')
+    parser.add_argument('--output', help='Guardar el reporte JSON en esta ruta')
+    parser.add_argument('--baseline', help='Ruta del baseline (default: benchmarks/baselines/query_<backend>.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='Guardar el reporte como baseline')
+    parser.add_argument('--check', action='store_true', help='Comparar con el baseline y fallar si hay regresiones')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Regresión relativa tolerada (default: 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='Regresión absoluta mínima de p50 (ms)')
+    parser.add_argument('--fail-on-latency', action='store_true',
+                        help='Fallar también por latencia y memoria (baseline generado en este mismo host)')
+    args = parser.parse_args()
+
+    # operations configura logging al importarse: se reemplaza el formato
+    logging.basicConfig(level=logging.INFO, format='%(message)s', force=True)
+    # Los logs INFO de los servicios distorsionan las mediciones
+    for name in ('operations', 'utils'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    sizes = [s.strip() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"Tamaños desconocidos: {', '.join(unknown)}")
+    queries = [q.strip() for q in args.queries.split(',')] if args.queries else None
+    if queries and any(q not in QUERIES for q in queries):
+        parser.error(f"Consultas disponibles: {', '.join(QUERIES)}")
+
+    report = run_suite(sizes, args.backend, args.repeat, args.seed, args.latency_ms, queries)
+    baseline_path = args.baseline or default_baseline_path(args.backend)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Reporte guardado en {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Baseline guardado en {baseline_path}")
+
+    exit_code = 0 if all(r['success'] for r in report['results'].values()) else 1
+    if args.check:
+        if not os.path.exists(baseline_path):
+            logger.error(f"No existe el baseline {baseline_path} (generarlo con --save-baseline)")
+            sys.exit(2)
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        base_meta = baseline.get('meta', {})
+        if (base_meta.get('machine'), base_meta.get('python')) != (report['meta']['machine'], report['meta']['python']):
+            logger.warning(f"Baseline de otra máquina ({base_meta.get('machine')}, Python {base_meta.get('python')}): "
+                           f"las latencias no son comparables")
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        failures = [r for r in regressions if r['deterministic'] or args.fail_on_latency]
+        for r in regressions:
+            log = logger.error if r in failures else logger.warning
+            log(f"{'REGRESIÓN' if r in failures else 'AVISO'} {r['key']} {r['metric']}: "
+                f"{r['baseline']} -> {r['current']}")
+        if failures:
+            exit_code = 1
+        else:
+            logger.info(f"Sin regresiones deterministas respecto a {baseline_path} "
+                        f"({len(regressions)} avisos de latencia/memoria, umbral {args.threshold:.0%})")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Stats - AquaLytics API
+Percentiles y resúmenes de latencia compartidos por las suites de benchmarks.
+"""
+
+from typing import Dict, List, Iterable
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por rango más cercano (`sorted_values` ya ordenado)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values: Iterable[float], digits: int = 3) -> Dict[str, float]:
+    """p50/p95/p99, media y máximo de una lista de valores"""
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+    return {
+        'count': len(ordered),
+        'p50': round(percentile(ordered, 50), digits),
+        'p95': round(percentile(ordered, 95), digits),
+        'p99': round(percentile(ordered, 99), digits),
+        'mean': round(sum(ordered) / len(ordered), digits),
+        'max': round(ordered[-1], digits),
+    }
@@ -0,0 +1,379 @@
+"""
+Synthetic Data - AquaLytics API
+Generador determinista de datasets sintéticos con el esquema de Phoenixdb:
+nadadores con nivel individual, competencias repartidas en el año y pruebas
+completas (10 métricas manuales + automáticas) con distribuciones realistas
+por estilo y distancia.
+"""
+
+import math
+import random
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+
+DISTANCIAS = [25, 50, 100, 200, 400, 800, 1500]
+ESTILOS = ['Crol', 'Dorso', 'Pecho', 'Mariposa', 'Combinado']
+FASES = ['Entrenamiento', 'Competencia', 'Prueba']
+CURSOS = ['largo', 'corto']
+
+# Tabla 'metricas' (ids y tipos como en las migraciones 002/003/006)
+METRICAS = [
+    (1, 'Tiempo 15m', 'M', False),
+    (2, 'Brazadas por Tramo', 'M', False),
+    (3, 'Tiempo por Tramo', 'M', False),
+    (4, 'Flecha por Tramo', 'M', False),
+    (9, 'Tiempo Total', 'M', True),
+    (10, 'Brazadas Totales', 'M', True),
+    (11, 'V1', 'A', False),
+    (12, 'V2', 'A', False),
+    (13, 'Velocidad Promedio', 'A', True),
+    (14, 'Distancia por Brazada', 'A', True),
+    (15, 'Distancia sin Flecha', 'A', True),
+    (16, 'F promedio', 'A', True),
+]
+
+# Ritmo base (s/100m) de un nadador medio y longitud de brazada típica (m)
+RITMO_BASE = {'Crol': 68.0, 'Dorso': 76.0, 'Pecho': 86.0, 'Mariposa': 74.0, 'Combinado': 80.0}
+BRAZADA_BASE = {'Crol': 1.9, 'Dorso': 1.8, 'Pecho': 1.5, 'Mariposa': 1.7, 'Combinado': 1.7}
+
+# Frecuencia relativa de cada estilo y distancia en los registros
+PESO_ESTILO = {'Crol': 0.45, 'Dorso': 0.15, 'Pecho': 0.17, 'Mariposa': 0.13, 'Combinado': 0.10}
+PESO_DISTANCIA = {25: 0.12, 50: 0.30, 100: 0.28, 200: 0.16, 400: 0.08, 800: 0.04, 1500: 0.02}
+
+# Pérdida de ritmo con la distancia (t ~ d^k)
+EXPONENTE_FATIGA = 1.07
+
+# Filas manuales y automáticas de una prueba completa
+ROWS_PER_TEST = 10 + 6
+
+
+def _pruebas() -> List[Dict[str, Any]]:
+    """Pruebas válidas: Combinado solo desde 100m (200m en largo)"""
+    pruebas, prueba_id = [], 1
+    for d_idx, distancia in enumerate(DISTANCIAS):
+        for e_idx, estilo in enumerate(ESTILOS):
+            for curso in CURSOS:
+                if estilo == 'Combinado' and distancia < (200 if curso == 'largo' else 100):
+                    continue
+                if estilo not in ('Crol', 'Combinado') and distancia > 200:
+                    continue
+                pruebas.append({
+                    'id': prueba_id,
+                    'nombre': f"{distancia}m {estilo} ({curso})",
+                    'distancia_id': d_idx + 1,
+                    'estilo_id': e_idx + 1,
+                    'curso': curso
+                })
+                prueba_id += 1
+    return pruebas
+
+
+def generate_dataset(n_swimmers: int, n_competitions: int, n_registros: int, seed: int = 42,
+                     anchor_date: Optional[date] = None, days: int = 365) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Tablas de Phoenixdb con aproximadamente `n_registros` filas en `registros`.
+
+    Misma semilla y fecha ancla producen exactamente el mismo dataset. Las
+    fechas caen en los `days` días anteriores a `anchor_date` (hoy por
+    defecto, para que los filtros relativos a la fecha actual encuentren datos).
+    """
+    rnd = random.Random(seed)
+    anchor = anchor_date or date.today()
+    start = anchor - timedelta(days=days - 1)
+
+    tables: Dict[str, List[Dict[str, Any]]] = {
+        'distancias': [{'distancia_id': i + 1, 'distancia': d} for i, d in enumerate(DISTANCIAS)],
+        'estilos': [{'estilo_id': i + 1, 'nombre': e} for i, e in enumerate(ESTILOS)],
+        'fases': [{'fase_id': i + 1, 'nombre': f} for i, f in enumerate(FASES)],
+        'metricas': [{'metrica_id': i, 'nombre': n, 'tipo': t, 'global': g} for i, n, t, g in METRICAS],
+        'pruebas': _pruebas(),
+    }
+
+    # Nadadores: nivel lognormal (1.0 = nadador medio) y estilo preferido
+    swimmers = []
+    for i in range(n_swimmers):
+        swimmers.append({
+            'id_nadador': i + 1,
+            'nombre': f"Nadador {i + 1:05d}",
+            'edad': rnd.randint(12, 24),
+            'peso': rnd.randint(40, 85),
+        })
+    skill = [math.exp(rnd.gauss(0.0, 0.08)) for _ in swimmers]
+    favorite = [rnd.choices(ESTILOS, weights=[PESO_ESTILO[e] for e in ESTILOS])[0] for _ in swimmers]
+    tables['nadadores'] = swimmers
+
+    # Competencias de 3 días repartidas en el periodo
+    competitions = []
+    for i in range(n_competitions):
+        first = start + timedelta(days=rnd.randrange(max(days - 3, 1)))
+        competitions.append({
+            'competencia_id': i + 1,
+            'competencia': f"Copa {i + 1:04d}",
+            'periodo': f"[{first.isoformat()},{(first + timedelta(days=3)).isoformat()})",
+            '_first': first
+        })
+
+    by_event = {(p['distancia_id'], p['estilo_id'], p['curso']): p['id'] for p in tables['pruebas']}
+    valid_events = list(by_event)
+    event_weights = [
+        PESO_DISTANCIA[DISTANCIAS[d - 1]] * PESO_ESTILO[ESTILOS[e - 1]] for d, e, _ in valid_events
+    ]
+    metric_ids = {name: metrica_id for metrica_id, name, _, _ in METRICAS}
+
+    registros: List[Dict[str, Any]] = []
+    n_tests = max(1, n_registros // ROWS_PER_TEST)
+    for _ in range(n_tests):
+        s = rnd.randrange(n_swimmers)
+        if rnd.random() < 0.35:
+            d_id, e_id, curso = valid_events[rnd.choices(range(len(valid_events)), weights=event_weights)[0]]
+        else:
+            # La mayoría de las pruebas son del estilo preferido del nadador
+            e_id = ESTILOS.index(favorite[s]) + 1
+            candidates = [k for k in valid_events if k[1] == e_id]
+            d_id, _, curso = rnd.choices(
+                candidates, weights=[PESO_DISTANCIA[DISTANCIAS[k[0] - 1]] for k in candidates]
+            )[0]
+
+        if competitions and rnd.random() < 0.4:
+            competition = rnd.choice(competitions)
+            fecha = competition['_first'] + timedelta(days=rnd.randrange(3))
+            competencia_id, fase_id = competition['competencia_id'], 2
+        else:
+            fecha = start + timedelta(days=rnd.randrange(days))
+            competencia_id, fase_id = None, rnd.choice((1, 3))
+        if fecha > anchor:
+            fecha = anchor
+
+        values = _test_values(rnd, DISTANCIAS[d_id - 1], ESTILOS[e_id - 1], curso, skill[s],
+                              (fecha - start).days / days)
+        base = {
+            'id_nadador': s + 1,
+            'prueba_id': by_event[(d_id, e_id, curso)],
+            'competencia_id': competencia_id,
+            'fecha': fecha.isoformat(),
+            'fase_id': fase_id,
+        }
+        for name, segmento, valor in values:
+            registros.append({**base, 'metrica_id': metric_ids[name], 'valor': valor, 'segmento': segmento})
+
+    for i, row in enumerate(registros):
+        row['registro_id'] = i + 1
+        row['created_at'] = None
+    for competition in competitions:
+        del competition['_first']
+    tables['competencias'] = competitions
+    tables['registros'] = registros
+    return tables
+
+
+def _test_values(rnd: random.Random, distancia: int, estilo: str, curso: str, skill: float,
+                 season: float) -> List[Tuple[str, Optional[int], float]]:
+    """Métricas manuales y automáticas de una prueba, coherentes entre sí"""
+    # Piscina corta algo más rápida (más virajes); mejora leve a lo largo de la temporada
+    course_factor = 0.975 if curso == 'corto' else 1.0
+    form = 1.0 - 0.02 * season + rnd.gauss(0.0, 0.015)
+    t_total = RITMO_BASE[estilo] * (distancia / 100) ** EXPONENTE_FATIGA * skill * course_factor * form
+    t_total = round(t_total, 2)
+
+    # Tramos: la mitad de la prueba cada uno, el primero algo más rápido
+    half = t_total / 2
+    t25_1 = round(half * rnd.uniform(0.95, 0.99), 2)
+    # Con margen de una centésima: t25_1 + t25_2 no supera t_total tras el redondeo
+    t25_2 = round(min(half * rnd.uniform(1.0, 1.04), t_total - t25_1 - 0.01), 2)
+    t15_1 = round(t25_1 * min(15 / (distancia / 2), 1.0) * rnd.uniform(0.82, 0.9), 2)
+    t15_2 = round(t25_2 * min(15 / (distancia / 2), 1.0) * rnd.uniform(0.85, 0.93), 2)
+
+    f1 = round(min(rnd.uniform(6.0, 12.0), distancia / 4), 1)
+    f2 = round(min(rnd.uniform(4.0, 9.0), distancia / 4), 1)
+    stroke = BRAZADA_BASE[estilo] / skill * rnd.uniform(0.93, 1.07)
+    brz_1 = max(1, round((distancia / 2 - f1) / stroke))
+    brz_2 = max(1, round((distancia / 2 - f2) / (stroke * 0.97)))
+    brz_total = brz_1 + brz_2
+
+    manual = [
+        ('Tiempo 15m', 1, t15_1), ('Tiempo 15m', 2, t15_2),
+        ('Brazadas por Tramo', 1, float(brz_1)), ('Brazadas por Tramo', 2, float(brz_2)),
+        ('Tiempo por Tramo', 1, t25_1), ('Tiempo por Tramo', 2, t25_2),
+        ('Flecha por Tramo', 1, f1), ('Flecha por Tramo', 2, f2),
+        ('Tiempo Total', None, t_total), ('Brazadas Totales', None, float(brz_total)),
+    ]
+    # Automáticas como las guarda la ingesta (mismo redondeo que SwimmingMetricsCalculator)
+    automatic = [
+        ('V1', 1, round((distancia / 2) / t25_1, 3)),
+        ('V2', 2, round((distancia / 2) / t25_2, 3)),
+        ('Velocidad Promedio', None, round(distancia / t_total, 3)),
+        ('Distancia por Brazada', None, round(distancia / brz_total, 2)),
+        ('Distancia sin Flecha', None, round(distancia - (f1 + f2), 1)),
+        ('F promedio', None, round((f1 + f2) / 2, 2)),
+    ]
+    return manual + automatic
+
+
+def describe(tables: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+    """Filas por tabla"""
+    return {name: len(rows) for name, rows in sorted(tables.items())}
+
+
+# === CSV de carga masiva ===
+
+NOMBRES = ['José', 'María', 'Sofía', 'Martín', 'Lucía', 'Andrés', 'Valentina', 'Sebastián', 'Camila', 'Nicolás']
+APELLIDOS = ['Núñez', 'Pérez', 'Gómez', 'Rodríguez', 'Fernández', 'López', 'Martínez', 'Díaz', 'Sánchez', 'Muñoz']
+
+# Columnas del CSV en el orden de la plantilla (nombres estándar de CSVProcessor.column_mappings)
+CSV_COLUMNS = [
+    'fecha', 'nombre', 'competencia', 'fase', 'estilo', 'distancia',
+    't15_1', 'brz_1', 't25_1', 'f1', 't15_2', 'brz_2', 't25_2', 'f2', 't_total', 'brz_total'
+]
+_CSV_FIELDS = {
+    ('Tiempo 15m', 1): 't15_1', ('Brazadas por Tramo', 1): 'brz_1', ('Tiempo por Tramo', 1): 't25_1',
+    ('Flecha por Tramo', 1): 'f1', ('Tiempo 15m', 2): 't15_2', ('Brazadas por Tramo', 2): 'brz_2',
+    ('Tiempo por Tramo', 2): 't25_2', ('Flecha por Tramo', 2): 'f2',
+    ('Tiempo Total', None): 't_total', ('Brazadas Totales', None): 'brz_total',
+}
+
+# Tipos de suciedad que se inyectan en las filas
+DIRT_KINDS = ['out_of_range', 'missing', 'bad_date', 'non_integer', 'unknown_swimmer', 'inconsistent']
+
+
+def _swimmer_names(n: int, rnd: random.Random) -> List[str]:
+    combos = [f"{n1} {a1} {a2}" for n1 in NOMBRES for a1 in APELLIDOS for a2 in APELLIDOS]
+    rnd.shuffle(combos)
+    return [combos[i % len(combos)] + (f" {i // len(combos) + 1}" if i >= len(combos) else '') for i in range(n)]
+
+
+def generate_csv(n_rows: int, seed: int = 42, n_swimmers: int = 200, n_competitions: int = 20,
+                 encoding: str = 'utf-8', delimiter: str = ',', aliases: Optional[Dict[str, List[str]]] = None,
+                 dirty_rate: float = 0.0) -> Tuple[bytes, Dict[str, List[Dict[str, Any]]], Dict[str, int]]:
+    """
+    CSV de carga masiva (una prueba de 50/100/200m por fila) y las tablas de referencia.
+
+    `aliases` son las variantes de CSVProcessor.column_mappings: cada columna
+    usa una al azar (con mayúsculas mezcladas). Una fracción `dirty_rate` de
+    las filas lleva un defecto de DIRT_KINDS; el tercer valor devuelto cuenta
+    las filas por tipo de defecto.
+    """
+    rnd = random.Random(seed)
+    anchor = date(2025, 6, 30)
+    names = _swimmer_names(n_swimmers, rnd)
+    skill = [math.exp(rnd.gauss(0.0, 0.08)) for _ in names]
+    competitions = [f"Copa {rnd.choice(APELLIDOS)} {2024 + i % 2} #{i + 1}" for i in range(n_competitions)]
+    tables: Dict[str, List[Dict[str, Any]]] = {
+        'nadadores': [{'id_nadador': i + 1, 'nombre': name} for i, name in enumerate(names)],
+        'competencias': [{'competencia_id': i + 1, 'competencia': c} for i, c in enumerate(competitions)],
+        'fases': [{'fase_id': i + 1, 'nombre': f} for i, f in enumerate(FASES)],
+        'metricas': [{'metrica_id': i, 'nombre': n, 'tipo': t, 'global': g} for i, n, t, g in METRICAS],
+        'distancias': [{'distancia_id': i + 1, 'distancia': d} for i, d in enumerate(DISTANCIAS)],
+        'estilos': [{'estilo_id': i + 1, 'nombre': e} for i, e in enumerate(ESTILOS)],
+        'pruebas': _pruebas(),
+        'registros': [],
+    }
+
+    header = []
+    for column in CSV_COLUMNS:
+        name = rnd.choice(aliases[column]) if aliases and column in aliases else column
+        header.append(name.upper() if aliases and rnd.random() < 0.3 else name)
+
+    dirt = {kind: 0 for kind in DIRT_KINDS}
+    lines = [delimiter.join(header)]
+    for _ in range(n_rows):
+        s = rnd.randrange(len(names))
+        estilo = rnd.choices(ESTILOS[:4], weights=[PESO_ESTILO[e] for e in ESTILOS[:4]])[0]
+        distancia = rnd.choice((50, 100, 200))
+        fecha = anchor - timedelta(days=rnd.randrange(365))
+        values = {
+            _CSV_FIELDS[(name, segmento)]: valor
+            for name, segmento, valor in _test_values(rnd, distancia, estilo, 'largo', skill[s], rnd.random())
+            if (name, segmento) in _CSV_FIELDS
+        }
+        row: Dict[str, Any] = {
+            'fecha': fecha.isoformat(),
+            'nombre': names[s],
+            'competencia': rnd.choice(competitions),
+            'fase': rnd.choice(FASES),
+            'estilo': estilo,
+            'distancia': distancia,
+            **{field: (int(v) if field.startswith('brz') else v) for field, v in values.items()}
+        }
+
+        if dirty_rate and rnd.random() < dirty_rate:
+            kind = rnd.choice(DIRT_KINDS)
+            dirt[kind] += 1
+            if kind == 'out_of_range':
+                field = rnd.choice(('t_total', 't25_1', 'f1', 'brz_total'))
+                row[field] = row[field] * 40 if rnd.random() < 0.5 else -abs(row[field])
+            elif kind == 'missing':
+                row[rnd.choice(('t25_1', 't25_2', 't_total', 'brz_total', 'f1', 'f2'))] = ''
+            elif kind == 'bad_date':
+                row['fecha'] = rnd.choice(('sin fecha', '2025-13-45', '??'))
+            elif kind == 'non_integer':
+                row[rnd.choice(('brz_1', 'brz_2', 'brz_total'))] += 0.5
+            elif kind == 'unknown_swimmer':
+                row['nombre'] = f"Invitado {rnd.randrange(10_000)}"
+            else:
+                row['t_total'] = round(row['t25_1'] + row['t25_2'] - 1.0, 2)
+
+        lines.append(delimiter.join(str(row[c]) for c in CSV_COLUMNS))
+
+    content = '\n'.join(lines) + '\n'
+    return content.encode(encoding), tables, dirt
+
+
+# === Métricas manuales (entrada del formulario de carga) ===
+
+# Defectos de las métricas manuales que rechaza SwimmingDataValidator
+MANUAL_DIRT_KINDS = ['out_of_range', 'missing', 'non_integer', 'wrong_type', 'inconsistent']
+
+
+def generate_manual_metrics(n: int, seed: int = 42, dirty_rate: float = 0.0,
+                            edge_rate: float = 0.2) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Métricas manuales de pruebas de 50/100m como las envía el formulario de
+    carga (brazadas enteras), con `distancia_total`.
+
+    Una fracción `edge_rate` lleva flechas con centésimas, cuyas medias caen
+    en mitades exactas al redondear (el caso delicado de round_like_python),
+    y otra una brazada parcial opcional vacía (None) o entera como float
+    (10.0): ambos casos son válidos y deben validar igual en todas las rutas.
+    Una fracción `dirty_rate` lleva un defecto de MANUAL_DIRT_KINDS; el
+    segundo valor devuelto cuenta los registros por tipo de defecto.
+    """
+    rnd = random.Random(seed)
+    dirt = {kind: 0 for kind in MANUAL_DIRT_KINDS}
+    records = []
+    for _ in range(n):
+        estilo = rnd.choices(ESTILOS[:4], weights=[PESO_ESTILO[e] for e in ESTILOS[:4]])[0]
+        distancia = rnd.choice((50, 100))
+        values = {
+            _CSV_FIELDS[(name, segmento)]: valor
+            for name, segmento, valor in _test_values(rnd, distancia, estilo, 'largo',
+                                                      math.exp(rnd.gauss(0.0, 0.08)), rnd.random())
+            if (name, segmento) in _CSV_FIELDS
+        }
+        record: Dict[str, Any] = {
+            field: (int(v) if field.startswith('brz') else v) for field, v in values.items()
+        }
+        record['distancia_total'] = float(distancia)
+        if rnd.random() < edge_rate:
+            record['f1'] = round(record['f1'] + rnd.choice((0.01, 0.03, 0.05, 0.07)), 2)
+        if rnd.random() < edge_rate:
+            field = rnd.choice(('brz_1', 'brz_2'))
+            record[field] = None if rnd.random() < 0.5 else float(record[field])
+
+        if dirty_rate and rnd.random() < dirty_rate:
+            kind = rnd.choice(MANUAL_DIRT_KINDS)
+            dirt[kind] += 1
+            if kind == 'out_of_range':
+                field = rnd.choice(('t_total', 't25_1', 'f1', 'brz_total'))
+                record[field] = record[field] * 40 if rnd.random() < 0.5 else -abs(record[field])
+            elif kind == 'missing':
+                record[rnd.choice(('t25_1', 't25_2', 't_total', 'brz_total', 'f1', 'f2'))] = None
+            elif kind == 'non_integer':
+                field = rnd.choice(('brz_1', 'brz_2', 'brz_total'))
+                record[field] = (record[field] or 0) + 0.5
+            elif kind == 'wrong_type':
+                field = rnd.choice(('t25_1', 'f2', 'brz_total'))
+                record[field] = str(record[field])
+            else:
+                record['t_total'] = round(record['t25_1'] + record['t25_2'] - 1.0, 2)
+        records.append(record)
+    return records, dirt
@@ -7,8 +7,39 @@ from typing import Dict, Any, Optional, List
 from dataclasses import dataclass
 import logging
 
+from utils.lazy import LazyModule
+
+# NumPy solo se carga si se usa el cálculo por lotes
+np = LazyModule('numpy')
+
 logger = logging.getLogger(__name__)
 
+# Decimales de cada métrica automática (los mismos que calculate_metrics)
+METRIC_DECIMALS = {
+    'v_promedio': 3,
+    'v1': 3,
+    'v2': 3,
+    'dist_x_brz': 2,
+    'dist_sin_f': 1,
+    'f_promedio': 2,
+    'brz_promedio': 1,
+}
+
+
+def round_like_python(values, decimals: int):
+    """
+    Redondeo vectorizado idéntico a round() de Python.
+
+    np.round escala por 10**decimals y eso puede desplazar los valores cercanos
+    a la mitad; esos casos (pocos) se redondean con round() de Python.
+    """
+    rounded = np.round(values, decimals)
+    scaled = np.abs(values) * 10.0 ** decimals
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_half & np.isfinite(values)):
+        rounded[i] = round(float(values[i]), decimals)
+    return rounded
+
 
 @dataclass
 class MetricCalculationInput:
@@ -128,6 +159,37 @@ class SwimmingMetricsCalculator:
             self.logger.error(f"Error calculando métricas desde diccionario: {str(e)}")
             raise
     
+    def calculate_batch(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Versión vectorizada de calculate_metrics para muchas pruebas a la vez.
+
+        `inputs` tiene un array por campo de MetricCalculationInput (NaN si
+        falta). Cada métrica se calcula donde sus entradas son válidas y queda
+        NaN en el resto; con todas las entradas, el resultado es idéntico al
+        de calculate_metrics.
+        """
+        n = len(inputs['t_total'])
+        field = lambda name: np.asarray(inputs.get(name, np.full(n, np.nan)), dtype=float)
+        distancia = field('distancia_total')
+        t_total, brz_total = field('t_total'), field('brz_total')
+        t25_1, t25_2 = field('t25_1'), field('t25_2')
+        f1, f2 = field('f1'), field('f2')
+        brz_1, brz_2 = field('brz_1'), field('brz_2')
+
+        tramo_distance = distancia / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw = {
+                'v_promedio': np.where(t_total > 0, distancia / t_total, np.nan),
+                'v1': np.where(t25_1 > 0, tramo_distance / t25_1, np.nan),
+                'v2': np.where(t25_2 > 0, tramo_distance / t25_2, np.nan),
+                'dist_x_brz': np.where(brz_total > 0, distancia / brz_total, np.nan),
+                'dist_sin_f': distancia - (f1 + f2),
+                'f_promedio': (f1 + f2) / 2,
+                # Como la versión escalar: solo con brazadas de ambos tramos distintas de cero
+                'brz_promedio': np.where((brz_1 != 0) & (brz_2 != 0), (brz_1 + brz_2) / 2, np.nan),
+            }
+        return {name: round_like_python(values, METRIC_DECIMALS[name]) for name, values in raw.items()}
+    
     def validate_input(self, data: Dict[str, Any]) -> List[str]:
         """Valida los datos de entrada para el cálculo"""
         errors = []
@@ -3,10 +3,11 @@ Data Ingestion Function - AquaLytics API
 Función serverless para ingesta de datos de natación
 """
 
+import sys
 import json
 import logging
-import pandas as pd
-import io
+import asyncio
+import contextlib
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
@@ -18,8 +19,13 @@ from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
 from utils.supabase_client import SupabaseClient, MetricRecord
-from utils.csv_processor import CSVProcessor
-from utils.data_validation import SwimmingDataValidator
+from utils.id_loader import IdLoader
+from utils.response_cache import invalidate_for_records
+from utils.single_flight import query_flights
+from utils.leaderboard import leaderboard_index
+from utils.write_buffer import WriteBehindBuffer, create_write_buffer, write_behind_enabled
+from utils.view_refresh import view_refresher, view_refresh_enabled
+from utils.lazy import lazy_import
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,7 +36,138 @@ class DataIngestionService:
     
     def __init__(self):
         self.supabase_client = None
-        self.validator = SwimmingDataValidator()
+        self._validator = None
+        self._write_buffer: Optional[WriteBehindBuffer] = None
+        # Automáticas insertadas por el flush del buffer, pendientes de propagar
+        self._buffered_automatic: List[MetricRecord] = []
+    
+    @property
+    def write_buffer(self) -> Optional[WriteBehindBuffer]:
+        """Buffer de escritura diferida (solo con AQUALYTICS_WRITE_BEHIND=1)"""
+        if self._write_buffer is None and write_behind_enabled():
+            self._write_buffer = create_write_buffer(
+                self._insert_buffered_records,
+                on_flushed=self._on_buffer_flushed
+            )
+        return self._write_buffer
+    
+    def _on_records_written(self, records: List[MetricRecord]) -> None:
+        """Propaga registros insertados a la caché de respuestas y a los índices en memoria"""
+        invalidate_for_records(records)
+        query_flights.invalidate()
+        leaderboard_index.apply_records(records)
+        # Si el almacén columnar está cargado en este proceso, refrescarlo en la próxima consulta
+        store_module = sys.modules.get('utils.columnar_store')
+        if store_module is not None:
+            store_module.registros_store.mark_stale()
+        # Vistas materializadas: un refresco con debounce por ráfaga de escrituras
+        if view_refresh_enabled():
+            view_refresher.notify(self.supabase_client, len(records))
+    
+    async def _reference_data(self, df, processor, ids: IdLoader) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Tablas de referencia de transform_to_long_format limitadas a los
+        nombres del CSV: el cargador resuelve cada tabla con una sola consulta
+        (nadadores y competencias nuevos se crean) y las pruebas por
+        (distancia, estilo, curso largo).
+        """
+        def distinct(column: str) -> List[str]:
+            return list(dict.fromkeys(str(value) for value in df[column]))
+        
+        swimmers, competitions, phases = distinct('nombre'), distinct('competencia'), distinct('fase')
+        metrics = list(dict.fromkeys(name for name, _ in processor.metric_columns.values()))
+        tests = list(dict.fromkeys(
+            (int(distancia), str(estilo)) for distancia, estilo in zip(df['distancia'], df['estilo'])
+        ))
+        swimmer_ids, competition_ids, phase_ids, metric_ids, test_ids = await asyncio.gather(
+            ids.nadadores.load_many(swimmers),
+            ids.competencias.load_many(competitions),
+            ids.fases.load_many(phases),
+            ids.metricas.load_many(metrics),
+            ids.pruebas_por_detalle.load_many((distancia, estilo, 'largo') for distancia, estilo in tests)
+        )
+        return {
+            'swimmers': [{'nombre': n, 'id_nadador': i} for n, i in zip(swimmers, swimmer_ids) if i],
+            'competitions': [{'competencia': n, 'competencia_id': i} for n, i in zip(competitions, competition_ids) if i],
+            'phases': [{'nombre': n, 'fase_id': i} for n, i in zip(phases, phase_ids) if i],
+            'metrics': [{'nombre': n, 'metrica_id': i} for n, i in zip(metrics, metric_ids) if i],
+            'tests': [
+                {'distancia': d, 'estilo': e, 'prueba_id': i} for (d, e), i in zip(tests, test_ids) if i
+            ],
+        }
+    
+    def _automatic_records(self, records: List[MetricRecord]) -> List[MetricRecord]:
+        """Registros automáticos calculados por lotes para las pruebas de `records`"""
+        automatic_metrics = lazy_import('utils.automatic_metrics')
+        try:
+            metric_names, distances = automatic_metrics.load_reference(
+                self.supabase_client, (r.prueba_id for r in records)
+            )
+            return automatic_metrics.build_automatic_records(records, metric_names, distances)
+        except Exception as e:
+            # Sin métricas automáticas la ingesta sigue; el backfill las completa después
+            logger.error(f"Error calculando métricas automáticas: {str(e)}")
+            return []
+    
+    def _completed_test_records(self, records: List[MetricRecord]) -> List[MetricRecord]:
+        """
+        Inserta las métricas automáticas de las pruebas que `records` (ya
+        guardados) dejan completas. Un fallo no afecta a los registros
+        manuales: el backfill las completa después.
+        """
+        automatic_metrics = lazy_import('utils.automatic_metrics')
+        try:
+            automatic = automatic_metrics.completed_test_records(self.supabase_client, records)
+            if not automatic:
+                return []
+            result = self.supabase_client.insert_metric_records(automatic)
+            if not result['success']:
+                logger.error(f"Error insertando métricas automáticas: {result['errors']}")
+                return []
+            return automatic
+        except Exception as e:
+            logger.error(f"Error calculando métricas automáticas: {str(e)}")
+            return []
+    
+    def _insert_buffered_records(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Inserta en un solo lote los registros acumulados por el buffer y las
+        métricas automáticas de las pruebas que completan (corre en un hilo).
+        """
+        metric_records = [MetricRecord(**r) for r in records]
+        result = self.supabase_client.insert_metric_records(metric_records)
+        if result['success']:
+            # Se propagan con los manuales en on_flushed, en el event loop
+            self._buffered_automatic.extend(self._completed_test_records(metric_records))
+        return result
+    
+    def _on_buffer_flushed(self, records: List[Dict[str, Any]]) -> None:
+        automatic, self._buffered_automatic = self._buffered_automatic, []
+        self._on_records_written([MetricRecord(**r) for r in records] + automatic)
+    
+    async def startup(self):
+        """Con escritura diferida, recupera los journals pendientes al arrancar (no en el primer registro)"""
+        if self.write_buffer is None:
+            return
+        try:
+            await self.initialize()
+        except Exception:
+            # Sin cliente no se puede insertar: la recuperación queda para el primer registro
+            return
+        self.write_buffer.open()
+    
+    async def shutdown(self):
+        """Vacía el buffer de escritura pendiente y detiene el refresco de vistas al apagar el servidor"""
+        if self._write_buffer is not None:
+            await self._write_buffer.close()
+        view_refresher.close()
+    
+    @property
+    def validator(self):
+        """Validador de datos (carga NumPy y el esquema compilado en el primer uso)"""
+        if self._validator is None:
+            self._validator = lazy_import('utils.data_validation').SwimmingDataValidator()
+        return self._validator
     
     async def initialize(self):
         """Inicializa el servicio si es necesario"""
@@ -48,149 +185,84 @@ class DataIngestionService:
             # Asegurar inicialización
             await self.initialize()
             
-            # Leer CSV desde string
-            df = pd.read_csv(io.StringIO(csv_content))
-            
-            # Procesar con CSVProcessor
-            processor = CSVProcessor()
-            
-            # Guardar temporalmente para procesamiento
-            import tempfile
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=True) as tmp:
-                df.to_csv(tmp.name, index=False)
-                processed_df, errors = processor.process_csv(tmp.name)
+            # Leer, normalizar y validar con CSVProcessor
+            processor = lazy_import('utils.csv_processor').CSVProcessor()
+            df_clean, processed = processor.read_and_clean(csv_content, filename)
             
             # Verificar errores críticos
-            critical_errors = [e for e in errors if e.severity == 'error']
-            if critical_errors:
+            if not processed.success:
                 return {
                     "success": False,
                     "message": "Se encontraron errores en el archivo",
-                    "errors": [
-                        {
-                            "row": e.row,
-                            "column": e.column,
-                            "message": e.message
-                        } for e in critical_errors
-                    ],
-                    "warnings": [
-                        {
-                            "row": e.row,
-                            "column": e.column,
-                            "message": e.message
-                        } for e in errors if e.severity == 'warning'
-                    ]
+                    "errors": processed.errors,
+                    "warnings": processed.warnings
                 }
             
-            # Obtener registros para cargar
-            records_data = processor.validate_for_upload(processed_df)
-            
-            if not records_data:
+            if df_clean.empty:
                 return {
                     "success": False,
                     "message": "No se encontraron registros válidos para procesar",
                     "errors": [],
-                    "warnings": []
+                    "warnings": processed.warnings
                 }
             
-            # Convertir a MetricRecords
+            # IDs de referencia de las filas: una consulta por tabla con el cargador del request
+            ids = IdLoader(self.supabase_client)
+            reference_data = await self._reference_data(df_clean, processor, ids)
+            logger.info(f"IDs de {len(df_clean)} filas resueltos con {ids.queries()} lotes")
+            
+            # Formato largo: una prueba por fila con sus métricas manuales
+            tests, transform_errors = processor.transform_to_long_format(df_clean, reference_data)
+            warnings = processed.warnings + transform_errors
+            
             metric_records = []
             pruebas_no_encontradas = set()
-            
-            for record in records_data:
-                # Obtener o crear nadador
-                nadador_id = self.supabase_client.get_or_create_nadador(record['nombre_nadador'])
-                
-                # Obtener ID de métrica
-                metrica_id = self.supabase_client.get_metrica_id(record['nombre_metrica'])
-                if not metrica_id:
-                    continue
-                
-                # Obtener ID de prueba
-                prueba_id = None
-                if record.get('prueba'):
-                    prueba_id = self.supabase_client.get_prueba_by_name(record['prueba'])
-                    
-                    if not prueba_id:
-                        # Intentar parsear y buscar por detalles
-                        prueba_parts = record['prueba'].split()
-                        if len(prueba_parts) >= 2:
-                            try:
-                                distancia = int(prueba_parts[0].lower().replace('m', ''))
-                                estilo = ' '.join(prueba_parts[1:])
-                                prueba_id = self.supabase_client.get_prueba_by_details(
-                                    distancia=distancia,
-                                    estilo=estilo,
-                                    curso='largo'
-                                )
-                            except:
-                                pass
-                    
-                    if not prueba_id:
-                        pruebas_no_encontradas.add(record['prueba'])
-                        continue
-                else:
+            for test in tests:
+                if test['prueba_id'] is None:
+                    pruebas_no_encontradas.add(test['prueba'])
                     continue
-                
-                # IDs opcionales
-                competencia_id = None
-                if record.get('competencia'):
-                    competencia_id = self.supabase_client.get_or_create_competencia(record['competencia'])
-                
-                fase_id = None
-                if record.get('fase'):
-                    fase_id = self.supabase_client.get_fase_id(record['fase'])
-                
-                # Crear MetricRecord
-                metric_record = MetricRecord(
-                    id_nadador=nadador_id,
-                    prueba_id=prueba_id,
-                    metrica_id=metrica_id,
-                    valor=record['valor'],
-                    fecha=record['fecha'].strftime('%Y-%m-%d') if hasattr(record['fecha'], 'strftime') else str(record['fecha']),
-                    segmento=record.get('segmento'),
-                    competencia_id=competencia_id,
-                    fase_id=fase_id
-                )
-                
-                metric_records.append(metric_record)
+                for metrica in test['metricas']:
+                    metric_records.append(MetricRecord(
+                        id_nadador=test['id_nadador'],
+                        prueba_id=test['prueba_id'],
+                        metrica_id=metrica['metrica_id'],
+                        valor=float(metrica['valor']),
+                        fecha=test['fecha'],
+                        segmento=metrica['segmento'],
+                        competencia_id=test['competencia_id'],
+                        fase_id=test['fase_id']
+                    ))
+            if pruebas_no_encontradas:
+                warnings.append(f"Pruebas no encontradas: {', '.join(sorted(pruebas_no_encontradas))}")
             
-            # Insertar registros
-            if metric_records:
-                result = self.supabase_client.insert_metric_records(metric_records)
-                
-                response = {
-                    "success": result['success'],
-                    "message": f"Se procesaron {result['inserted']} registros de métricas",
-                    "stats": {
-                        "total_records": len(records_data),
-                        "inserted": result['inserted'],
-                        "skipped": len(records_data) - result['inserted']
-                    },
-                    "warnings": [
-                        {
-                            "row": e.row,
-                            "column": e.column,
-                            "message": e.message
-                        } for e in errors if e.severity == 'warning'
-                    ],
-                    "info": "Las métricas automáticas se calculan automáticamente mediante triggers en la base de datos."
-                }
-                
-                if pruebas_no_encontradas:
-                    response["warnings"].append({
-                        "row": 0,
-                        "column": "prueba",
-                        "message": f"Pruebas no encontradas: {', '.join(pruebas_no_encontradas)}"
-                    })
-                
-                return response
-            else:
+            if not metric_records:
                 return {
                     "success": False,
                     "message": "No se pudieron procesar registros válidos",
                     "errors": [],
-                    "warnings": []
+                    "warnings": warnings
+                }
+            
+            # Métricas automáticas de las pruebas completas, en el mismo insert
+            automatic_records = self._automatic_records(metric_records)
+            result = self.supabase_client.insert_metric_records(metric_records + automatic_records)
+            inserted = result['inserted'] - len(automatic_records) if result['success'] else 0
+            if result['success']:
+                self._on_records_written(metric_records + automatic_records)
+            
+            return {
+                "success": result['success'],
+                "message": f"Se procesaron {inserted} registros de métricas",
+                "stats": {
+                    "total_rows": processed.total_rows,
+                    "total_records": len(metric_records),
+                    "inserted": inserted,
+                    "automatic_inserted": len(automatic_records) if result['success'] else 0,
+                    "skipped": len(metric_records) - inserted
+                },
+                "errors": result.get('errors', []),
+                "warnings": warnings,
+                "info": "Las métricas automáticas de cada prueba completa se calculan al ingerir y se guardan junto a las manuales."
             }
 
         except Exception as e:
@@ -211,7 +283,7 @@ class DataIngestionService:
             logger.info(f"Validando registro individual: {record_data.keys()}")
             
             # Validar datos del registro usando el validador robusto
-            validation_result = self.validator.validate_record_data(record_data)
+            validation_result = self.validator.validate_metric_record(record_data)
             
             if not validation_result.is_valid:
                 logger.warning(f"Validación fallida: {validation_result.errors}")
@@ -245,14 +317,27 @@ class DataIngestionService:
                 fase_id=sanitized_data.get('fase_id', record_data.get('fase_id'))
             )
             
+            # Escritura diferida: confirmar ya y agrupar en inserts por lotes
+            if self.write_buffer is not None:
+                seq = self.write_buffer.enqueue(metric_record.to_dict())
+                return {
+                    "success": True,
+                    "queued": True,
+                    "message": "Registro aceptado (escritura diferida)",
+                    "data": {**metric_record.to_dict(), "seq": seq}
+                }
+            
             # Insertar
             result = self.supabase_client.insert_metric_records([metric_record])
             
             if result['success']:
+                automatic_records = self._completed_test_records([metric_record])
+                self._on_records_written([metric_record] + automatic_records)
                 return {
                     "success": True,
                     "message": "Registro insertado correctamente",
-                    "data": metric_record.to_dict()
+                    "data": metric_record.to_dict(),
+                    "automatic_inserted": len(automatic_records)
                 }
             else:
                 return {
@@ -312,7 +397,10 @@ async def ingest_record(request: Request) -> JSONResponse:
         data = await request.json()
         result = await ingestion_service.ingest_single_record(data)
         
-        status_code = 200 if result['success'] else 400
+        if result.get('queued'):
+            status_code = 202
+        else:
+            status_code = 200 if result['success'] else 400
         return JSONResponse(result, status_code=status_code)
         
     except json.JSONDecodeError:
@@ -344,8 +432,15 @@ middleware = [
     )
 ]
 
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Recupera el journal de escritura diferida al arrancar; lo vacía y detiene el refresco de vistas al apagar"""
+    await ingestion_service.startup()
+    yield
+    await ingestion_service.shutdown()
+
 # Aplicación Starlette
-app = Starlette(routes=routes, middleware=middleware)
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
 
 # Handler para Vercel
 async def handler(request, context=None):
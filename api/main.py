@@ -3,18 +3,36 @@ Main Backend Server - AquaLytics API
 Servidor unificado para desarrollo local que incluye todos los endpoints
 """
 
+import sys
 import logging
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
 from starlette.routing import Route
 from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
 
-# Importar las rutas de cada microservicio
-from ingest import routes as ingest_routes
-from query import routes as query_routes  
-from preview import routes as preview_routes
+from utils.lazy import timed_import, lazy_import, mark_ready, startup_report
+from utils.response_cache import ResponseCacheMiddleware, response_cache
+from utils.instrumentation import MetricsMiddleware, registry, render_metrics, stats_collector
+from utils.query_tracing import QueryTraceMiddleware, trace_store
+from utils.leaderboard import leaderboard_index
+from utils.view_refresh import view_refresher, view_refresh_enabled
+from utils.profiling import ProfilingMiddleware, profile_store, is_authorized
+from utils.loop_monitor import LoopMonitorMiddleware, loop_monitor
+from utils.single_flight import query_flights
+from utils.admission import AdmissionController, AdmissionMiddleware, AdmissionPolicy
+
+# Importar las rutas de cada microservicio (tiempos expuestos en /system/startup).
+# pandas, NumPy y el SDK de Supabase se cargan en el primer uso, no aquí.
+ingest_routes = timed_import('ingest').routes
+ingest_lifespan = timed_import('ingest').lifespan
+query_module = timed_import('query')
+query_routes = query_module.routes
+cache_policies = query_module.cache_policies
+preview_routes = timed_import('preview').routes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,32 +52,245 @@ async def root_handler(request: Request) -> JSONResponse:
                 "/query/aggregate", 
                 "/query/performance-progress",
                 "/query/best-times",
-                "/query/styles-distribution"
+                "/query/styles-distribution",
+                "/query/leaderboard",
+                "/query/batch"
             ],
             "preview": ["/preview/calculate"],
-            "health": ["/health"]
+            "system": ["/system/cache", "/system/admission", "/system/startup", "/system/leaderboards", "/system/columnar", "/system/refresh-views"],
+            "debug": ["/debug/traces", "/debug/profiles", "/debug/profiles/{profile_id}", "/debug/loop-blocks"],
+            "health": ["/health"],
+            "metrics": ["/metrics"]
+        }
+    })
+
+async def cache_stats_handler(request: Request) -> JSONResponse:
+    """Estadísticas de la caché de respuestas (ratio de aciertos, bytes ahorrados)"""
+    return JSONResponse({"success": True, "data": response_cache.stats()})
+
+async def admission_handler(request: Request) -> JSONResponse:
+    """Estado del control de admisión: plazas en curso, colas y rechazos por limitador"""
+    return JSONResponse({"success": True, "data": admission_controller.stats()})
+
+async def leaderboards_handler(request: Request) -> JSONResponse:
+    """Estado del índice de leaderboards; POST lo reconstruye desde la BD"""
+    if request.method == 'POST':
+        if not _profiles_authorized(request):
+            return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+        try:
+            stats = await run_in_threadpool(
+                leaderboard_index.rebuild, query_module.query_service.supabase_client
+            )
+        except Exception as e:
+            logger.error(f"Error reconstruyendo leaderboards: {str(e)}")
+            return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+        return JSONResponse({"success": True, "data": stats})
+    return JSONResponse({"success": True, "data": leaderboard_index.stats()})
+
+async def columnar_handler(request: Request) -> JSONResponse:
+    """Estado del almacén columnar de registros; POST lo recarga completo (o con ?snapshot=1 escribe un snapshot)"""
+    if request.method == 'POST':
+        if not _profiles_authorized(request):
+            return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+        store = lazy_import('utils.columnar_store').registros_store
+        try:
+            if request.query_params.get('snapshot') == '1':
+                if not store.snapshot_dir or not store.is_loaded:
+                    return JSONResponse(
+                        {"success": False, "error": "Snapshot no disponible: configure AQUALYTICS_SNAPSHOT_DIR y cargue el almacén"},
+                        status_code=409
+                    )
+                await run_in_threadpool(store.write_snapshot)
+                stats = store.stats()
+            else:
+                stats = await run_in_threadpool(store.reload, query_module.query_service.supabase_client)
+        except Exception as e:
+            logger.error(f"Error recargando el almacén columnar: {str(e)}")
+            return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+        return JSONResponse({"success": True, "data": stats})
+    # Sin forzar la carga de NumPy si el almacén no se ha usado
+    module = sys.modules.get('utils.columnar_store')
+    stats = module.registros_store.stats() if module else {"loaded": False}
+    return JSONResponse({"success": True, "data": stats})
+
+async def refresh_views_handler(request: Request) -> JSONResponse:
+    """Estado del refresco de vistas materializadas; POST programa uno inmediato"""
+    if request.method == 'POST':
+        if not _profiles_authorized(request):
+            return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+        if not view_refresh_enabled():
+            return JSONResponse(
+                {"success": False, "error": "Refresco de vistas deshabilitado (AQUALYTICS_VIEW_REFRESH=1)"},
+                status_code=409
+            )
+        view_refresher.request_refresh(query_module.query_service.supabase_client)
+        return JSONResponse({"success": True, "data": view_refresher.stats()}, status_code=202)
+    return JSONResponse({"success": True, "data": {"enabled": view_refresh_enabled(), **view_refresher.stats()}})
+
+async def startup_report_handler(request: Request) -> JSONResponse:
+    """Reporte de arranque: tiempos de import por módulo y dependencias cargadas"""
+    return JSONResponse({"success": True, "data": startup_report()})
+
+async def traces_handler(request: Request) -> JSONResponse:
+    """Trazas de consultas a BD de los requests recientes (con detección de N+1)"""
+    if not _profiles_authorized(request):
+        return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+    request_id = request.query_params.get('id')
+    if request_id:
+        trace = trace_store.get(request_id)
+        if trace is None:
+            return JSONResponse({"success": False, "error": "Traza no encontrada"}, status_code=404)
+        return JSONResponse({"success": True, "data": trace})
+
+    try:
+        limit = int(request.query_params.get('limit', 50))
+    except ValueError:
+        return JSONResponse({"success": False, "error": "limit debe ser un número entero"}, status_code=400)
+    return JSONResponse({
+        "success": True,
+        "data": trace_store.recent(
+            limit=limit,
+            only_n_plus_one=request.query_params.get('n_plus_one') == '1',
+            full=request.query_params.get('full') == '1'
+        )
+    })
+
+def _profiles_authorized(request: Request) -> bool:
+    token = request.headers.get('x-profile') or request.query_params.get('_profile')
+    return is_authorized(token)
+
+async def profiles_handler(request: Request) -> JSONResponse:
+    """Perfiles guardados (bajo demanda y de requests lentos)"""
+    if not _profiles_authorized(request):
+        return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+    return JSONResponse({"success": True, "data": profile_store.list()})
+
+async def profile_detail_handler(request: Request) -> Response:
+    """Detalle de un perfil; con ?format=raw descarga el .prof/.folded"""
+    if not _profiles_authorized(request):
+        return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+    profile_id = request.path_params['profile_id']
+    if request.query_params.get('format') == 'raw':
+        raw = profile_store.raw(profile_id)
+        if raw is None:
+            return JSONResponse({"success": False, "error": "Perfil no encontrado"}, status_code=404)
+        filename, payload = raw
+        return Response(payload, media_type='application/octet-stream',
+                        headers={'content-disposition': f'attachment; filename="{filename}"'})
+    meta = profile_store.get(profile_id)
+    if meta is None:
+        return JSONResponse({"success": False, "error": "Perfil no encontrado"}, status_code=404)
+    return JSONResponse({"success": True, "data": meta})
+
+async def loop_blocks_handler(request: Request) -> JSONResponse:
+    """Bloqueos del event loop agregados por punto de llamada (AQUALYTICS_LOOP_BLOCK_MS); DELETE los reinicia"""
+    # Las pilas y rutas de código no son públicas: GET y DELETE requieren el token
+    if not _profiles_authorized(request):
+        return JSONResponse({"success": False, "error": "No autorizado"}, status_code=403)
+    if request.method == 'DELETE':
+        loop_monitor.reset()
+        return JSONResponse({"success": True, "data": loop_monitor.stats()})
+    try:
+        limit = int(request.query_params.get('limit', 50))
+    except ValueError:
+        return JSONResponse({"success": False, "error": "limit debe ser un número entero"}, status_code=400)
+    return JSONResponse({
+        "success": True,
+        "data": {
+            **loop_monitor.stats(),
+            "call_sites": loop_monitor.sites(limit=limit, full=request.query_params.get('full') == '1'),
+            "recent": loop_monitor.recent(limit) if request.query_params.get('recent') == '1' else []
         }
     })
 
+async def health_handler(request: Request) -> JSONResponse:
+    """Health check básico"""
+    return JSONResponse({"status": "ok"})
+
+async def metrics_handler(request: Request) -> PlainTextResponse:
+    """Métricas en formato de texto Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
+# Contadores de la caché de respuestas en /metrics
+registry.register_collector(
+    stats_collector('aqualytics_response_cache', 'Caché de respuestas', response_cache.stats)
+)
+registry.register_collector(
+    stats_collector('aqualytics_leaderboard', 'Índice de leaderboards', leaderboard_index.stats)
+)
+registry.register_collector(
+    stats_collector('aqualytics_view_refresh', 'Refresco de vistas materializadas', view_refresher.stats)
+)
+registry.register_collector(
+    stats_collector('aqualytics_single_flight', 'Coalescencia de consultas', query_flights.stats)
+)
+registry.register_collector(
+    stats_collector('aqualytics_loop_monitor', 'Monitor de bloqueos del event loop', loop_monitor.stats)
+)
+
+# === Control de admisión (AQUALYTICS_ADMISSION=1) ===
+# La primera política que coincide gana: las rutas concretas van antes que los prefijos
+admission_policies = [
+    AdmissionPolicy('/preview/calculate', priority='interactive', deadline=2),
+    # Recorre toda la tabla de registros: límite propio dentro de la clase dashboard
+    AdmissionPolicy('/query/styles-distribution', priority='dashboard', max_concurrent=2, max_queue=4, deadline=5),
+    AdmissionPolicy('/query/batch', priority='dashboard', max_concurrent=2, max_queue=4, deadline=10),
+    AdmissionPolicy('/query/', priority='dashboard', deadline=5, prefix=True),
+    AdmissionPolicy('/ingest/', priority='ingest', deadline=60, prefix=True),
+]
+admission_controller = AdmissionController(admission_policies)
+registry.register_collector(
+    stats_collector('aqualytics_admission', 'Control de admisión', admission_controller.stats)
+)
+
 # Crear la ruta raíz
-root_route = [Route('/', root_handler, methods=['GET'])]
+root_route = [
+    Route('/', root_handler, methods=['GET']),
+    Route('/health', health_handler, methods=['GET']),
+    Route('/metrics', metrics_handler, methods=['GET']),
+    Route('/system/cache', cache_stats_handler, methods=['GET']),
+    Route('/system/admission', admission_handler, methods=['GET']),
+    Route('/system/startup', startup_report_handler, methods=['GET']),
+    Route('/system/leaderboards', leaderboards_handler, methods=['GET', 'POST']),
+    Route('/system/columnar', columnar_handler, methods=['GET', 'POST']),
+    Route('/system/refresh-views', refresh_views_handler, methods=['GET', 'POST']),
+    Route('/debug/traces', traces_handler, methods=['GET']),
+    Route('/debug/profiles', profiles_handler, methods=['GET']),
+    Route('/debug/profiles/{profile_id}', profile_detail_handler, methods=['GET']),
+    Route('/debug/loop-blocks', loop_blocks_handler, methods=['GET', 'DELETE'])
+]
 
 # Combinar todas las rutas
 all_routes = root_route + ingest_routes + query_routes + preview_routes
 
 # Configurar middleware
 middleware = [
+    # Latencias, status y requests en curso por ruta (/metrics)
+    Middleware(MetricsMiddleware),
+    # Traza de consultas a BD por request (X-Debug-Trace, /debug/traces)
+    Middleware(QueryTraceMiddleware),
+    # Perfilado bajo demanda (X-Profile) y de requests lentos (AQUALYTICS_SLOW_PROFILE_MS)
+    Middleware(ProfilingMiddleware),
+    # Detector de bloqueos del event loop (AQUALYTICS_LOOP_BLOCK_MS, /debug/loop-blocks)
+    Middleware(LoopMonitorMiddleware),
     Middleware(
         CORSMiddleware, 
         allow_origins=['*'], 
         allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'], 
         allow_headers=['*'],
         allow_credentials=True
-    )
+    ),
+    # Compresión gzip (negociada vía Accept-Encoding) para respuestas > 1KB
+    Middleware(GZipMiddleware, minimum_size=1024, compresslevel=6),
+    # Caché de respuestas /query/* invalidada por la ingesta
+    Middleware(ResponseCacheMiddleware, cache=response_cache, policies=cache_policies),
+    # Admisión por clase de prioridad y plazos por ruta (tras la caché: los aciertos no ocupan plaza)
+    Middleware(AdmissionMiddleware, controller=admission_controller)
 ]
 
 # Crear la aplicación unificada
-app = Starlette(routes=all_routes, middleware=middleware)
+app = Starlette(routes=all_routes, middleware=middleware, lifespan=ingest_lifespan)
+mark_ready('app')
 
 if __name__ == "__main__":
     import uvicorn
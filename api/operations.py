@@ -1,28 +1,128 @@
 """
 Business Logic for Data Querying - AquaLytics API
 """
+import os
 import logging
-from typing import Dict, Any, List, Optional
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime, timedelta
 
 from utils.supabase_client import SupabaseClient
 from utils.db_constants import MetricaID, TIEMPO_15M_ID, TIEMPO_TOTAL_ID
+from utils.leaderboard import leaderboard_index, leaderboard_enabled
+from utils.lazy import lazy_import
+from utils.view_refresh import view_refresh_enabled
+from utils.single_flight import single_flight
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Columnas que se leen de cada tabla de referencia
+REFERENCE_COLUMNS = {
+    'distancias': 'distancia_id, distancia',
+    'estilos': 'estilo_id, nombre',
+    'pruebas': 'id, distancia_id, estilo_id, curso',
+}
+
+
+class ReferenceData:
+    """
+    Tablas de referencia compartidas por las consultas de un mismo request.
+
+    Las consultas de /query/batch corren en hilos concurrentes: cada tabla se
+    lee una sola vez y los demás hilos esperan esa lectura.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[str, List[Dict[str, Any]]] = {}
+        self._loading: Dict[str, threading.Lock] = {}
+        self.loads = 0
+
+    def rows(self, table: str, load: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            if table in self._tables:
+                return self._tables[table]
+            table_lock = self._loading.setdefault(table, threading.Lock())
+        with table_lock:
+            with self._lock:
+                if table in self._tables:
+                    return self._tables[table]
+            rows = load()
+            with self._lock:
+                self._tables[table] = rows
+                self.loads += 1
+            return rows
+
+
+_reference_data: ContextVar[Optional[ReferenceData]] = ContextVar('aqualytics_reference_data', default=None)
+
+
+@contextmanager
+def shared_reference_data():
+    """Dentro del bloque, las tablas de referencia se leen una vez y se comparten"""
+    reference = ReferenceData()
+    token = _reference_data.set(reference)
+    try:
+        yield reference
+    finally:
+        _reference_data.reset(token)
+
+
 class DataQueryService:
     """Servicio de consultas de datos de natación"""
     
-    def __init__(self):
-        self.supabase_client = SupabaseClient()
-        logger.info("Cliente de Supabase para consultas inicializado")
+    # Filas por página en las consultas paginadas de registros
+    PAGE_SIZE = 1000
+    
+    def __init__(self, supabase_client: Optional[SupabaseClient] = None):
+        self._supabase_client = supabase_client
+    
+    @property
+    def supabase_client(self) -> SupabaseClient:
+        """Cliente de Supabase, creado en el primer uso para no penalizar el arranque"""
+        if self._supabase_client is None:
+            self._supabase_client = SupabaseClient()
+            logger.info("Cliente de Supabase para consultas inicializado")
+        return self._supabase_client
     
+    def _columnar(self):
+        """Almacén columnar actualizado (None si AQUALYTICS_COLUMNAR no está activo)"""
+        if os.getenv('AQUALYTICS_COLUMNAR') != '1':
+            return None
+        # NumPy se carga solo si el almacén está activo
+        return lazy_import('utils.columnar_store').registros_store.ensure_fresh(self.supabase_client)
+    
+    def _reference_rows(self, table: str) -> List[Dict[str, Any]]:
+        """Filas de una tabla de referencia (compartidas si hay un shared_reference_data activo)"""
+        def load() -> List[Dict[str, Any]]:
+            return self.supabase_client.client.table(table).select(REFERENCE_COLUMNS[table]).execute().data or []
+        shared = _reference_data.get()
+        return shared.rows(table, load) if shared is not None else load()
+    
+    @single_flight
     async def get_rankings(self, limit: int = 10) -> Dict[str, Any]:
         """Obtiene rankings de nadadores basado en rendimiento usando métricas de Tiempo 15m"""
         try:
             logger.info(f"Obteniendo rankings usando métrica: {MetricaID.get_description(TIEMPO_15M_ID)}")
+            if leaderboard_enabled():
+                # Mejor marca por nadador desde el índice en memoria, sin ordenar en la BD
+                leaderboard_index.ensure_built(self.supabase_client)
+                top = leaderboard_index.top(None, TIEMPO_15M_ID, limit, higher_is_better=True)
+                return {"success": True, "data": [
+                    {"id": e['id_nadador'], "name": e['nadador'], "improvement": e['valor']} for e in top
+                ]}
+            
+            store = self._columnar()
+            if store is not None:
+                top = store.top_values(TIEMPO_15M_ID, limit, descending=True)
+                return {"success": True, "data": [
+                    {"id": e['id_nadador'], "name": e['nadador'], "improvement": e['valor']} for e in top
+                ]}
+            
             result = self.supabase_client.client.table('registros') \
                 .select('id_nadador, nadadores(nombre), valor, metrica_id, metricas(nombre)') \
                 .eq('metrica_id', TIEMPO_15M_ID) \
@@ -43,6 +143,7 @@ class DataQueryService:
             logger.error(f"Error obteniendo rankings: {str(e)}")
             return {"success": False, "error": "No ranking data available."}
     
+    @single_flight
     async def get_aggregate_data(self, metrics: List[str]) -> Dict[str, Any]:
         """Obtiene datos agregados para una lista de métricas."""
         try:
@@ -67,53 +168,183 @@ class DataQueryService:
             logger.error(f"Error obteniendo datos agregados: {str(e)}")
             return {"success": False, "error": f"Error obteniendo datos agregados: {str(e)}"}
     
-    async def get_performance_progress(self, days: int = 30) -> Dict[str, Any]:
-        """Obtiene progreso de rendimiento en los últimos días"""
+    @single_flight
+    async def get_performance_progress(self, days: int = 30, max_points: Optional[int] = None,
+                                       mode: str = 'lttb') -> Dict[str, Any]:
+        """
+        Obtiene progreso de rendimiento en los últimos días. Con `max_points`
+        la serie diaria se reduce para la gráfica (LTTB o min/max/media por bucket).
+        """
         try:
             start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-            result = self.supabase_client.client.table('registros') \
-                .select('fecha, valor, metrica_id') \
-                .gte('fecha', start_date) \
-                .eq('metrica_id', TIEMPO_15M_ID) \
-                .order('fecha') \
-                .execute()
-            
-            if not result.data:
-                return {"success": True, "data": []}
-            
-            date_values = {}
-            for record in result.data:
-                date_key = record['fecha']
-                date_values.setdefault(date_key, []).append(float(record['valor']))
-            
-            progress_data = [{"date": date_key, "avg_speed": round(sum(values) / len(values), 2)}
-                             for date_key, values in sorted(date_values.items())]
-            
-            return {"success": True, "data": progress_data}
+            progress_data = self._daily_progress(start_date)
+            response = {"success": True, "data": progress_data}
+            if max_points is not None and len(progress_data) > max_points:
+                response["data"] = self._downsample_progress(progress_data, max_points, mode)
+                response["downsampling"] = {"mode": mode, "original_points": len(progress_data),
+                                            "points": len(response["data"])}
+            return response
             
         except Exception as e:
             logger.error(f"Error obteniendo progreso de rendimiento: {str(e)}")
             return {"success": False, "error": f"Error obteniendo progreso de rendimiento: {str(e)}"}
     
-    async def get_swimmer_records(self, swimmer_id: int) -> Dict[str, Any]:
-        """Obtiene registros de un nadador específico"""
+    def _daily_progress(self, start_date: str) -> List[Dict[str, Any]]:
+        """Promedio diario de TIEMPO_15M desde `start_date`, ordenado por fecha"""
+        store = self._columnar()
+        if store is not None:
+            return [
+                {"date": date_key, "avg_speed": round(avg, 2)}
+                for date_key, avg in store.daily_mean(TIEMPO_15M_ID, start_date)
+            ]
+        
+        if view_refresh_enabled():
+            # Promedios precalculados (mv_promedio_diario, migración 008)
+            result = self.supabase_client.client.table('mv_promedio_diario') \
+                .select('fecha, valor_promedio') \
+                .eq('metrica_id', TIEMPO_15M_ID) \
+                .gte('fecha', start_date) \
+                .order('fecha') \
+                .execute()
+            return [
+                {"date": r['fecha'], "avg_speed": round(float(r['valor_promedio']), 2)} for r in result.data or []
+            ]
+        
+        result = self.supabase_client.client.table('registros') \
+            .select('fecha, valor, metrica_id') \
+            .gte('fecha', start_date) \
+            .eq('metrica_id', TIEMPO_15M_ID) \
+            .order('fecha') \
+            .execute()
+        
+        date_values = {}
+        for record in result.data or []:
+            date_key = record['fecha']
+            date_values.setdefault(date_key, []).append(float(record['valor']))
+        
+        return [{"date": date_key, "avg_speed": round(sum(values) / len(values), 2)}
+                for date_key, values in sorted(date_values.items())]
+    
+    @staticmethod
+    def _downsample_progress(progress_data: List[Dict[str, Any]], max_points: int, mode: str) -> List[Dict[str, Any]]:
+        """
+        LTTB conserva días reales; minmax agrupa los días en `max_points`
+        buckets de tiempo con la media de los promedios diarios y su rango.
+        """
+        downsampling = lazy_import('utils.downsampling')
+        np = lazy_import('numpy')
+        x = downsampling.dates_to_days([p['date'] for p in progress_data])
+        y = np.array([p['avg_speed'] for p in progress_data], dtype=np.float64)
+        if mode == 'lttb':
+            return [progress_data[i] for i in downsampling.lttb_indices(x, y, max_points).tolist()]
+        stats = downsampling.bucket_stats(x, y, max_points)
+        dates = stats['x'].astype('datetime64[D]').astype(str).tolist()
+        return [
+            {"date": date_key, "avg_speed": round(mean, 2), "min_speed": round(low, 2),
+             "max_speed": round(high, 2), "days": count}
+            for date_key, mean, low, high, count in zip(
+                dates, stats['mean'].tolist(), stats['min'].tolist(), stats['max'].tolist(), stats['count'].tolist()
+            )
+        ]
+    
+    @single_flight
+    async def get_swimmer_records(self, swimmer_id: int, max_points: Optional[int] = None,
+                                  mode: str = 'lttb') -> Dict[str, Any]:
+        """
+        Obtiene registros de un nadador específico. Con `max_points`, cada
+        serie (métrica, prueba, segmento) se reduce a ese número de registros.
+        """
         try:
-            records = self.supabase_client.get_registros_by_swimmer(swimmer_id)
+            store = self._columnar()
+            if store is not None:
+                records = store.swimmer_history(swimmer_id, max_points=max_points, mode=mode)
+            else:
+                records = self.supabase_client.get_registros_by_swimmer(swimmer_id)
+                if max_points is not None:
+                    records = lazy_import('utils.downsampling').downsample_rows(
+                        records, max_points, mode,
+                        series=lambda r: (r.get('metrica_id'), r.get('prueba_id'), r.get('segmento'))
+                    )
             return {"success": True, "data": records}
         except Exception as e:
             logger.error(f"Error obteniendo registros del nadador {swimmer_id}: {str(e)}")
             return {"success": False, "error": f"Error obteniendo registros del nadador: {str(e)}"}
     
-    async def get_complete_test_record(self) -> Dict[str, Any]:
-        """Obtiene registro completo de prueba usando la función de BD"""
+    @single_flight
+    async def get_complete_tests(self, nadador_id: Optional[int] = None, prueba_id: Optional[int] = None,
+                                 competencia_id: Optional[int] = None, fecha: Optional[str] = None,
+                                 fecha_desde: Optional[str] = None, fecha_hasta: Optional[str] = None,
+                                 limit: int = 100) -> Dict[str, Any]:
+        """
+        Pruebas completas (métricas manuales + automáticas) por lotes.
+
+        Reemplaza la llamada por prueba a get_complete_test_record: trae las
+        filas de registros del filtro en una consulta paginada y las pivota
+        con pandas (utils/complete_tests.py), usando las métricas automáticas
+        guardadas en la ingesta.
+        """
         try:
-            result = self.supabase_client.client.rpc('get_complete_test_record').execute()
-            return {"success": True, "data": result.data}
+            client = self.supabase_client.client
+            automatic_metrics = lazy_import('utils.automatic_metrics')
+            metricas = client.table('metricas').select('metrica_id, nombre, tipo').execute().data or []
+            # Manuales y automáticas guardadas en la ingesta (las que falten se calculan al pivotar)
+            metric_names = {
+                m['metrica_id']: m['nombre'] for m in metricas
+                if m.get('tipo') == 'M' or m['nombre'] in automatic_metrics.AUTOMATIC_METRICS
+            }
+            if not metric_names:
+                return {"success": True, "data": []}
+
+            rows: List[Dict[str, Any]] = []
+            seen: Dict[tuple, str] = {}
+            offset = 0
+            while True:
+                query = client.table('registros') \
+                    .select('id_nadador, prueba_id, metrica_id, valor, segmento, fecha, competencia_id, fase_id') \
+                    .in_('metrica_id', list(metric_names))
+                if nadador_id is not None:
+                    query = query.eq('id_nadador', nadador_id)
+                if prueba_id is not None:
+                    query = query.eq('prueba_id', prueba_id)
+                if competencia_id is not None:
+                    query = query.eq('competencia_id', competencia_id)
+                if fecha:
+                    query = query.eq('fecha', fecha)
+                if fecha_desde:
+                    query = query.gte('fecha', fecha_desde)
+                if fecha_hasta:
+                    query = query.lte('fecha', fecha_hasta)
+                page = query.order('fecha', desc=True).order('registro_id') \
+                    .range(offset, offset + self.PAGE_SIZE - 1).execute().data or []
+                rows.extend(page)
+                for r in page:
+                    seen.setdefault((r['prueba_id'], r['id_nadador'], r['fecha']), r['fecha'])
+                if len(page) < self.PAGE_SIZE:
+                    break
+                # Las filas llegan por fecha descendente: con más de `limit` pruebas y la
+                # página ya en una fecha anterior a la de la prueba `limit`, no falta ninguna
+                if len(seen) > limit and page[-1]['fecha'] < list(seen.values())[limit - 1]:
+                    break
+                offset += self.PAGE_SIZE
+
+            prueba_ids = sorted({r['prueba_id'] for r in rows})
+            distances = {}
+            if prueba_ids:
+                for p in client.table('pruebas').select('id, distancias(distancia)') \
+                        .in_('id', prueba_ids).execute().data or []:
+                    if p.get('distancias'):
+                        distances[p['id']] = float(p['distancias']['distancia'])
+
+            complete_tests = lazy_import('utils.complete_tests')
+            tests = complete_tests.pivot_complete_tests(rows, metric_names, distances, limit)
+            logger.info(f"Pruebas completas: {len(tests)} desde {len(rows)} registros")
+            return {"success": True, "data": tests}
         except Exception as e:
-            logger.error(f"Error obteniendo registro completo: {str(e)}")
-            return {"success": False, "error": f"Error obteniendo registro completo: {str(e)}"}
+            logger.error(f"Error obteniendo pruebas completas: {str(e)}")
+            return {"success": False, "error": f"Error obteniendo pruebas completas: {str(e)}"}
 
     # Función para obtener los mejores tiempos de una prueba
+    @single_flight
     async def get_best_times(self, style: str, distance: int, course: str) -> Dict[str, Any]:
         """Obtiene los 5 mejores tiempos para una prueba específica."""
         try:
@@ -132,35 +363,46 @@ class DataQueryService:
             
             logger.info(f"Buscando mejores tiempos para: {distance}m {estilo_normalizado} curso {curso_normalizado}")
             
-            # Primero obtener IDs de distancia y estilo directamente
-            dist_result = client.client.table('distancias').select('*').eq('distancia', distance).execute()
-            if not dist_result.data:
+            # IDs de distancia, estilo y prueba desde las tablas de referencia
+            distancia_id = next((d['distancia_id'] for d in self._reference_rows('distancias')
+                                 if d['distancia'] == distance), None)
+            if distancia_id is None:
                 logger.warning(f"No se encontró distancia para: {distance}m")
                 return {"success": True, "data": []}
-            distancia_id = dist_result.data[0]['distancia_id']
             logger.info(f"Distancia ID encontrada: {distancia_id}")
             
-            estilo_result = client.client.table('estilos').select('*').eq('nombre', estilo_normalizado).execute()
-            if not estilo_result.data:
+            estilo_id = next((e['estilo_id'] for e in self._reference_rows('estilos')
+                              if e['nombre'] == estilo_normalizado), None)
+            if estilo_id is None:
                 logger.warning(f"No se encontró estilo para: {estilo_normalizado}")
                 return {"success": True, "data": []}
-            estilo_id = estilo_result.data[0]['estilo_id']
             logger.info(f"Estilo ID encontrado: {estilo_id}")
             
-            # Buscar la prueba directamente
-            prueba_result = client.client.table('pruebas').select('*') \
-                .eq('distancia_id', distancia_id) \
-                .eq('estilo_id', estilo_id) \
-                .eq('curso', curso_normalizado) \
-                .execute()
-            
-            if not prueba_result.data:
+            prueba_id = next((p['id'] for p in self._reference_rows('pruebas')
+                              if p['distancia_id'] == distancia_id and p['estilo_id'] == estilo_id
+                              and p['curso'] == curso_normalizado), None)
+            if prueba_id is None:
                 logger.warning(f"No se encontró prueba para: {distance}m {estilo_normalizado} ({curso_normalizado})")
                 return {"success": True, "data": []}
-            
-            prueba_id = prueba_result.data[0]['id']
             logger.info(f"Prueba ID encontrada: {prueba_id}")
             
+            if leaderboard_enabled():
+                leaderboard_index.ensure_built(self.supabase_client)
+                top = leaderboard_index.top(prueba_id, TIEMPO_TOTAL_ID, 5)
+                formatted_data = [
+                    {"tiempo": e['valor'], "nadador": e['nadador'], "competencia": e['competencia']}
+                    for e in top
+                ]
+                return {"success": True, "data": formatted_data, "prueba_id": prueba_id}
+            
+            store = self._columnar()
+            if store is not None:
+                formatted_data = [
+                    {"tiempo": e['valor'], "nadador": e['nadador'], "competencia": e['competencia']}
+                    for e in store.top_values(TIEMPO_TOTAL_ID, 5, prueba_id=prueba_id)
+                ]
+                return {"success": True, "data": formatted_data, "prueba_id": prueba_id}
+            
             # Verificar si hay registros para esta prueba específica
             registros_count = client.client.table('registros') \
                 .select('registro_id', count='exact') \
@@ -172,7 +414,7 @@ class DataQueryService:
                 
             if registros_count.count == 0:
                 logger.info(f"No hay registros para la prueba: {distance}m {estilo_normalizado} ({curso_normalizado})")
-                return {"success": True, "data": []}
+                return {"success": True, "data": [], "prueba_id": prueba_id}
 
             # Obtener los registros para esta prueba específica
             registros_query = client.client.table('registros') \
@@ -190,11 +432,30 @@ class DataQueryService:
             ]
             
             logger.info(f"Datos formateados para retorno: {len(formatted_data)} registros")
-            return {"success": True, "data": formatted_data}
+            return {"success": True, "data": formatted_data, "prueba_id": prueba_id}
         except Exception as e:
             logger.error(f"Error obteniendo mejores tiempos: {str(e)}")
             return {"success": False, "error": f"Error obteniendo mejores tiempos: {str(e)}"}
 
+    @single_flight
+    async def get_leaderboard(self, prueba_id: Optional[int], metrica_id: int, limit: int = 10,
+                              swimmer_id: Optional[int] = None) -> Dict[str, Any]:
+        """Top-K de una prueba/métrica y, opcionalmente, posición y percentil de un nadador"""
+        try:
+            leaderboard_index.ensure_built(self.supabase_client)
+            data: Dict[str, Any] = {
+                "prueba_id": prueba_id,
+                "metrica_id": metrica_id,
+                "top": leaderboard_index.top(prueba_id, metrica_id, limit)
+            }
+            if swimmer_id is not None:
+                data["nadador"] = leaderboard_index.swimmer_position(prueba_id, metrica_id, swimmer_id)
+            return {"success": True, "data": data}
+        except Exception as e:
+            logger.error(f"Error obteniendo leaderboard: {str(e)}")
+            return {"success": False, "error": f"Error obteniendo leaderboard: {str(e)}"}
+
+    @single_flight
     async def get_styles_distribution(self) -> Dict[str, Any]:
         """Obtiene la distribución de estilos más practicados."""
         try:
@@ -202,6 +463,26 @@ class DataQueryService:
             
             logger.info("Obteniendo distribución de estilos")
             
+            store = self._columnar()
+            if store is not None:
+                formatted_data = store.style_distribution()
+                logger.info(f"Distribución de estilos obtenida: {len(formatted_data)} estilos")
+                return {"success": True, "data": formatted_data}
+            
+            if view_refresh_enabled():
+                # Conteos precalculados (mv_distribucion_estilos, migración 008)
+                result = client.client.table('mv_distribucion_estilos') \
+                    .select('estilo, total_registros, nadadores_distintos') \
+                    .order('total_registros', desc=True) \
+                    .execute()
+                formatted_data = [
+                    {"estilo": r['estilo'], "total_registros": int(r['total_registros']),
+                     "nadadores_distintos": int(r['nadadores_distintos'])}
+                    for r in result.data or []
+                ]
+                logger.info(f"Distribución de estilos obtenida: {len(formatted_data)} estilos")
+                return {"success": True, "data": formatted_data}
+            
             # Usar la misma consulta que funciona en la query directa
             style_counts = {}
             
@@ -214,18 +495,9 @@ class DataQueryService:
                 logger.warning("No se encontraron registros")
                 return {"success": True, "data": []}
             
-            # Obtener información de pruebas y estilos
-            pruebas = client.client.table('pruebas') \
-                .select('id, estilo_id') \
-                .execute()
-            
-            estilos = client.client.table('estilos') \
-                .select('estilo_id, nombre') \
-                .execute()
-            
-            # Crear mapas para búsqueda rápida
-            prueba_to_estilo = {p['id']: p['estilo_id'] for p in pruebas.data}
-            estilo_to_nombre = {e['estilo_id']: e['nombre'] for e in estilos.data}
+            # Crear mapas para búsqueda rápida desde las tablas de referencia
+            prueba_to_estilo = {p['id']: p['estilo_id'] for p in self._reference_rows('pruebas')}
+            estilo_to_nombre = {e['estilo_id']: e['nombre'] for e in self._reference_rows('estilos')}
             
             # Contar registros por estilo
             nadadores_por_estilo = {}
@@ -5,14 +5,10 @@ Función serverless para previsualización de métricas calculadas sin persisten
 
 import json
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
-from starlette.applications import Starlette
-from starlette.requests import Request
-from starlette.responses import JSONResponse
-from starlette.routing import Route
-from starlette.middleware import Middleware
-from starlette.middleware.cors import CORSMiddleware
+# Starlette se importa bajo demanda: el handler serverless atiende
+# /preview/calculate como ASGI puro para que el arranque en frío sea mínimo
 
 # Eliminamos la dependencia de Supabase
 # from utils.supabase_client import create_supabase_client
@@ -124,10 +120,10 @@ class DataPreviewService:
 preview_service = DataPreviewService()
 
 
-async def calculate_preview(request: Request) -> JSONResponse:
-    """Endpoint para previsualización de métricas"""
+async def _calculate(body: bytes) -> Tuple[Dict[str, Any], int]:
+    """Decodifica el payload y calcula la previsualización: (resultado, status)"""
     try:
-        data = await request.json()
+        data = json.loads(body)
         logger.info(f"Request recibido en /preview/calculate: {data}")
         
         # Inicializar el servicio si es necesario
@@ -135,31 +131,88 @@ async def calculate_preview(request: Request) -> JSONResponse:
         
         result = await preview_service.calculate_preview_metrics(data)
         status_code = 200 if result['success'] else 400
-        return JSONResponse(result, status_code=status_code)
+        return result, status_code
         
     except json.JSONDecodeError:
         logger.error("Error decodificando JSON")
-        return JSONResponse({'success': False, 'errors': ['JSON inválido']}, status_code=400)
+        return {'success': False, 'errors': ['JSON inválido']}, 400
     except Exception as e:
         logger.error(f"Error en endpoint de previsualización: {str(e)}")
-        return JSONResponse({'success': False, 'errors': [f'Error interno: {str(e)}']}, status_code=500)
+        return {'success': False, 'errors': [f'Error interno: {str(e)}']}, 500
+
+
+async def calculate_preview(request):
+    """Endpoint para previsualización de métricas"""
+    from starlette.responses import JSONResponse
+    
+    result, status_code = await _calculate(await request.body())
+    return JSONResponse(result, status_code=status_code)
+
 
+# Configuración Starlette (construida en el primer acceso a routes / app)
+_starlette_objects: Dict[str, Any] = {}
 
-# Configuración Starlette
-routes = [
-    Route('/preview/calculate', calculate_preview, methods=['POST'])
-]
 
-middleware = [
-    Middleware(CORSMiddleware, 
-              allow_origins=['*'], 
-              allow_methods=['POST'], 
-              allow_headers=['*'])
-]
+def _build_starlette() -> Dict[str, Any]:
+    if not _starlette_objects:
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from starlette.middleware import Middleware
+        from starlette.middleware.cors import CORSMiddleware
+        
+        routes = [
+            Route('/preview/calculate', calculate_preview, methods=['POST'])
+        ]
+        middleware = [
+            Middleware(CORSMiddleware, 
+                      allow_origins=['*'], 
+                      allow_methods=['POST'], 
+                      allow_headers=['*'])
+        ]
+        _starlette_objects.update(
+            routes=routes,
+            middleware=middleware,
+            app=Starlette(routes=routes, middleware=middleware)
+        )
+    return _starlette_objects
+
+
+def __getattr__(name: str) -> Any:
+    """Expone routes, middleware y app sin importar Starlette al cargar el módulo"""
+    if name in ('routes', 'middleware', 'app'):
+        return _build_starlette()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def _asgi_calculate(receive, send) -> None:
+    """Atiende POST /preview/calculate directamente sobre ASGI"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    
+    result, status_code = await _calculate(body)
+    payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode('latin-1')),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
 
-app = Starlette(routes=routes, middleware=middleware)
 
 # Handler para Vercel
 async def handler(request, context=None):
     """Handler principal para deployment serverless"""
-    return await app(request.scope, request.receive, request.send) 
\ No newline at end of file
+    scope = request.scope
+    if scope.get('type') == 'http' and scope.get('method') == 'POST' \
+            and scope.get('path') == '/preview/calculate':
+        return await _asgi_calculate(request.receive, request.send)
+    # Resto de casos (p. ej. preflight CORS) a través de la app Starlette
+    return await _build_starlette()['app'](scope, request.receive, request.send)
@@ -1,24 +1,56 @@
 """
 Data Querying Endpoints - AquaLytics API
 """
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Callable, Awaitable, Tuple
+
 from starlette.applications import Starlette
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from starlette.routing import Route
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+
+from operations import DataQueryService, shared_reference_data
+from utils.db_constants import TIEMPO_15M_ID, TIEMPO_TOTAL_ID
+from utils.response_cache import CachePolicy, add_cache_tags, skip_cache, response_cache
+from utils.view_refresh import view_refresher
+from utils.single_flight import query_flights
+from utils.response_encoding import negotiated_response
+from utils.lazy import lazy_import
 
-from operations import DataQueryService
+logger = logging.getLogger(__name__)
 
 # Instancia global del servicio
 query_service = DataQueryService()
 
+# Límites de /query/batch: sub-consultas por request y sub-consultas en paralelo
+MAX_BATCH_QUERIES = int(os.getenv('AQUALYTICS_BATCH_MAX_QUERIES', '20'))
+BATCH_CONCURRENCY = int(os.getenv('AQUALYTICS_BATCH_CONCURRENCY', '6'))
+
+
+def _respond(request: Request, result: dict, *tags: str, binary: bool = False) -> Response:
+    """
+    Construye la respuesta en el formato negociado y declara sus etiquetas de caché
+    (las respuestas fallidas no se cachean). `binary` habilita MessagePack.
+    """
+    if result.get('success'):
+        add_cache_tags(request, *tags)
+    else:
+        skip_cache(request)
+    return negotiated_response(request, result, binary=binary)
+
 # === Handlers de Endpoints ===
 
 async def get_rankings_handler(request: Request) -> JSONResponse:
     limit = int(request.query_params.get('limit', 10))
     result = await query_service.get_rankings(limit)
-    return JSONResponse(result)
+    return _respond(request, result, binary=True)
 
 async def get_aggregate_handler(request: Request) -> JSONResponse:
     metrics_param = request.query_params.get('metrics', '')
@@ -26,21 +58,47 @@ async def get_aggregate_handler(request: Request) -> JSONResponse:
     if not metrics:
         return JSONResponse({"success": False, "error": "Parámetro 'metrics' es requerido."}, status_code=400)
     result = await query_service.get_aggregate_data(metrics)
-    return JSONResponse(result)
+    return _respond(request, result)
+
+def _downsampling_params(params: Any) -> Dict[str, Any]:
+    """`max_points` y `downsample` (lttb | minmax) como kwargs del servicio; ValueError si son inválidos"""
+    # NumPy se carga con la primera petición que pide reducción
+    parsed = lazy_import('utils.downsampling').parse_downsampling(params.get('max_points'), params.get('downsample'))
+    return parsed or {}
 
 async def get_performance_progress_handler(request: Request) -> JSONResponse:
     days = int(request.query_params.get('days', 30))
-    result = await query_service.get_performance_progress(days)
-    return JSONResponse(result)
+    try:
+        downsampling = _downsampling_params(request.query_params)
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    result = await query_service.get_performance_progress(days, **downsampling)
+    return _respond(request, result, binary=True)
 
 async def get_swimmer_records_handler(request: Request) -> JSONResponse:
     swimmer_id = int(request.path_params['swimmer_id'])
-    result = await query_service.get_swimmer_records(swimmer_id)
-    return JSONResponse(result)
+    try:
+        downsampling = _downsampling_params(request.query_params)
+    except ValueError as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=400)
+    result = await query_service.get_swimmer_records(swimmer_id, **downsampling)
+    return _respond(request, result)
 
 async def get_complete_test_handler(request: Request) -> JSONResponse:
-    result = await query_service.get_complete_test_record()
-    return JSONResponse(result)
+    """Pruebas completas por lotes; requiere al menos un filtro"""
+    params = request.query_params
+    try:
+        filters = {key: int(params[key]) for key in ('nadador_id', 'prueba_id', 'competencia_id') if params.get(key)}
+        limit = min(int(params.get('limit', 100)), 500)
+    except ValueError:
+        return JSONResponse({"success": False, "error": "nadador_id, prueba_id, competencia_id y limit deben ser enteros."}, status_code=400)
+    dates = {key: params[key] for key in ('fecha', 'fecha_desde', 'fecha_hasta') if params.get(key)}
+    if not filters and not dates:
+        return JSONResponse({"success": False, "error": "Indique al menos un filtro: nadador_id, prueba_id, competencia_id, fecha, fecha_desde o fecha_hasta."}, status_code=400)
+    if limit < 1:
+        return JSONResponse({"success": False, "error": "limit debe ser mayor que 0."}, status_code=400)
+    result = await query_service.get_complete_tests(**filters, **dates, limit=limit)
+    return _respond(request, result, binary=True)
 
 async def get_best_times_handler(request: Request) -> JSONResponse:
     try:
@@ -50,12 +108,187 @@ async def get_best_times_handler(request: Request) -> JSONResponse:
     except (KeyError, ValueError):
         return JSONResponse({"success": False, "error": "Parámetros requeridos: style, distance (entero), course."}, status_code=400)
     result = await query_service.get_best_times(style, distance, course)
-    return JSONResponse(result)
+    if result.get('prueba_id') is not None:
+        return _respond(request, result, f"prueba:{result['prueba_id']}:metrica:{TIEMPO_TOTAL_ID}", binary=True)
+    return _respond(request, result, 'pruebas', binary=True)
+
+async def get_leaderboard_handler(request: Request) -> JSONResponse:
+    """Leaderboard en memoria: top-K, posición y percentil de un nadador"""
+    try:
+        prueba_id = request.query_params.get('prueba_id')
+        prueba_id = int(prueba_id) if prueba_id else None
+        metrica_id = int(request.query_params.get('metrica_id', TIEMPO_TOTAL_ID))
+        limit = int(request.query_params.get('limit', 10))
+        swimmer_id = request.query_params.get('swimmer_id')
+        swimmer_id = int(swimmer_id) if swimmer_id else None
+    except ValueError:
+        return JSONResponse({"success": False, "error": "prueba_id, metrica_id, limit y swimmer_id deben ser enteros."}, status_code=400)
+    result = await query_service.get_leaderboard(prueba_id, metrica_id, limit, swimmer_id)
+    return _respond(request, result, binary=True)
 
 async def get_styles_distribution_handler(request: Request) -> JSONResponse:
     """Handler para obtener la distribución de estilos más practicados"""
     result = await query_service.get_styles_distribution()
-    return JSONResponse(result)
+    return _respond(request, result, binary=True)
+
+# === Consultas por lotes ===
+
+def _int_param(params: Dict[str, Any], name: str, default: Any = None) -> Any:
+    value = params.get(name, default)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Parámetro '{name}' debe ser un número entero.")
+
+
+def _required_int_param(params: Dict[str, Any], name: str) -> int:
+    value = _int_param(params, name)
+    if value is None:
+        raise ValueError(f"Parámetro '{name}' es requerido.")
+    return value
+
+
+def _batch_aggregate(params: Dict[str, Any]) -> Awaitable[Dict[str, Any]]:
+    metrics = params.get('metrics', '')
+    if isinstance(metrics, str):
+        metrics = metrics.split(',')
+    metrics = [str(m).strip() for m in metrics if str(m).strip()]
+    if not metrics:
+        raise ValueError("Parámetro 'metrics' es requerido.")
+    return query_service.get_aggregate_data(metrics)
+
+
+def _batch_best_times(params: Dict[str, Any]) -> Awaitable[Dict[str, Any]]:
+    try:
+        return query_service.get_best_times(str(params['style']), int(params['distance']), str(params['course']))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Parámetros requeridos: style, distance (entero), course.")
+
+
+def _batch_complete_test(params: Dict[str, Any]) -> Awaitable[Dict[str, Any]]:
+    try:
+        filters = {key: _int_param(params, key) for key in ('nadador_id', 'prueba_id', 'competencia_id')}
+        limit = min(int(params.get('limit', 100)), 500)
+    except (TypeError, ValueError):
+        raise ValueError("nadador_id, prueba_id, competencia_id y limit deben ser enteros.")
+    filters = {key: value for key, value in filters.items() if value is not None}
+    dates = {key: str(params[key]) for key in ('fecha', 'fecha_desde', 'fecha_hasta') if params.get(key)}
+    if not filters and not dates:
+        raise ValueError("Indique al menos un filtro: nadador_id, prueba_id, competencia_id, fecha, fecha_desde o fecha_hasta.")
+    if limit < 1:
+        raise ValueError("limit debe ser mayor que 0.")
+    return query_service.get_complete_tests(**filters, **dates, limit=limit)
+
+
+def _batch_leaderboard(params: Dict[str, Any]) -> Awaitable[Dict[str, Any]]:
+    try:
+        return query_service.get_leaderboard(
+            _int_param(params, 'prueba_id'), _int_param(params, 'metrica_id', TIEMPO_TOTAL_ID),
+            _int_param(params, 'limit', 10), _int_param(params, 'swimmer_id')
+        )
+    except (TypeError, ValueError):
+        raise ValueError("prueba_id, metrica_id, limit y swimmer_id deben ser enteros.")
+
+
+# Sub-consultas de /query/batch: nombre -> función que valida los parámetros
+# (ValueError con el mensaje para el cliente) y devuelve la corrutina del servicio
+BATCH_QUERIES: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+    'rankings': lambda p: query_service.get_rankings(_int_param(p, 'limit', 10)),
+    'aggregate': _batch_aggregate,
+    'performance-progress': lambda p: query_service.get_performance_progress(
+        _int_param(p, 'days', 30), **_downsampling_params(p)),
+    'swimmer': lambda p: query_service.get_swimmer_records(
+        _required_int_param(p, 'swimmer_id'), **_downsampling_params(p)),
+    'complete_test': _batch_complete_test,
+    'best-times': _batch_best_times,
+    'styles-distribution': lambda p: query_service.get_styles_distribution(),
+    'leaderboard': _batch_leaderboard,
+}
+
+
+def _batch_key(query: str, params: Dict[str, Any]) -> str:
+    """Clave de deduplicación: misma consulta con los mismos parámetros (normalizados como texto)"""
+    return json.dumps([query, {k: str(v) for k, v in params.items()}], sort_keys=True)
+
+
+async def _run_batch_item(query: str, params: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    Ejecuta una sub-consulta: status 400 si los parámetros son inválidos y 500
+    si el servicio falla. Los métodos del servicio son async pero hacen las
+    llamadas a la BD de forma síncrona: cada uno corre en su propio event loop
+    en el threadpool para que las sub-consultas avancen en paralelo.
+    """
+    try:
+        coroutine = BATCH_QUERIES[query](params)
+    except (KeyError, TypeError, ValueError) as e:
+        message = str(e) if isinstance(e, ValueError) else f"Parámetros inválidos para '{query}'."
+        return {"status": 400, "success": False, "error": message}
+
+    start = time.perf_counter()
+    async with semaphore:
+        try:
+            result = await run_in_threadpool(asyncio.run, coroutine)
+        except Exception as e:
+            logger.error(f"Error en sub-consulta {query}: {str(e)}")
+            result = {"success": False, "error": str(e)}
+    item = {"status": 200 if result.get('success') else 500, **result}
+    item['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return item
+
+
+async def query_batch_handler(request: Request) -> Response:
+    """
+    Varias consultas del dashboard en un solo request.
+
+    Body: {"queries": [{"id": "bt100", "query": "best-times", "params": {...}}, ...]}.
+    Las sub-consultas idénticas se ejecutan una vez y las tablas de referencia
+    se leen una vez para todo el batch. Cada resultado lleva su propio status.
+    """
+    try:
+        body = await request.json()
+        queries = body['queries']
+        if not isinstance(queries, list) or not all(isinstance(q, dict) for q in queries):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JSONResponse({"success": False, "error": "Body requerido: {\"queries\": [{\"id\", \"query\", \"params\"}]}"}, status_code=400)
+    if not queries or len(queries) > MAX_BATCH_QUERIES:
+        return JSONResponse({"success": False, "error": f"Entre 1 y {MAX_BATCH_QUERIES} consultas por batch."}, status_code=400)
+
+    items: List[Tuple[str, str, str]] = []
+    unique: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for position, entry in enumerate(queries):
+        query = str(entry.get('query', ''))
+        params = entry.get('params') or {}
+        if not isinstance(params, dict):
+            params = {'_invalid': params}
+        key = _batch_key(query, params)
+        items.append((str(entry.get('id', position)), query, key))
+        unique.setdefault(key, (query, params))
+
+    unknown = {key for key, (query, _) in unique.items() if query not in BATCH_QUERIES}
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    start = time.perf_counter()
+    with shared_reference_data() as reference:
+        # El contexto (tablas de referencia, traza del request) se copia a cada hilo
+        keys = [key for key in unique if key not in unknown]
+        results = dict(zip(keys, await asyncio.gather(
+            *(_run_batch_item(*unique[key], semaphore) for key in keys)
+        )))
+    for key in unknown:
+        results[key] = {"status": 400, "success": False, "error": f"Consulta desconocida: '{unique[key][0]}'. Disponibles: {', '.join(BATCH_QUERIES)}"}
+
+    return negotiated_response(request, {
+        "success": True,
+        "data": {
+            "results": [{"id": item_id, "query": query, **results[key]} for item_id, query, key in items],
+            "executed": len(keys),
+            "deduplicated": len(items) - len(unique),
+            "reference_loads": reference.loads,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+    }, binary=True)
 
 # === Rutas ===
 routes = [
@@ -66,8 +299,28 @@ routes = [
     Route('/query/complete_test', get_complete_test_handler, methods=['GET']),
     Route('/query/best-times', get_best_times_handler, methods=['GET']),
     Route('/query/styles-distribution', get_styles_distribution_handler, methods=['GET']),
+    Route('/query/leaderboard', get_leaderboard_handler, methods=['GET']),
+    Route('/query/batch', query_batch_handler, methods=['POST']),
+]
+
+# === Políticas de caché (TTL en segundos y etiquetas base por ruta) ===
+cache_policies = [
+    CachePolicy('/query/rankings', ttl=60, tags=lambda p, q: [f'metrica:{TIEMPO_15M_ID}']),
+    CachePolicy('/query/aggregate', ttl=300, tags=lambda p, q: ['nadadores', 'competencias', 'pruebas']),
+    CachePolicy('/query/performance-progress', ttl=120, tags=lambda p, q: [f'metrica:{TIEMPO_15M_ID}']),
+    CachePolicy('/query/swimmer/{swimmer_id:int}', ttl=300, tags=lambda p, q: [f"swimmer:{p['swimmer_id']}"]),
+    CachePolicy('/query/complete_test', ttl=300, tags=lambda p, q: ['registros']),
+    CachePolicy('/query/best-times', ttl=300),
+    CachePolicy('/query/styles-distribution', ttl=300, tags=lambda p, q: ['registros']),
 ]
 
+# Las respuestas servidas desde vistas materializadas caducan cuando las vistas se refrescan
+def _on_views_refreshed() -> None:
+    response_cache.invalidate_tags({'registros', f'metrica:{TIEMPO_15M_ID}'})
+    query_flights.invalidate()
+
+view_refresher.on_refreshed = _on_views_refreshed
+
 # === Aplicación Starlette (para pruebas aisladas) ===
 if __name__ == "__main__":
     middleware = [
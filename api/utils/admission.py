@@ -0,0 +1,333 @@
+"""
+Admission Control - AquaLytics API
+Control de admisión por ruta y clase de prioridad: límites de concurrencia con
+colas de espera acotadas, rechazo inmediato (503 + Retry-After) cuando la cola
+está llena y plazos por ruta que se comprueban antes de cada consulta a la BD
+(activo con AQUALYTICS_ADMISSION=1).
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Deque
+
+from starlette.responses import JSONResponse
+
+from utils.instrumentation import registry, add_execute_guard
+
+logger = logging.getLogger(__name__)
+
+admission_queue_wait_seconds = registry.histogram(
+    'aqualytics_admission_queue_wait_seconds',
+    'Espera en cola de admisión por ruta y prioridad',
+    ('route', 'priority'),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+admission_rejections_total = registry.counter(
+    'aqualytics_admission_rejections_total',
+    'Requests rechazados con 503 (queue_full, queue_timeout)',
+    ('route', 'priority', 'reason')
+)
+admission_deadline_exceeded_total = registry.counter(
+    'aqualytics_admission_deadline_exceeded_total',
+    'Consultas a la BD canceladas por plazo agotado',
+    ('route',)
+)
+admission_active = registry.gauge(
+    'aqualytics_admission_active', 'Requests admitidos en curso por limitador', ('limiter',)
+)
+admission_queued = registry.gauge(
+    'aqualytics_admission_queued', 'Requests en cola por limitador', ('limiter',)
+)
+
+
+def admission_enabled() -> bool:
+    return os.getenv('AQUALYTICS_ADMISSION') == '1'
+
+
+class Rejected(Exception):
+    """El request no se admite: cola llena o espera agotada"""
+
+    def __init__(self, reason: str, limiter: 'Limiter'):
+        super().__init__(f"{limiter.name}: {reason}")
+        self.reason = reason
+        self.limiter = limiter
+
+
+class DeadlineExceeded(TimeoutError):
+    """El request agotó su plazo antes de una consulta a la BD"""
+
+
+class Limiter:
+    """
+    Semáforo con cola FIFO acotada para un solo event loop. Al liberar, la
+    plaza pasa directamente al primero de la cola, de modo que los que llegan
+    después no adelantan a los que esperan. `max_concurrent <= 0` no limita.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._stats = {'admitted': 0, 'enqueued': 0, 'queue_full': 0, 'queue_timeout': 0}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> None:
+        if self.max_concurrent <= 0 or (self.active < self.max_concurrent and not self._waiters):
+            self._admit()
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._stats['queue_full'] += 1
+            raise Rejected('queue_full', self)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._stats['enqueued'] += 1
+        admission_queued.set(len(self._waiters), limiter=self.name)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._stats['queue_timeout'] += 1
+            raise Rejected('queue_timeout', self)
+        except asyncio.CancelledError:
+            # La plaza pudo llegar justo antes de la cancelación: se devuelve
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            admission_queued.set(len(self._waiters), limiter=self.name)
+        # release() ya contó la plaza traspasada en `active`
+        self._stats['admitted'] += 1
+
+    def _admit(self) -> None:
+        self.active += 1
+        self._stats['admitted'] += 1
+        admission_active.set(self.active, limiter=self.name)
+
+    def release(self) -> None:
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                admission_queued.set(len(self._waiters), limiter=self.name)
+                return
+        self.active -= 1
+        admission_active.set(self.active, limiter=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limiter': self.name,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'queued': len(self._waiters),
+            **self._stats
+        }
+
+
+@dataclass
+class PriorityClass:
+    """Clase de prioridad: un límite compartido por todas sus rutas"""
+    name: str
+    max_concurrent: int  # <= 0: sin límite
+    max_queue: int
+    queue_timeout: float  # Segundos máximos en cola
+    retry_after: int  # Segundos sugeridos en Retry-After
+
+
+@dataclass
+class AdmissionPolicy:
+    """Política de admisión para una ruta (o prefijo con `prefix=True`)"""
+    path: str  # Plantilla de ruta, p. ej. '/query/swimmer/{swimmer_id:int}'
+    priority: str
+    max_concurrent: int = 0  # Límite propio de la ruta, además del de la clase
+    max_queue: int = 0
+    deadline: Optional[float] = None  # Segundos desde la llegada del request
+    prefix: bool = False
+
+    def __post_init__(self):
+        pattern = re.sub(r'\{(\w+)(?::\w+)?\}', r'[^/]+', self.path)
+        self._regex = re.compile(f"^{pattern}{'' if self.prefix else '$'}")
+
+    def match(self, path: str) -> bool:
+        return self._regex.match(path) is not None
+
+
+def default_priority_classes() -> Dict[str, PriorityClass]:
+    """
+    interactive no se limita (la previsualización debe responder siempre);
+    dashboard e ingest comparten límites por clase configurables con
+    AQUALYTICS_ADMISSION_DASHBOARD_CONCURRENCY / AQUALYTICS_ADMISSION_INGEST_CONCURRENCY.
+    """
+    dashboard = int(os.getenv('AQUALYTICS_ADMISSION_DASHBOARD_CONCURRENCY', '8'))
+    ingest = int(os.getenv('AQUALYTICS_ADMISSION_INGEST_CONCURRENCY', '2'))
+    return {
+        'interactive': PriorityClass('interactive', max_concurrent=0, max_queue=0, queue_timeout=0, retry_after=1),
+        'dashboard': PriorityClass('dashboard', max_concurrent=dashboard, max_queue=dashboard * 2,
+                                   queue_timeout=2.0, retry_after=2),
+        'ingest': PriorityClass('ingest', max_concurrent=ingest, max_queue=ingest * 2,
+                                queue_timeout=10.0, retry_after=5),
+    }
+
+
+@dataclass
+class _Deadline:
+    """Plazo del request en curso (compartido con los hilos que copian el contexto)"""
+    route: str
+    expires_at: float
+    exceeded: bool = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.perf_counter()
+
+
+_current_deadline: ContextVar[Optional[_Deadline]] = ContextVar('aqualytics_deadline', default=None)
+
+
+def remaining_time() -> Optional[float]:
+    """Segundos que le quedan al request en curso (None sin plazo)"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def _check_deadline(table: str) -> None:
+    deadline = _current_deadline.get()
+    if deadline is not None and deadline.remaining() <= 0:
+        if not deadline.exceeded:
+            admission_deadline_exceeded_total.inc(route=deadline.route)
+        deadline.exceeded = True
+        raise DeadlineExceeded(f"Plazo de {deadline.route} agotado antes de consultar {table}")
+
+
+add_execute_guard(_check_deadline)
+
+
+class AdmissionController:
+    """Limitadores por clase y por ruta para el servidor unificado"""
+
+    def __init__(self, policies: List[AdmissionPolicy],
+                 classes: Optional[Dict[str, PriorityClass]] = None):
+        self.classes = classes if classes is not None else default_priority_classes()
+        self.policies = policies
+        self._class_limiters = {
+            name: Limiter(f"class:{name}", c.max_concurrent, c.max_queue) for name, c in self.classes.items()
+        }
+        self._route_limiters = {
+            p.path: Limiter(f"route:{p.path}", p.max_concurrent, p.max_queue)
+            for p in policies if p.max_concurrent > 0
+        }
+        self._stats = {'admitted': 0, 'rejected': 0}
+
+    def match(self, path: str) -> Optional[AdmissionPolicy]:
+        for policy in self.policies:
+            if policy.match(path):
+                return policy
+        return None
+
+    def _limiters(self, policy: AdmissionPolicy) -> List[Limiter]:
+        limiters = [self._class_limiters[policy.priority]]
+        if policy.path in self._route_limiters:
+            limiters.append(self._route_limiters[policy.path])
+        return limiters
+
+    async def admit(self, policy: AdmissionPolicy) -> float:
+        """Toma las plazas de la clase y de la ruta (en ese orden); retorna la espera en segundos"""
+        priority = self.classes[policy.priority]
+        timeout = priority.queue_timeout
+        if policy.deadline is not None:
+            timeout = min(timeout, policy.deadline)
+        start = time.perf_counter()
+        acquired: List[Limiter] = []
+        try:
+            for limiter in self._limiters(policy):
+                await limiter.acquire(max(timeout - (time.perf_counter() - start), 0.0))
+                acquired.append(limiter)
+        except BaseException as e:
+            for limiter in reversed(acquired):
+                limiter.release()
+            if isinstance(e, Rejected):
+                self._stats['rejected'] += 1
+                admission_rejections_total.inc(route=policy.path, priority=policy.priority, reason=e.reason)
+            raise
+        waited = time.perf_counter() - start
+        self._stats['admitted'] += 1
+        admission_queue_wait_seconds.observe(waited, route=policy.path, priority=policy.priority)
+        return waited
+
+    def release(self, policy: AdmissionPolicy) -> None:
+        for limiter in reversed(self._limiters(policy)):
+            limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        limiters = list(self._class_limiters.values()) + list(self._route_limiters.values())
+        return {
+            'enabled': admission_enabled(),
+            **self._stats,
+            'deadline_exceeded': sum(v for _, _, v in admission_deadline_exceeded_total.samples()),
+            'active': sum(l.active for l in self._class_limiters.values()),
+            'queued': sum(l.queued for l in limiters),
+            'limiters': [l.stats() for l in limiters]
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI de admisión (con AQUALYTICS_ADMISSION=1). Los requests
+    rechazados reciben 503 con Retry-After sin llegar a la aplicación; los
+    admitidos llevan su plazo en el contexto y, si una consulta lo agotó, la
+    respuesta sale como 504 (los servicios responden sus errores con
+    success=false y status 200, así que no basta con mirar el status).
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not admission_enabled():
+            await self.app(scope, receive, send)
+            return
+        policy = self.controller.match(scope['path'])
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.perf_counter()
+        try:
+            await self.controller.admit(policy)
+        except Rejected as e:
+            retry_after = self.controller.classes[policy.priority].retry_after
+            response = JSONResponse(
+                {"success": False, "error": f"Servicio saturado ({e.reason}), reintente en {retry_after}s"},
+                status_code=503,
+                headers={'Retry-After': str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        deadline = _Deadline(policy.path, arrival + policy.deadline) if policy.deadline is not None else None
+        token = _current_deadline.set(deadline)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and deadline is not None and deadline.exceeded:
+                message = dict(message)
+                message['status'] = 504
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_deadline.reset(token)
+            self.controller.release(policy)
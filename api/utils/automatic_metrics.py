@@ -0,0 +1,176 @@
+"""
+Automatic Metrics - AquaLytics API
+Métricas automáticas por lotes: agrupa los registros manuales por prueba completa,
+las calcula con SwimmingMetricsCalculator.calculate_batch y genera los registros
+automáticos que se guardan junto a los manuales.
+"""
+
+import logging
+from typing import Dict, List, Optional, Any, Iterable, Set, Tuple
+
+import numpy as np
+
+from calculations.swimming_metrics import SwimmingMetricsCalculator
+from utils.supabase_client import MetricRecord
+from utils.validation_schema import SWIMMING_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+# Campo de MetricCalculationInput por (métrica manual, segmento); inverso del
+# mapeo de columnas del CSV en CSVProcessor.transform_to_long_format
+MANUAL_INPUTS: Dict[Tuple[str, Optional[int]], str] = {
+    ('Tiempo 15m', 1): 't15_1',
+    ('Tiempo 15m', 2): 't15_2',
+    ('Brazadas por Tramo', 1): 'brz_1',
+    ('Brazadas por Tramo', 2): 'brz_2',
+    ('Tiempo por Tramo', 1): 't25_1',
+    ('Tiempo por Tramo', 2): 't25_2',
+    ('Flecha por Tramo', 1): 'f1',
+    ('Flecha por Tramo', 2): 'f2',
+    ('Tiempo Total', None): 't_total',
+    ('Brazadas Totales', None): 'brz_total',
+}
+
+# Métrica automática en 'metricas' -> (campo calculado, segmento con que se guarda)
+AUTOMATIC_METRICS: Dict[str, Tuple[str, Optional[int]]] = {
+    'Velocidad Promedio': ('v_promedio', None),
+    'V1': ('v1', 1),
+    'V2': ('v2', 2),
+    'Distancia por Brazada': ('dist_x_brz', None),
+    'Distancia sin Flecha': ('dist_sin_f', None),
+    'F promedio': ('f_promedio', None),
+}
+
+TestKey = Tuple[int, int, str]  # (id_nadador, prueba_id, fecha)
+
+_calculator = SwimmingMetricsCalculator()
+
+
+def calculate(inputs: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Métricas automáticas por nombre de 'metricas' (NaN donde no se pueden calcular)"""
+    results = _calculator.calculate_batch(inputs)
+    return {name: results[field] for name, (field, _) in AUTOMATIC_METRICS.items()}
+
+
+def build_automatic_records(records: Iterable[Any], metric_names: Dict[int, str],
+                            distances: Dict[int, float],
+                            existing: Optional[Set[Tuple[TestKey, int]]] = None) -> List[MetricRecord]:
+    """
+    Registros automáticos para las pruebas completas presentes en `records`.
+
+    `records` son MetricRecord o filas de `registros`; las pruebas se agrupan
+    por (id_nadador, prueba_id, fecha) y heredan competencia y fase del primer
+    registro. `existing` contiene ((nadador, prueba, fecha), metrica_id) ya
+    guardados, que no se vuelven a generar.
+    """
+    metric_ids = {name: metrica_id for metrica_id, name in metric_names.items()}
+    tests: Dict[TestKey, Dict[str, Any]] = {}
+    for record in records:
+        get = record.get if isinstance(record, dict) else lambda name: getattr(record, name)
+        field = MANUAL_INPUTS.get((metric_names.get(get('metrica_id')), get('segmento')))
+        if field is None:
+            continue
+        key = (get('id_nadador'), get('prueba_id'), str(get('fecha')))
+        test = tests.get(key)
+        if test is None:
+            test = tests[key] = {'competencia_id': get('competencia_id'), 'fase_id': get('fase_id'), 'inputs': {}}
+        test['inputs'][field] = float(get('valor'))
+
+    keys = [key for key in tests if key[1] in distances]
+    if not keys:
+        return []
+
+    # Un array por campo de entrada, alineado con `keys`
+    fields = set(MANUAL_INPUTS.values())
+    inputs = {
+        field: np.array([tests[key]['inputs'].get(field, np.nan) for key in keys], dtype=float)
+        for field in fields
+    }
+    inputs['distancia_total'] = np.array([distances[key[1]] for key in keys], dtype=float)
+    results = calculate(inputs)
+
+    automatic = []
+    for name, values in results.items():
+        metrica_id = metric_ids.get(name)
+        if metrica_id is None:
+            continue
+        segmento = AUTOMATIC_METRICS[name][1]
+        for i in np.flatnonzero(np.isfinite(values)):
+            key = keys[i]
+            if existing and (key, metrica_id) in existing:
+                continue
+            test = tests[key]
+            automatic.append(MetricRecord(
+                id_nadador=key[0],
+                prueba_id=key[1],
+                metrica_id=metrica_id,
+                valor=float(values[i]),
+                fecha=key[2],
+                segmento=segmento,
+                competencia_id=test['competencia_id'],
+                fase_id=test['fase_id']
+            ))
+    return automatic
+
+
+def load_reference(supabase_client, prueba_ids: Iterable[int]) -> Tuple[Dict[int, str], Dict[int, float]]:
+    """Nombres de todas las métricas y distancia (m) de las pruebas indicadas"""
+    metric_names = {m['metrica_id']: m['nombre'] for m in supabase_client.get_all_metricas() or []}
+    distances: Dict[int, float] = {}
+    prueba_ids = sorted(set(prueba_ids))
+    if prueba_ids:
+        for p in supabase_client.client.table('pruebas').select('id, distancias(distancia)') \
+                .in_('id', prueba_ids).execute().data or []:
+            if p.get('distancias'):
+                distances[p['id']] = float(p['distancias']['distancia'])
+    return metric_names, distances
+
+
+def automatic_metric_ids(metric_names: Dict[int, str]) -> List[int]:
+    return [metrica_id for metrica_id, name in metric_names.items() if name in AUTOMATIC_METRICS]
+
+
+def _test_key(row: Dict[str, Any]) -> TestKey:
+    return (row['id_nadador'], row['prueba_id'], str(row['fecha']))
+
+
+def completed_test_records(supabase_client, records: Iterable[MetricRecord]) -> List[MetricRecord]:
+    """
+    Registros automáticos que faltan en las pruebas de `records`, ya
+    guardados, que están completas en 'registros' (con todos los campos
+    requeridos del esquema). Para registros individuales, que llegan de uno
+    en uno: la prueba se calcula cuando entra su último dato.
+    """
+    keys = {(r.id_nadador, r.prueba_id, str(r.fecha)) for r in records}
+    if not keys:
+        return []
+    metric_names, distances = load_reference(supabase_client, (key[1] for key in keys))
+    auto_ids = set(automatic_metric_ids(metric_names))
+    if not auto_ids:
+        return []
+
+    rows = [
+        row for row in supabase_client.client.table('registros')
+        .select('id_nadador, prueba_id, metrica_id, valor, segmento, fecha, competencia_id, fase_id')
+        .in_('id_nadador', sorted({key[0] for key in keys}))
+        .in_('prueba_id', sorted({key[1] for key in keys}))
+        .in_('fecha', sorted({key[2] for key in keys}))
+        .execute().data or []
+        if _test_key(row) in keys
+    ]
+
+    # Campos manuales presentes por prueba
+    present: Dict[TestKey, Set[str]] = {}
+    for row in rows:
+        field = MANUAL_INPUTS.get((metric_names.get(row['metrica_id']), row.get('segmento')))
+        if field is not None:
+            present.setdefault(_test_key(row), set()).add(field)
+    required = set(SWIMMING_SCHEMA.required_fields)
+    complete = {key for key, fields in present.items() if required <= fields}
+    if not complete:
+        return []
+
+    existing = {(_test_key(row), row['metrica_id']) for row in rows if row['metrica_id'] in auto_ids}
+    return build_automatic_records(
+        [row for row in rows if _test_key(row) in complete], metric_names, distances, existing
+    )
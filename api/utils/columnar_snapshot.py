@@ -0,0 +1,143 @@
+"""
+Columnar Snapshot - AquaLytics API
+Snapshot en disco del almacén columnar: un .npy por columna (mapeable en memoria,
+páginas compartidas entre workers), índices de tablas de referencia y un manifiesto
+versionado con el high-water mark.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+REFERENCE_FILE = 'reference.json'
+
+Segment = Dict[str, np.ndarray]
+
+
+def _current_path(directory: str) -> Optional[str]:
+    """Snapshot vigente según el puntero CURRENT"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isdir(path) else None
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    path = _current_path(directory)
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest['path'] = path
+    return manifest
+
+
+def write_snapshot(directory: str, segments: List[Segment], schema: Dict[str, Any],
+                   reference: Dict[str, Any], meta: Dict[str, Any], keep: int = 2) -> Dict[str, Any]:
+    """
+    Escribe un snapshot nuevo y lo publica de forma atómica.
+
+    Las columnas se escriben directamente en archivos .npy (sin concatenar en
+    memoria), el manifiesto se escribe al final y el directorio se renombra;
+    luego se reemplaza el puntero CURRENT con os.replace.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rows = sum(len(seg[next(iter(schema))]) for seg in segments)
+    name = f"snapshot-{meta['high_water_mark']}-{uuid.uuid4().hex[:8]}"
+    tmp = os.path.join(directory, f".tmp-{name}")
+    os.makedirs(tmp)
+    try:
+        for column, dtype in schema.items():
+            out = np.lib.format.open_memmap(
+                os.path.join(tmp, f"{column}.npy"), mode='w+', dtype=dtype, shape=(rows,)
+            )
+            pos = 0
+            for seg in segments:
+                n = len(seg[column])
+                out[pos:pos + n] = seg[column]
+                pos += n
+            out.flush()
+            del out
+        with open(os.path.join(tmp, REFERENCE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(reference, f, ensure_ascii=False)
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'columns': {column: np.dtype(dtype).str for column, dtype in schema.items()},
+            'rows': rows,
+            'created_at': time.time(),
+            **meta
+        }
+        with open(os.path.join(tmp, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        final = os.path.join(directory, name)
+        os.rename(tmp, final)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(directory, f".{CURRENT_FILE}-{uuid.uuid4().hex[:8]}")
+    with open(pointer, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+    _prune(directory, keep)
+    manifest['path'] = final
+    logger.info(f"Snapshot columnar escrito: {rows} filas, high-water mark {meta['high_water_mark']} ({final})")
+    return manifest
+
+
+def _prune(directory: str, keep: int) -> None:
+    """Borra snapshots antiguos (los workers que aún los mapean conservan sus páginas)"""
+    current = _current_path(directory)
+    snapshots = sorted(
+        (os.path.join(directory, d) for d in os.listdir(directory) if d.startswith('snapshot-')),
+        key=os.path.getmtime, reverse=True
+    )
+    for path in snapshots[keep:]:
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_snapshot(directory: str, schema: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], Segment, Dict[str, Any]]]:
+    """
+    Mapea en memoria el snapshot vigente (solo lectura, sin copiar).
+
+    Devuelve None si no hay snapshot, si su versión/esquema no coincide o si
+    no se puede leer (p. ej. otro worker lo podó entre leer CURRENT y abrir
+    los ficheros); el llamador recurre entonces a la BD.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    expected = {column: np.dtype(dtype).str for column, dtype in schema.items()}
+    if manifest.get('format_version') != FORMAT_VERSION or manifest.get('columns') != expected:
+        logger.warning(f"Snapshot columnar incompatible en {manifest['path']}: se ignora")
+        return None
+    path = manifest['path']
+    try:
+        columns = {
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+            for column in schema
+        }
+        with open(os.path.join(path, REFERENCE_FILE), encoding='utf-8') as f:
+            reference = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudo leer el snapshot columnar {path}: {str(e)}")
+        return None
+    return manifest, columns, reference
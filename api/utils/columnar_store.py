@@ -0,0 +1,595 @@
+"""
+Columnar Store - AquaLytics API
+Copia columnar en memoria de `registros` (arrays NumPy) con nombres codificados por
+diccionario, refresco incremental por high-water mark y consultas vectorizadas.
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from utils.downsampling import downsample_series
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+
+# Columnas de registros y su tipo en memoria (~43 bytes por fila)
+COLUMNS: Dict[str, Any] = {
+    'registro_id': np.int32,
+    'id_nadador': np.int32,
+    'prueba_id': np.int16,
+    'metrica_id': np.int16,
+    'competencia_id': np.int32,   # -1 = NULL
+    'fase_id': np.int16,          # -1 = NULL
+    'segmento': np.int8,          # -1 = NULL
+    'valor': np.float64,
+    'fecha': 'datetime64[D]',
+    'created_at': 'datetime64[us]',
+}
+NULLABLE = ('competencia_id', 'fase_id', 'segmento')
+SELECT = ', '.join(COLUMNS)
+
+
+def _parse_timestamp(value: Optional[str]) -> str:
+    """Timestamp ISO de PostgREST (UTC con sufijo de zona) a formato NumPy"""
+    if not value:
+        return 'NaT'
+    value = str(value).replace(' ', 'T')
+    for sep in ('+', 'Z'):
+        cut = value.find(sep, 10)
+        if cut != -1:
+            value = value[:cut]
+    return value
+
+
+def _page_to_columns(page: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Convierte una página de filas (dicts) en arrays por columna"""
+    n = len(page)
+    out: Dict[str, np.ndarray] = {}
+    for name, dtype in COLUMNS.items():
+        if name == 'fecha':
+            out[name] = np.array([r.get('fecha') or 'NaT' for r in page], dtype=dtype)
+        elif name == 'created_at':
+            out[name] = np.array([_parse_timestamp(r.get('created_at')) for r in page], dtype=dtype)
+        elif name == 'valor':
+            out[name] = np.fromiter(
+                (np.nan if r.get('valor') is None else r['valor'] for r in page), dtype=dtype, count=n
+            )
+        elif name in NULLABLE:
+            out[name] = np.fromiter(
+                (-1 if r.get(name) is None else r[name] for r in page), dtype=dtype, count=n
+            )
+        else:
+            out[name] = np.fromiter((r[name] for r in page), dtype=dtype, count=n)
+    return out
+
+
+class NameDictionary:
+    """Codificación por diccionario id -> nombre con búsqueda vectorizada"""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int32)
+        self.names = np.empty(0, dtype=object)
+
+    def update(self, mapping: Dict[int, str]) -> None:
+        if not mapping:
+            return
+        merged = dict(zip(self.ids.tolist(), self.names.tolist()))
+        merged.update(mapping)
+        ids = np.fromiter(merged.keys(), dtype=np.int32, count=len(merged))
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.names = np.array(list(merged.values()), dtype=object)[order]
+
+    def missing(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.unique(ids[ids >= 0])
+        return ids[~np.isin(ids, self.ids)]
+
+    def lookup(self, ids: np.ndarray, default: str = 'N/A') -> np.ndarray:
+        """Nombres para un array de ids (default para los desconocidos)"""
+        out = np.full(len(ids), default, dtype=object)
+        if len(self.ids):
+            pos = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+            found = self.ids[pos] == ids
+            out[found] = self.names[pos[found]]
+        return out
+
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.names.nbytes + sum(len(n) + 49 for n in self.names.tolist())
+
+
+def _empty_segment() -> Dict[str, np.ndarray]:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def _seg_len(seg: Dict[str, np.ndarray]) -> int:
+    return len(seg['registro_id'])
+
+
+class RegistrosStore:
+    """
+    Snapshot columnar de `registros` para consultas analíticas.
+
+    Los datos viven en dos segmentos: `base` (carga completa o snapshot en
+    disco mapeado en memoria, compartido entre workers) y `delta` (filas
+    nuevas en memoria propia). Se carga en el primer uso y luego trae solo
+    filas con registro_id mayor que el high-water mark (cada
+    `refresh_interval` segundos o tras `mark_stale()` desde la ingesta).
+    Como una transacción larga puede confirmar un registro_id menor que el
+    mark, cada refresco relee además las filas creadas en los últimos
+    `late_window` segundos y descarta las ya cargadas; solo `reload()`
+    garantiza filas confirmadas más tarde que eso. Las ediciones y borrados
+    de filas existentes también requieren `reload()`.
+
+    Con `snapshot_dir`, el arranque mapea el último snapshot y solo pide a
+    la BD las filas posteriores; tras una carga completa, o cuando el delta
+    supera `snapshot_delta_rows`, se escribe un snapshot nuevo.
+    """
+
+    def __init__(self, refresh_interval: float = 30.0, snapshot_dir: Optional[str] = None,
+                 snapshot_delta_rows: int = 50000, late_window: float = 60.0):
+        self.refresh_interval = refresh_interval
+        self.late_window = late_window
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_delta_rows = snapshot_delta_rows
+        self.base = _empty_segment()
+        self.delta = _empty_segment()
+        self.snapshot: Optional[Dict[str, Any]] = None
+        self.swimmers = NameDictionary()
+        self.competitions = NameDictionary()
+        self.metricas: Dict[int, Dict[str, Any]] = {}
+        self.pruebas: Dict[int, Dict[str, Any]] = {}
+        self.estilos: Dict[int, str] = {}
+        self._prueba_estilo = np.empty(0, dtype=np.int16)
+        self.high_water_mark = 0
+        self.max_created_at: Optional[str] = None
+        self._client = None
+        self._lock = threading.RLock()
+        self._loaded_at: Optional[float] = None
+        self._refreshed_at = 0.0
+        self._stale = False
+        self._stats: Dict[str, Any] = {}
+
+    @property
+    def segments(self) -> List[Dict[str, np.ndarray]]:
+        return [seg for seg in (self.base, self.delta) if _seg_len(seg)]
+
+    def __len__(self) -> int:
+        return _seg_len(self.base) + _seg_len(self.delta)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    # === Carga y refresco ===
+
+    def ensure_fresh(self, supabase_client) -> 'RegistrosStore':
+        """Carga en el primer uso (snapshot o BD); refresco incremental si está marcado o vencido"""
+        if not self.is_loaded:
+            with self._lock:
+                if self.is_loaded:
+                    return self
+                self._client = supabase_client
+                if self.snapshot_dir and self.load_snapshot():
+                    self.refresh()
+                else:
+                    self.reload(supabase_client)
+        elif self._stale or time.time() - self._refreshed_at > self.refresh_interval:
+            self.refresh()
+        return self
+
+    def mark_stale(self) -> None:
+        """La ingesta insertó filas: la próxima consulta refresca antes de responder"""
+        self._stale = True
+
+    def reload(self, supabase_client) -> Dict[str, Any]:
+        """Carga completa de tablas de referencia y registros"""
+        start = time.perf_counter()
+        with self._lock:
+            self._client = supabase_client
+            self._load_reference()
+            self.base, self.delta = _empty_segment(), _empty_segment()
+            self.snapshot = None
+            self.high_water_mark = 0
+            self.max_created_at = None
+            self.swimmers = NameDictionary()
+            self.competitions = NameDictionary()
+            rows = self._fetch_new()
+            self.base, self.delta = self.delta, _empty_segment()
+            self._loaded_at = time.time()
+            self._stats['load_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self._stats['loaded_from'] = 'database'
+            if self.snapshot_dir:
+                self.write_snapshot()
+        logger.info(f"Almacén columnar cargado: {rows} registros en {self._stats['load_ms']}ms")
+        return self.stats()
+
+    def refresh(self) -> int:
+        """Trae solo las filas nuevas desde el high-water mark"""
+        with self._lock:
+            start = time.perf_counter()
+            rows = self._fetch_new()
+            self._stats['last_refresh_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self._stats['last_refresh_rows'] = rows
+            if self.snapshot_dir and _seg_len(self.delta) >= self.snapshot_delta_rows:
+                self.write_snapshot()
+        return rows
+
+    # === Snapshot en disco ===
+
+    def _reference(self) -> Dict[str, Any]:
+        return {
+            'metricas': list(self.metricas.values()),
+            'pruebas': list(self.pruebas.values()),
+            'estilos': [{'estilo_id': k, 'nombre': v} for k, v in self.estilos.items()],
+            'swimmers': {'ids': self.swimmers.ids.tolist(), 'names': self.swimmers.names.tolist()},
+            'competitions': {'ids': self.competitions.ids.tolist(), 'names': self.competitions.names.tolist()},
+        }
+
+    def _apply_reference(self, reference: Dict[str, Any]) -> None:
+        self.metricas = {m['metrica_id']: m for m in reference['metricas']}
+        self.pruebas = {p['id']: p for p in reference['pruebas']}
+        self.estilos = {e['estilo_id']: e['nombre'] for e in reference['estilos']}
+        self._build_prueba_lookup()
+        self.swimmers = NameDictionary()
+        self.swimmers.update(dict(zip(reference['swimmers']['ids'], reference['swimmers']['names'])))
+        self.competitions = NameDictionary()
+        self.competitions.update(dict(zip(reference['competitions']['ids'], reference['competitions']['names'])))
+
+    def load_snapshot(self) -> bool:
+        """Mapea el snapshot vigente como segmento base (sin consultar la BD)"""
+        start = time.perf_counter()
+        with self._lock:
+            if not self._map_snapshot():
+                return False
+            self._loaded_at = time.time()
+            self._refreshed_at = 0.0
+            self._stats['load_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self._stats['loaded_from'] = 'snapshot'
+        logger.info(f"Snapshot columnar mapeado: {self.snapshot['rows']} filas, high-water mark {self.high_water_mark}")
+        return True
+
+    def _map_snapshot(self) -> bool:
+        from utils.columnar_snapshot import read_snapshot
+
+        loaded = read_snapshot(self.snapshot_dir, COLUMNS)
+        if loaded is None:
+            return False
+        manifest, columns, reference = loaded
+        self.base, self.delta = columns, _empty_segment()
+        self._apply_reference(reference)
+        self.snapshot = manifest
+        self.high_water_mark = manifest['high_water_mark']
+        self.max_created_at = manifest.get('max_created_at')
+        return True
+
+    def write_snapshot(self) -> Dict[str, Any]:
+        """
+        Escribe base + delta como snapshot nuevo y pasa a mapearlo. Si otro
+        worker ya publicó uno igual o más reciente, se mapea ese en su lugar.
+        """
+        from utils.columnar_snapshot import FORMAT_VERSION, read_manifest, write_snapshot
+
+        with self._lock:
+            current = read_manifest(self.snapshot_dir)
+            if current is None or current.get('format_version') != FORMAT_VERSION \
+                    or current.get('high_water_mark', 0) < self.high_water_mark:
+                write_snapshot(
+                    self.snapshot_dir, self.segments, COLUMNS, self._reference(),
+                    {'high_water_mark': self.high_water_mark, 'max_created_at': self.max_created_at}
+                )
+            hwm = self.high_water_mark
+            self._map_snapshot()
+            if self.high_water_mark < hwm:
+                # El snapshot publicado es anterior a nuestras filas: traerlas de nuevo
+                self._fetch_new()
+            self._refreshed_at = time.time()
+            return self.snapshot
+
+    def _load_reference(self) -> None:
+        client = self._client.client
+        self.metricas = {m['metrica_id']: m for m in client.table('metricas').select('*').execute().data or []}
+        estilos = {e['estilo_id']: e for e in client.table('estilos').select('*').execute().data or []}
+        distancias = {d['distancia_id']: d for d in client.table('distancias').select('*').execute().data or []}
+        self.estilos = {k: v.get('nombre') for k, v in estilos.items()}
+        pruebas = client.table('pruebas').select('*').execute().data or []
+        # Filas de pruebas con sus relaciones embebidas, como las devuelve PostgREST
+        self.pruebas = {
+            p['id']: {**p, 'distancias': distancias.get(p.get('distancia_id')),
+                      'estilos': estilos.get(p.get('estilo_id'))}
+            for p in pruebas
+        }
+        self._build_prueba_lookup()
+
+    def _build_prueba_lookup(self) -> None:
+        lookup = np.full(max(self.pruebas, default=0) + 1, -1, dtype=np.int16)
+        for prueba_id, p in self.pruebas.items():
+            if p.get('estilo_id') is not None:
+                lookup[prueba_id] = p['estilo_id']
+        self._prueba_estilo = lookup
+
+    def _fetch_new(self) -> int:
+        client = self._client.client
+        previous_mark, previous_created = self.high_water_mark, self.max_created_at
+        chunks = []
+        rows = 0
+        while True:
+            page = client.table('registros').select(SELECT) \
+                .gt('registro_id', self.high_water_mark) \
+                .order('registro_id') \
+                .limit(PAGE_SIZE) \
+                .execute().data or []
+            if not page:
+                break
+            chunk = _page_to_columns(page)
+            chunks.append(chunk)
+            rows += len(page)
+            self.high_water_mark = int(chunk['registro_id'][-1])
+            created = [r['created_at'] for r in page if r.get('created_at')]
+            if created:
+                self.max_created_at = max([self.max_created_at or ''] + created)
+            if len(page) < PAGE_SIZE:
+                break
+
+        if previous_mark and previous_created and self.late_window > 0:
+            late = self._fetch_late(previous_mark, previous_created)
+            if late is not None:
+                chunks.append(late)
+                rows += _seg_len(late)
+
+        if chunks:
+            # Solo el delta (memoria propia) crece; la base mapeada no se copia
+            self.delta = {
+                name: np.concatenate([self.delta[name]] + [c[name] for c in chunks])
+                for name in COLUMNS
+            }
+            self._resolve_names(
+                np.concatenate([c['id_nadador'] for c in chunks]),
+                np.concatenate([c['competencia_id'] for c in chunks])
+            )
+            if any(int(c['prueba_id'].max()) >= len(self._prueba_estilo) for c in chunks):
+                self._load_reference()
+        self._stale = False
+        self._refreshed_at = time.time()
+        return rows
+
+    def _fetch_late(self, mark: int, created_at: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Filas con registro_id <= mark creadas hasta `late_window` segundos antes
+        del último created_at visto que aún no están en memoria (confirmadas
+        después del refresco anterior con un id menor que el mark).
+        """
+        try:
+            since = datetime.fromisoformat(created_at.replace('Z', '+00:00')) - timedelta(seconds=self.late_window)
+        except ValueError:
+            logger.warning(f"created_at no reconocido, sin relectura de filas tardías: {created_at}")
+            return None
+        client = self._client.client
+        page_rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = client.table('registros').select(SELECT) \
+                .lte('registro_id', mark) \
+                .gte('created_at', since.isoformat()) \
+                .order('registro_id') \
+                .range(offset, offset + PAGE_SIZE - 1) \
+                .execute().data or []
+            page_rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+        if not page_rows:
+            return None
+
+        chunk = _page_to_columns(page_rows)
+        # Deduplicación por registro_id contra la cola de cada segmento
+        lowest = int(chunk['registro_id'].min())
+        known = np.concatenate([seg['registro_id'][seg['registro_id'] >= lowest] for seg in (self.base, self.delta)])
+        fresh = ~np.isin(chunk['registro_id'], known)
+        if not fresh.any():
+            return None
+        logger.info(f"Almacén columnar: {int(fresh.sum())} registros confirmados por debajo del high-water mark")
+        return {name: col[fresh] for name, col in chunk.items()}
+
+    def _resolve_names(self, swimmer_ids: np.ndarray, competition_ids: np.ndarray) -> None:
+        """Añade al diccionario los nombres que falten (una consulta por tabla)"""
+        client = self._client.client
+        missing = self.swimmers.missing(swimmer_ids)
+        if len(missing):
+            names = {}
+            for start in range(0, len(missing), PAGE_SIZE):
+                ids = missing[start:start + PAGE_SIZE].tolist()
+                for n in client.table('nadadores').select('id_nadador, nombre') \
+                        .in_('id_nadador', ids).execute().data or []:
+                    names[n['id_nadador']] = n['nombre']
+            self.swimmers.update(names)
+        missing = self.competitions.missing(competition_ids)
+        if len(missing):
+            names = {}
+            for start in range(0, len(missing), PAGE_SIZE):
+                ids = missing[start:start + PAGE_SIZE].tolist()
+                for c in client.table('competencias').select('competencia_id, competencia') \
+                        .in_('competencia_id', ids).execute().data or []:
+                    names[c['competencia_id']] = c['competencia']
+            self.competitions.update(names)
+
+    # === Consultas vectorizadas (por segmento, resultados combinados) ===
+
+    @staticmethod
+    def _gather(selections: List[Tuple[Dict[str, np.ndarray], np.ndarray]],
+                names: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        """Concatena las filas seleccionadas de cada segmento para las columnas pedidas"""
+        if not selections:
+            return {name: np.empty(0, dtype=COLUMNS[name]) for name in names}
+        return {name: np.concatenate([seg[name][idx] for seg, idx in selections]) for name in names}
+
+    @staticmethod
+    def _top(seg: Dict[str, np.ndarray], mask: np.ndarray, limit: int, descending: bool) -> np.ndarray:
+        """Índices de las `limit` filas con mayor/menor valor dentro de la máscara"""
+        idx = np.flatnonzero(mask)
+        values = seg['valor'][idx]
+        if descending:
+            values = -values
+        if len(idx) > limit:
+            part = np.argpartition(values, limit - 1)[:limit]
+            idx, values = idx[part], values[part]
+        return idx[np.argsort(values, kind='stable')]
+
+    def _mask(self, seg: Dict[str, np.ndarray], metrica_id: int, prueba_id: Optional[int]) -> np.ndarray:
+        mask = seg['metrica_id'] == metrica_id
+        if prueba_id is not None:
+            mask &= seg['prueba_id'] == prueba_id
+        return mask
+
+    def top_values(self, metrica_id: int, limit: int, descending: bool = False,
+                   prueba_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Mejores registros de una métrica (y prueba) con nombre de nadador y competencia"""
+        selections = [
+            (seg, self._top(seg, self._mask(seg, metrica_id, prueba_id), limit, descending))
+            for seg in self.segments
+        ]
+        g = self._gather(selections, ('id_nadador', 'competencia_id', 'valor'))
+        order = np.argsort(-g['valor'] if descending else g['valor'], kind='stable')[:limit]
+        swimmers = g['id_nadador'][order]
+        names = self.swimmers.lookup(swimmers)
+        competitions = self.competitions.lookup(g['competencia_id'][order])
+        return [
+            {'id_nadador': int(s), 'nadador': n, 'valor': float(v), 'competencia': comp}
+            for s, n, v, comp in zip(swimmers, names, g['valor'][order], competitions)
+        ]
+
+    def count(self, metrica_id: int, prueba_id: Optional[int] = None) -> int:
+        return sum(int(np.count_nonzero(self._mask(seg, metrica_id, prueba_id))) for seg in self.segments)
+
+    def daily_mean(self, metrica_id: int, since: str) -> List[Tuple[str, float]]:
+        """Promedio diario de una métrica desde una fecha (YYYY-MM-DD)"""
+        since_day = np.datetime64(since, 'D')
+        selections = [
+            (seg, np.flatnonzero((seg['metrica_id'] == metrica_id) & (seg['fecha'] >= since_day)))
+            for seg in self.segments
+        ]
+        g = self._gather(selections, ('fecha', 'valor'))
+        if not len(g['fecha']):
+            return []
+        # Agrupación por día con bincount sobre el desplazamiento en días (sin ordenar)
+        days = g['fecha'].astype(np.int64)
+        first = days.min()
+        offsets = days - first
+        sums = np.bincount(offsets, weights=g['valor'])
+        counts = np.bincount(offsets)
+        present = np.flatnonzero(counts)
+        dates = (present + first).astype('datetime64[D]').astype(str)
+        return list(zip(dates.tolist(), (sums[present] / counts[present]).tolist()))
+
+    def style_distribution(self) -> List[Dict[str, Any]]:
+        """Registros y nadadores distintos por estilo"""
+        n_estilos = max(self.estilos, default=0) + 1
+        counts = np.zeros(n_estilos, dtype=np.int64)
+        pairs = []
+        for seg in self.segments:
+            prueba = seg['prueba_id'].astype(np.int64)
+            valid = (prueba >= 0) & (prueba < len(self._prueba_estilo))
+            estilo = np.full(len(prueba), -1, dtype=np.int64)
+            estilo[valid] = self._prueba_estilo[prueba[valid]]
+            known = (estilo >= 0) & (estilo < n_estilos)
+            estilo, swimmers = estilo[known], seg['id_nadador'][known].astype(np.int64)
+            if not len(estilo):
+                continue
+            counts += np.bincount(estilo, minlength=n_estilos)
+            pairs.append((estilo, swimmers))
+        if not pairs:
+            return []
+        # Nadadores distintos por estilo: pares únicos codificados como estilo * K + nadador
+        # (memoria proporcional a las filas, no al mayor id_nadador)
+        k = max(int(swimmers.max()) for _, swimmers in pairs) + 1
+        keys = np.unique(np.concatenate([estilo * k + swimmers for estilo, swimmers in pairs]))
+        distinct = np.bincount(keys // k, minlength=n_estilos)
+        out = [
+            {'estilo': self.estilos[e], 'total_registros': int(counts[e]), 'nadadores_distintos': int(distinct[e])}
+            for e in np.flatnonzero(counts) if e in self.estilos
+        ]
+        return sorted(out, key=lambda x: x['total_registros'], reverse=True)
+
+    @staticmethod
+    def _rows(cols: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """Filas de registros en formato PostgREST ('*')"""
+        out = []
+        for i in range(len(cols['registro_id'])):
+            row: Dict[str, Any] = {
+                'registro_id': int(cols['registro_id'][i]),
+                'id_nadador': int(cols['id_nadador'][i]),
+                'prueba_id': int(cols['prueba_id'][i]),
+                'metrica_id': int(cols['metrica_id'][i]),
+                'valor': float(cols['valor'][i]),
+                'fecha': str(cols['fecha'][i]),
+            }
+            for name in NULLABLE:
+                value = int(cols[name][i])
+                row[name] = None if value == -1 else value
+            created = cols['created_at'][i]
+            row['created_at'] = None if np.isnat(created) else f"{created}+00:00"
+            out.append(row)
+        return out
+
+    def swimmer_history(self, id_nadador: int, fecha_desde: Optional[str] = None,
+                        fecha_hasta: Optional[str] = None, max_points: Optional[int] = None,
+                        mode: str = 'lttb') -> List[Dict[str, Any]]:
+        """
+        Registros de un nadador con métrica y prueba embebidas, más recientes
+        primero. Con `max_points`, cada serie (métrica, prueba, segmento) se
+        reduce antes de construir las filas (utils/downsampling.py).
+        """
+        selections = []
+        for seg in self.segments:
+            mask = seg['id_nadador'] == id_nadador
+            if fecha_desde:
+                mask &= seg['fecha'] >= np.datetime64(fecha_desde, 'D')
+            if fecha_hasta:
+                mask &= seg['fecha'] <= np.datetime64(fecha_hasta, 'D')
+            selections.append((seg, np.flatnonzero(mask)))
+        g = self._gather(selections, tuple(COLUMNS))
+        if max_points is not None and len(g['fecha']) > max_points:
+            keep = downsample_series(g['fecha'].astype(np.int64), g['valor'],
+                                     [g['metrica_id'], g['prueba_id'], g['segmento']], max_points, mode)
+            g = {name: col[keep] for name, col in g.items()}
+        order = np.argsort(g['fecha'], kind='stable')[::-1]
+        rows = self._rows({name: col[order] for name, col in g.items()})
+        for row in rows:
+            row['metricas'] = self.metricas.get(row['metrica_id'])
+            row['pruebas'] = self.pruebas.get(row['prueba_id'])
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        base_bytes = sum(arr.nbytes for arr in self.base.values())
+        delta_bytes = sum(arr.nbytes for arr in self.delta.values())
+        mapped = self.snapshot is not None
+        return {
+            'loaded': self.is_loaded,
+            'rows': len(self),
+            'delta_rows': _seg_len(self.delta),
+            'high_water_mark': self.high_water_mark,
+            'max_created_at': self.max_created_at,
+            # Con snapshot, la base vive en el page cache compartido entre workers
+            'mapped_bytes': base_bytes if mapped else 0,
+            'private_bytes': delta_bytes + (0 if mapped else base_bytes),
+            'dictionary_bytes': self.swimmers.nbytes() + self.competitions.nbytes(),
+            'bytes_per_row': round((base_bytes + delta_bytes) / len(self), 1) if len(self) else None,
+            'age_seconds': round(time.time() - self._refreshed_at, 1) if self.is_loaded else None,
+            'snapshot': {k: self.snapshot.get(k) for k in ('path', 'rows', 'high_water_mark', 'created_at')}
+            if mapped else None,
+            **self._stats
+        }
+
+
+registros_store = RegistrosStore(
+    refresh_interval=float(os.getenv('AQUALYTICS_COLUMNAR_REFRESH_S', '30')),
+    snapshot_dir=os.getenv('AQUALYTICS_SNAPSHOT_DIR') or None,
+    snapshot_delta_rows=int(os.getenv('AQUALYTICS_SNAPSHOT_DELTA_ROWS', '50000')),
+    late_window=float(os.getenv('AQUALYTICS_COLUMNAR_LATE_WINDOW_S', '60'))
+)
@@ -0,0 +1,114 @@
+"""
+Complete Tests - AquaLytics API
+Pivote por lotes de `registros` (formato largo) a pruebas completas (formato ancho):
+una fila por (prueba_id, id_nadador, fecha) con sus métricas manuales y las
+automáticas calculadas en la misma pasada, sin llamar a la BD por prueba.
+"""
+
+import logging
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+import pandas as pd
+
+from utils.automatic_metrics import AUTOMATIC_METRICS, MANUAL_INPUTS, calculate
+
+logger = logging.getLogger(__name__)
+
+# Identidad de una prueba completa (igual que get_complete_test_record)
+TEST_KEYS = ['prueba_id', 'id_nadador', 'fecha']
+
+# Segmento de las métricas globales en las columnas del pivote
+NO_SEGMENT = -1
+
+
+def _id(value: Any) -> Optional[int]:
+    """Id opcional (pandas convierte a float las columnas enteras con NULL)"""
+    return None if value is None or pd.isna(value) else int(value)
+
+
+def pivot_complete_tests(rows: List[Dict[str, Any]], metric_names: Dict[int, str],
+                         distances: Dict[int, float], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Convierte filas de `registros` en pruebas completas.
+
+    Las métricas manuales globales (segmento NULL) quedan como valor único y
+    las de tramo como lista ordenada por segmento. Las automáticas se toman de
+    los registros guardados en la ingesta; las que falten (datos anteriores al
+    backfill) se calculan en la misma pasada con el calculador por lotes.
+    Resultado ordenado por fecha descendente.
+    """
+    if not rows:
+        return []
+    df = pd.DataFrame(rows)
+    df['metrica'] = df['metrica_id'].map(metric_names)
+    df = df.dropna(subset=['metrica', 'valor'])
+    if df.empty:
+        return []
+    df['valor'] = df['valor'].astype(float)
+    if 'segmento' not in df.columns:
+        df['segmento'] = None
+    df['segmento'] = df['segmento'].fillna(NO_SEGMENT).astype(int)
+
+    is_auto = df['metrica'].isin(list(AUTOMATIC_METRICS))
+    manual = df[~is_auto].sort_values('segmento', kind='stable')
+    stored = df[is_auto]
+
+    index = df.groupby(TEST_KEYS).size().index
+    # Fecha descendente; empates por prueba y nadador
+    order = np.lexsort((
+        index.get_level_values('id_nadador').to_numpy(),
+        index.get_level_values('prueba_id').to_numpy(),
+        -pd.to_datetime(index.get_level_values('fecha')).to_numpy().astype('datetime64[D]').astype(np.int64)
+    ))
+    if limit is not None:
+        order = order[:limit]
+    index = index[order]
+
+    # Pivote vectorizado: una columna por (métrica, segmento)
+    wide = manual.pivot_table(index=TEST_KEYS, columns=['metrica', 'segmento'], values='valor', aggfunc='last') \
+        .reindex(index) if not manual.empty else pd.DataFrame(index=index)
+    stored_wide = stored.pivot_table(index=TEST_KEYS, columns='metrica', values='valor', aggfunc='last') \
+        .reindex(index) if not stored.empty else pd.DataFrame(index=index)
+    context = df.groupby(TEST_KEYS)[['competencia_id', 'fase_id']].first().reindex(index) \
+        if {'competencia_id', 'fase_id'} <= set(df.columns) else None
+
+    # Métricas automáticas para todas las pruebas a la vez
+    inputs = {field: np.full(len(index), np.nan) for field in MANUAL_INPUTS.values()}
+    for (name, segmento), field in MANUAL_INPUTS.items():
+        column = (name, NO_SEGMENT if segmento is None else segmento)
+        if column in wide.columns:
+            inputs[field] = wide[column].to_numpy(dtype=float)
+    inputs['distancia_total'] = index.get_level_values('prueba_id').map(distances).to_numpy(dtype=float)
+    auto = calculate(inputs)
+    for name in stored_wide.columns:
+        persisted = stored_wide[name].to_numpy(dtype=float)
+        auto[name] = np.where(np.isnan(persisted), auto[name], persisted)
+
+    # Solo el armado de los dicts de salida recorre las pruebas una a una
+    columns = list(wide.columns)
+    values = wide.to_numpy(dtype=float).tolist() if columns else [[]] * len(index)
+    context = context.to_numpy().tolist() if context is not None else [[None, None]] * len(index)
+    auto_names = list(auto)
+    auto_values = np.column_stack([auto[name] for name in auto_names]).tolist()
+
+    tests = []
+    for i, (prueba_id, nadador_id, fecha) in enumerate(index):
+        manual_metrics: Dict[str, Any] = {}
+        for (name, segmento), value in zip(columns, values[i]):
+            if np.isnan(value):
+                continue
+            if segmento == NO_SEGMENT:
+                manual_metrics[name] = value
+            else:
+                manual_metrics.setdefault(name, []).append(value)
+        tests.append({
+            'prueba_id': int(prueba_id),
+            'nadador_id': int(nadador_id),
+            'fecha': str(fecha),
+            'competencia_id': _id(context[i][0]),
+            'fase_id': _id(context[i][1]),
+            'manual_metrics': manual_metrics,
+            'auto_metrics': {k: v for k, v in zip(auto_names, auto_values[i]) if not np.isnan(v)},
+        })
+    return tests
@@ -5,6 +5,7 @@ Versión optimizada para MVP con validaciones esenciales
 """
 
 import pandas as pd
+import numpy as np
 import io
 from typing import Dict, List, Optional, Any, Union, Tuple
 from dataclasses import dataclass
@@ -12,6 +13,8 @@ import logging
 from datetime import datetime
 import chardet
 
+from utils.validation_schema import SWIMMING_SCHEMA
+
 logger = logging.getLogger(__name__)
 
 
@@ -62,20 +65,25 @@ class CSVProcessor:
             't25_1', 't25_2', 't_total', 'brz_1', 'brz_2', 'brz_total', 'f1', 'f2'
         ]
         
-        # Rangos de validación básicos (min, max)
-        self.validation_ranges = {
-            'distancia': (25, 1500),
-            't25_1': (5.0, 60.0),
-            't25_2': (5.0, 60.0),
-            't_total': (10.0, 300.0),
-            'brz_1': (1, 100),
-            'brz_2': (1, 100),
-            'brz_total': (2, 200),
-            'f1': (0.0, 15.0),
-            'f2': (0.0, 15.0),
-            't15_1': (3.0, 30.0),
-            't15_2': (3.0, 30.0)
+        # Columnas de métricas -> (nombre en 'metricas', segmento) para el formato largo
+        self.metric_columns = {
+            't15_1': ('Tiempo 15m', 1),
+            'brz_1': ('Brazadas por Tramo', 1),
+            't25_1': ('Tiempo por Tramo', 1),
+            'f1': ('Flecha por Tramo', 1),
+            't15_2': ('Tiempo 15m', 2),
+            'brz_2': ('Brazadas por Tramo', 2),
+            't25_2': ('Tiempo por Tramo', 2),
+            'f2': ('Flecha por Tramo', 2),
+            't_total': ('Tiempo Total', None),
+            'brz_total': ('Brazadas Totales', None),
         }
+        
+        # Esquema compilado compartido con SwimmingDataValidator
+        self.schema = SWIMMING_SCHEMA
+        
+        # Rangos de validación (min, max) derivados del esquema
+        self.validation_ranges = self.schema.ranges
 
     def detect_encoding(self, file_content: bytes) -> str:
         """Detecta encoding del archivo"""
@@ -136,28 +144,31 @@ class CSVProcessor:
         except Exception as e:
             errors.append(f"Error procesando fechas: {str(e)}")
         
-        # 2. Convertir campos numéricos y validar rangos básicos
-        numeric_fields = ['t25_1', 't25_2', 't_total', 'brz_1', 'brz_2', 'brz_total', 
-                         'f1', 'f2', 'distancia', 't15_1', 't15_2']
-        
-        for field in numeric_fields:
+        # 2. Convertir campos numéricos y validar tipos y rangos del esquema
+        for field in self.schema.numeric_fields:
             if field in df_clean.columns:
-                # Convertir a numérico
-                df_clean[field] = pd.to_numeric(df_clean[field], errors='coerce')
+                # Convertir a numérico con el redondeo del esquema
+                values = self.schema.coerce_array(
+                    field, pd.to_numeric(df_clean[field], errors='coerce').to_numpy()
+                )
+                df_clean[field] = values
+                
+                not_integer = self.schema.integer_mask(field, values)
+                if not_integer.any():
+                    warnings.append(f"{int(not_integer.sum())} valores no enteros en {field}")
+                
+                # Los límites de tiempos y brazadas escalan con la distancia de cada fila
+                distance = (
+                    pd.to_numeric(df_clean['distancia'], errors='coerce').to_numpy(dtype=float)
+                    if 'distancia' in df_clean.columns else 50.0
+                )
+                out_of_range = self.schema.range_mask(field, values, distance)
+                if out_of_range.any():
+                    warnings.append(f"{int(out_of_range.sum())} valores fuera de rango en {field}")
                 
-                # Validar rango si existe
-                if field in self.validation_ranges:
-                    min_val, max_val = self.validation_ranges[field]
-                    out_of_range = df_clean[
-                        (df_clean[field] < min_val) | (df_clean[field] > max_val)
-                    ][field].count()
-                    
-                    if out_of_range > 0:
-                        warnings.append(f"{out_of_range} valores fuera de rango en {field}")
-                        # Filtrar valores fuera de rango
-                        df_clean = df_clean[
-                            (df_clean[field] >= min_val) & (df_clean[field] <= max_val)
-                        ]
+                invalid = not_integer | out_of_range
+                if invalid.any():
+                    df_clean = df_clean[~invalid]
         
         # 3. Eliminar filas con datos críticos faltantes
         critical_fields = ['t25_1', 't25_2', 't_total', 'brz_1', 'brz_2', 'brz_total', 'f1', 'f2']
@@ -168,16 +179,31 @@ class CSVProcessor:
         if dropped_rows > 0:
             warnings.append(f"{dropped_rows} filas eliminadas por datos faltantes")
         
-        # 4. Validación básica de consistencia (solo tiempo total)
-        inconsistent = df_clean[df_clean['t_total'] < (df_clean['t25_1'] + df_clean['t25_2'])].shape[0]
-        if inconsistent > 0:
-            warnings.append(f"{inconsistent} registros con tiempo total inconsistente")
-            df_clean = df_clean[df_clean['t_total'] >= (df_clean['t25_1'] + df_clean['t25_2'])]
+        # 4. Reglas de consistencia del esquema (mismas que en la carga manual)
+        columns = {
+            field: df_clean[field].to_numpy(dtype=float)
+            for field in self.schema.numeric_fields if field in df_clean.columns
+        }
+        consistency = self.schema.consistency_masks(columns, columns['distancia'])
+        inconsistent = np.zeros(len(df_clean), dtype=bool)
+        for rule in self.schema.rules:
+            mask = consistency[rule.name]
+            if mask.any():
+                warnings.append(f"{int(mask.sum())} registros con {rule.description}")
+                inconsistent |= mask
+        if inconsistent.any():
+            df_clean = df_clean[~inconsistent]
         
         return df_clean, errors, warnings
     
     def transform_to_long_format(self, df: pd.DataFrame, reference_data: Dict[str, List[Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], List[str]]:
-        """Transforma el DataFrame de formato ancho a formato largo."""
+        """
+        Transforma el DataFrame de formato ancho a formato largo.
+        
+        `reference_data` trae 'swimmers', 'competitions', 'phases' y 'metrics';
+        con 'tests' (filas con distancia, estilo y prueba_id, curso largo) cada
+        registro lleva además su prueba_id, o None si la prueba no existe.
+        """
         
         long_format_records = []
         errors = []
@@ -187,19 +213,8 @@ class CSVProcessor:
         competition_map = {c['competencia'].lower(): c['competencia_id'] for c in reference_data.get('competitions', [])}
         phase_map = {p['nombre'].lower(): p['fase_id'] for p in reference_data.get('phases', [])}
         metric_map = {m['nombre'].lower(): m['metrica_id'] for m in reference_data.get('metrics', [])}
-        
-        # Mapeo de columnas de CSV a nombres de métricas y segmentos
-        metric_column_map = {
-            't15_1': ('Tiempo 15m', 1),
-            'brz_1': ('Brazadas por Tramo', 1),
-            't25_1': ('Tiempo por Tramo', 1),
-            'f1': ('Flecha por Tramo', 1),
-            't15_2': ('Tiempo 15m', 2),
-            'brz_2': ('Brazadas por Tramo', 2),
-            't25_2': ('Tiempo por Tramo', 2),
-            'f2': ('Flecha por Tramo', 2),
-            't_total': ('Tiempo Total', None),
-            'brz_total': ('Brazadas Totales', None),
+        test_map = {
+            (int(t['distancia']), str(t['estilo']).lower()): t['prueba_id'] for t in reference_data.get('tests', [])
         }
 
         for index, row in df.iterrows():
@@ -208,21 +223,16 @@ class CSVProcessor:
                 competencia_id = competition_map.get(str(row['competencia']).lower())
                 fase_id = phase_map.get(str(row['fase']).lower())
                 
-                # Crear prueba_id (simplificado, asume que ya existe en la BD)
-                # En un sistema real, esto podría necesitar una lógica más robusta
-                # para crear la prueba si no existe.
-                # Esta parte sigue siendo una simplificación y podría necesitar ajuste.
-                # Por ahora, dejamos que el frontend maneje la creación de la prueba si es necesario.
-                # El CSV se enfoca en registrar datos para pruebas existentes.
-                # Aquí necesitaríamos un lookup para prueba_id basado en distancia y estilo.
-                # Esta lógica se omite por brevedad pero es un punto a considerar.
+                # La prueba debe existir en la BD: se busca por distancia y estilo
+                # (curso largo) si el llamador pasó las pruebas en 'tests'
+                prueba_id = test_map.get((int(row['distancia']), str(row['estilo']).lower()))
                 
                 if not all([nadador_id, competencia_id, fase_id]):
                     errors.append(f"Fila {index + 2}: No se pudo encontrar ID para nadador, competencia o fase.")
                     continue
 
                 metricas_list = []
-                for col, (metric_name, segment) in metric_column_map.items():
+                for col, (metric_name, segment) in self.metric_columns.items():
                     if col in row and pd.notna(row[col]):
                         metric_id = metric_map.get(metric_name.lower())
                         if metric_id:
@@ -232,7 +242,7 @@ class CSVProcessor:
                                 'segmento': segment
                             })
                         else:
-                             warnings.append(f"Fila {index + 2}: Métrica '{metric_name}' no encontrada en la base de datos.")
+                            logger.warning(f"Fila {index + 2}: Métrica '{metric_name}' no encontrada en la base de datos.")
 
 
                 record = {
@@ -240,8 +250,8 @@ class CSVProcessor:
                     "competencia_id": competencia_id,
                     "fecha": row['fecha'].strftime('%Y-%m-%d'),
                     "fase_id": fase_id,
-                    # "prueba_id" necesitaría ser buscado o creado dinámicamente
-                    # Lo omitimos del payload principal por ahora. El frontend lo gestiona.
+                    "prueba_id": prueba_id,
+                    "prueba": f"{int(row['distancia'])}m {row['estilo']}",
                     "metricas": metricas_list
                 }
                 long_format_records.append(record)
@@ -251,12 +261,19 @@ class CSVProcessor:
 
         return long_format_records, errors
     
-    def process_csv_file(self, file_content: Union[bytes, str], reference_data: Dict, filename: str = "upload.csv") -> CSVProcessingResult:
-        """Procesa un archivo CSV completo y lo transforma a formato largo"""
+    def read_and_clean(self, file_content: Union[bytes, str],
+                       filename: str = "upload.csv") -> Tuple[Optional[pd.DataFrame], CSVProcessingResult]:
+        """
+        Detecta encoding y delimitador, lee, normaliza y valida el CSV.
+        
+        Devuelve el DataFrame limpio (None si hay errores) y el resultado con
+        los errores y avisos, sin transformar a formato largo: así quien llama
+        puede resolver los IDs de referencia de las filas que quedaron.
+        """
         try:
             # Validar tamaño
             if isinstance(file_content, bytes) and len(file_content) > self.max_file_size:
-                return CSVProcessingResult(
+                return None, CSVProcessingResult(
                     success=False, total_rows=0, valid_rows=0,
                     errors=[f"Archivo muy grande (máximo {self.max_file_size // 1024 // 1024}MB)"],
                     warnings=[], data=[], encoding_detected="unknown", delimiter_detected="unknown"
@@ -274,7 +291,7 @@ class CSVProcessor:
             total_rows = len(df)
             
             if total_rows > self.max_rows:
-                return CSVProcessingResult(
+                return None, CSVProcessingResult(
                     success=False, total_rows=total_rows, valid_rows=0,
                     errors=[f"Demasiadas filas (máximo {self.max_rows} para MVP)"],
                     warnings=[], data=[], encoding_detected=encoding, delimiter_detected=delimiter
@@ -284,7 +301,7 @@ class CSVProcessor:
             try:
                 df = self.normalize_column_names(df)
             except ValueError as e:
-                return CSVProcessingResult(
+                return None, CSVProcessingResult(
                     success=False, total_rows=total_rows, valid_rows=0,
                     errors=[str(e)], warnings=[], data=[],
                     encoding_detected=encoding, delimiter_detected=delimiter
@@ -293,43 +310,41 @@ class CSVProcessor:
             # Validar y limpiar datos
             df_clean, errors, warnings = self.validate_and_clean_data(df)
             
-            if len(errors) > 0:
-                return CSVProcessingResult(
-                    success=False, total_rows=total_rows, valid_rows=0,
-                    errors=errors, warnings=warnings, data=[],
-                    encoding_detected=encoding, delimiter_detected=delimiter
-                )
-            
-            # Transformar a formato largo
-            long_format_data, transform_errors = self.transform_to_long_format(df_clean, reference_data)
-            errors.extend(transform_errors)
-
-            if len(errors) > 0:
-                 return CSVProcessingResult(
-                    success=False, total_rows=total_rows, valid_rows=0,
-                    errors=errors, warnings=warnings, data=[],
-                    encoding_detected=encoding, delimiter_detected=delimiter
-                )
-            
-            return CSVProcessingResult(
-                success=True,
-                total_rows=total_rows,
-                valid_rows=len(long_format_data),
-                errors=[],
-                warnings=warnings,
-                data=long_format_data,
-                encoding_detected=encoding,
-                delimiter_detected=delimiter
+            return (None if errors else df_clean), CSVProcessingResult(
+                success=not errors, total_rows=total_rows, valid_rows=0 if errors else len(df_clean),
+                errors=errors, warnings=warnings, data=[],
+                encoding_detected=encoding, delimiter_detected=delimiter
             )
             
         except Exception as e:
             logger.error(f"Error procesando CSV: {str(e)}")
-            return CSVProcessingResult(
+            return None, CSVProcessingResult(
                 success=False, total_rows=0, valid_rows=0,
                 errors=[f"Error procesando archivo: {str(e)}"],
                 warnings=[], data=[], 
                 encoding_detected="unknown", delimiter_detected="unknown"
             )
+    
+    def process_csv_file(self, file_content: Union[bytes, str], reference_data: Dict, filename: str = "upload.csv") -> CSVProcessingResult:
+        """Procesa un archivo CSV completo y lo transforma a formato largo"""
+        df_clean, result = self.read_and_clean(file_content, filename)
+        if df_clean is None:
+            return result
+        
+        try:
+            # Transformar a formato largo
+            long_format_data, transform_errors = self.transform_to_long_format(df_clean, reference_data)
+        except Exception as e:
+            logger.error(f"Error procesando CSV: {str(e)}")
+            transform_errors = [f"Error procesando archivo: {str(e)}"]
+            long_format_data = []
+        
+        if transform_errors:
+            result.success, result.valid_rows, result.errors = False, 0, transform_errors
+            return result
+        
+        result.valid_rows, result.data = len(long_format_data), long_format_data
+        return result
 
 
 # Función helper para uso directo
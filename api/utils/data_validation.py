@@ -4,11 +4,16 @@ Validación de datos de entrada para métricas de natación
 """
 
 import re
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Mapping, Sequence, Union
+from dataclasses import dataclass, field
 from datetime import datetime, date
+import math
 import logging
 
+import numpy as np
+
+from utils.validation_schema import SWIMMING_SCHEMA
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,29 +26,51 @@ class ValidationResult:
     sanitized_data: Optional[Dict[str, Any]] = None
 
 
+@dataclass
+class BatchValidationResult:
+    """Resultado compacto de una validación columnar en batch"""
+    total_records: int
+    valid_mask: np.ndarray
+    # Nombre de la regla -> índices (posiciones en el batch) que la incumplen
+    failures: Dict[str, np.ndarray] = field(default_factory=dict)
+
+    @property
+    def valid_records(self) -> int:
+        return int(self.valid_mask.sum())
+
+    @property
+    def is_valid(self) -> bool:
+        return self.total_records > 0 and self.valid_records == self.total_records
+
+    def invalid_indices(self) -> np.ndarray:
+        """Índices de los registros que incumplen al menos una regla"""
+        return np.flatnonzero(~self.valid_mask)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Resumen serializable a JSON"""
+        return {
+            'is_valid': self.is_valid,
+            'total_records': self.total_records,
+            'valid_records': self.valid_records,
+            'failures': {rule: idx.tolist() for rule, idx in self.failures.items()}
+        }
+
+
+ColumnarInput = Union[Sequence[Mapping[str, Any]], Mapping[str, Any]]
+
+
 class SwimmingDataValidator:
     """Validador de datos de natación"""
     
     def __init__(self):
-        # Rangos de validación para métricas
-        self.ranges = {
-            # Tiempos (segundos)
-            't15_1': {'min': 3.0, 'max': 30.0},
-            't15_2': {'min': 3.0, 'max': 30.0},
-            't25_1': {'min': 5.0, 'max': 60.0},
-            't25_2': {'min': 5.0, 'max': 60.0},
-            't_total': {'min': 10.0, 'max': 120.0},
-            # Brazadas
-            'brz_1': {'min': 1, 'max': 50},
-            'brz_2': {'min': 1, 'max': 50},
-            'brz_total': {'min': 2, 'max': 100},
-            # Flechas (metros)
-            'f1': {'min': 0.0, 'max': 15.0},
-            'f2': {'min': 0.0, 'max': 15.0}
-        }
+        # Esquema compilado compartido con CSVProcessor
+        self.schema = SWIMMING_SCHEMA
+        
+        # Rangos de validación para métricas (derivados del esquema)
+        self.ranges = self.schema.metric_ranges()
         
         # Campos requeridos
-        self.required_manual_fields = ['t25_1', 't25_2', 't_total', 'brz_total', 'f1', 'f2']
+        self.required_manual_fields = self.schema.required_fields
         self.required_record_fields = ['id_nadador', 'competencia_id', 'fecha', 'distancia_id', 
                                      'estilo_id', 'fase_id', 'metrica_id', 'valor']
         
@@ -128,21 +155,21 @@ class SwimmingDataValidator:
         sanitized_data = {}
         
         # Validar campos requeridos
-        for field in self.required_record_fields:
-            if field not in data or data[field] is None:
-                errors.append(f"El campo '{field}' es requerido")
+        for field_name in self.required_record_fields:
+            if field_name not in data or data[field_name] is None:
+                errors.append(f"El campo '{field_name}' es requerido")
         
         if errors:
             return ValidationResult(is_valid=False, errors=errors, warnings=warnings)
         
         # Validar IDs (deben ser enteros positivos)
         id_fields = ['id_nadador', 'competencia_id', 'distancia_id', 'estilo_id', 'fase_id', 'metrica_id']
-        for field in id_fields:
-            if field in data:
-                if not isinstance(data[field], int) or data[field] <= 0:
-                    errors.append(f"'{field}' debe ser un entero positivo")
+        for field_name in id_fields:
+            if field_name in data:
+                if not isinstance(data[field_name], int) or data[field_name] <= 0:
+                    errors.append(f"'{field_name}' debe ser un entero positivo")
                 else:
-                    sanitized_data[field] = data[field]
+                    sanitized_data[field_name] = data[field_name]
         
         # Validar fecha
         if 'fecha' in data:
@@ -189,40 +216,32 @@ class SwimmingDataValidator:
         warnings = []
         sanitized_data = {}
         
-        # Verificar campos requeridos
-        for field in self.required_manual_fields:
-            if field not in data or data[field] is None:
-                errors.append(f"El campo '{field}' es requerido para cálculo automático")
+        # Verificar campos requeridos (None y NaN cuentan como ausentes, igual que en batch)
+        for field_name in self.required_manual_fields:
+            if _is_missing(data.get(field_name)):
+                errors.append(f"El campo '{field_name}' es requerido para cálculo automático")
         
         if errors:
             return ValidationResult(is_valid=False, errors=errors, warnings=warnings)
         
-        # Validar rangos
-        for field, value in data.items():
-            if field in self.ranges:
-                range_rule = self.ranges[field]
-                
-                # Validar tipo para brazadas (deben ser enteros)
-                if field.startswith('brz_'):
-                    if not isinstance(value, int) or value != int(value):
-                        errors.append(f"'{field}' debe ser un número entero")
-                    elif value < range_rule['min'] or value > range_rule['max']:
-                        errors.append(f"'{field}' debe estar entre {range_rule['min']} y {range_rule['max']}")
-                    else:
-                        sanitized_data[field] = int(value)
-                
-                # Validar tiempos y flechas (pueden ser decimales)
-                else:
-                    if not isinstance(value, (int, float)):
-                        errors.append(f"'{field}' debe ser numérico")
-                    elif value < range_rule['min'] or value > range_rule['max']:
-                        errors.append(f"'{field}' debe estar entre {range_rule['min']} y {range_rule['max']}")
-                    else:
-                        sanitized_data[field] = round(float(value), 2)
+        # Validar tipos y rangos con los validadores compilados del esquema
+        # (los límites de tiempos y brazadas escalan con la distancia)
+        distance = data.get('distance', 50.0)
+        validators = self.schema.metric_validators
+        for field_name, value in data.items():
+            validate = validators.get(field_name)
+            if validate is None or _is_missing(value):
+                # Campo opcional vacío: se trata como ausente
+                continue
+            sanitized, error = validate(value, distance)
+            if error:
+                errors.append(error)
+            else:
+                sanitized_data[field_name] = sanitized
         
         # Validaciones de consistencia lógica
         if len(errors) == 0:
-            consistency_errors = self._validate_consistency(sanitized_data)
+            consistency_errors = self._validate_consistency(sanitized_data, distance)
             errors.extend(consistency_errors)
         
         return ValidationResult(
@@ -232,66 +251,9 @@ class SwimmingDataValidator:
             sanitized_data=sanitized_data if len(errors) == 0 else None
         )
     
-    def _validate_consistency(self, data: Dict[str, Any]) -> List[str]:
+    def _validate_consistency(self, data: Dict[str, Any], distance: Optional[float] = None) -> List[str]:
         """Valida consistencia lógica entre métricas"""
-        errors = []
-        
-        # Obtener valores
-        t25_1 = data.get('t25_1', 0)
-        t25_2 = data.get('t25_2', 0)
-        t_total = data.get('t_total', 0)
-        brz_1 = data.get('brz_1', 0)
-        brz_2 = data.get('brz_2', 0)
-        brz_total = data.get('brz_total', 0)
-        t15_1 = data.get('t15_1', 0)
-        t15_2 = data.get('t15_2', 0)
-        f1 = data.get('f1', 0)
-        f2 = data.get('f2', 0)
-        
-        # Validar que el tiempo total sea coherente
-        if t_total > 0 and t25_1 > 0 and t25_2 > 0:
-            sum_segments = t25_1 + t25_2
-            if t_total < sum_segments:
-                errors.append(f"Tiempo total ({t_total}s) menor que suma de segmentos ({sum_segments:.2f}s)")
-            elif t_total > sum_segments * 1.1:  # Máximo 10% de diferencia (más estricto)
-                errors.append(f"Tiempo total ({t_total}s) excesivamente mayor que suma de segmentos ({sum_segments:.2f}s)")
-        
-        # Validar que el total de brazadas sea coherente
-        if brz_total > 0 and brz_1 > 0 and brz_2 > 0:
-            sum_strokes = brz_1 + brz_2
-            if brz_total < sum_strokes:
-                errors.append(f"Total brazadas ({brz_total}) menor que suma de segmentos ({sum_strokes})")
-            elif brz_total > sum_strokes + 5:  # Máximo 5 brazadas de diferencia
-                errors.append(f"Total brazadas ({brz_total}) excesivamente mayor que suma de segmentos ({sum_strokes})")
-        
-        # Validar que T15 < T25 en cada segmento
-        if t15_1 > 0 and t25_1 > 0 and t15_1 >= t25_1:
-            errors.append(f"T15(1) ({t15_1}s) debe ser menor que T25(1) ({t25_1}s)")
-        
-        if t15_2 > 0 and t25_2 > 0 and t15_2 >= t25_2:
-            errors.append(f"T15(2) ({t15_2}s) debe ser menor que T25(2) ({t25_2}s)")
-        
-        # Validar coherencia de velocidades entre segmentos
-        if t25_1 > 0 and t25_2 > 0:
-            speed1 = 25 / t25_1
-            speed2 = 25 / t25_2
-            speed_diff = abs(speed2 - speed1) / speed1
-            
-            if speed_diff > 0.5:  # 50% de diferencia máxima
-                errors.append(f"Diferencia de velocidad entre segmentos excesiva ({speed_diff*100:.1f}%). Verificar tiempos.")
-        
-        # Validar distancias de flecha razonables
-        if f1 > 0 and f2 > 0:
-            if abs(f1 - f2) > 10:  # Diferencia máxima de 10m
-                errors.append(f"Diferencia entre flechas muy alta: F1={f1}m, F2={f2}m")
-        
-        # Suma de flechas no puede ser >= distancia total
-        total_underwater = f1 + f2
-        distance = data.get('distance', 50.0)
-        if total_underwater >= distance:
-            errors.append(f"Suma de flechas ({total_underwater}m) debe ser < distancia total ({distance}m)")
-        
-        return errors
+        return self.schema.consistency_errors(data, data.get('distance', 50.0) if distance is None else distance)
     
     def validate_batch_data(self, data_list: List[Dict[str, Any]], 
                            validation_type: str = 'metric_record') -> Dict[str, Any]:
@@ -305,18 +267,20 @@ class SwimmingDataValidator:
                 'results': []
             }
         
+        validators = {
+            'metric_record': self.validate_metric_record,
+            'manual_metrics': self.validate_manual_metrics,
+            'swimmer': self.validate_swimmer_data,
+            'competition': self.validate_competition_data
+        }
+        validate = validators.get(validation_type)
+        
         results = []
         valid_count = 0
         
         for i, record in enumerate(data_list):
-            if validation_type == 'metric_record':
-                result = self.validate_metric_record(record)
-            elif validation_type == 'manual_metrics':
-                result = self.validate_manual_metrics(record)
-            elif validation_type == 'swimmer':
-                result = self.validate_swimmer_data(record)
-            elif validation_type == 'competition':
-                result = self.validate_competition_data(record)
+            if validate is not None:
+                result = validate(record)
             else:
                 result = ValidationResult(
                     is_valid=False,
@@ -338,6 +302,125 @@ class SwimmingDataValidator:
             'results': results
         }
 
+    def validate_batch_columnar(self, data: ColumnarInput,
+                                distance: float = 50.0) -> BatchValidationResult:
+        """
+        Valida un batch de métricas manuales de forma columnar.
+        
+        Aplica las mismas reglas que validate_manual_metrics (requeridos, rangos,
+        enteros en brazadas y consistencia) como operaciones sobre arrays, sin
+        construir un ValidationResult por registro.
+        
+        Args:
+            data: Lista de diccionarios (un registro por fila) o mapeo
+                  columna -> secuencia de valores (dict de arrays, DataFrame)
+            distance: Distancia total por defecto si no hay columna 'distance'
+        """
+        columns, type_errors, n = self._to_columns(data)
+        failures: Dict[str, np.ndarray] = {}
+        field_ok = np.ones(n, dtype=bool)
+        
+        def record(rule: str, mask: np.ndarray) -> None:
+            if mask.any():
+                failures[rule] = np.flatnonzero(mask)
+        
+        # Campos requeridos
+        for field_name in self.required_manual_fields:
+            missing = np.isnan(columns[field_name]) & ~type_errors[field_name]
+            record(f"requerido:{field_name}", missing)
+            field_ok &= ~missing
+        
+        if 'distance' in columns:
+            dist = np.where(np.isnan(columns['distance']), distance, columns['distance'])
+        else:
+            dist = np.full(n, float(distance))
+        
+        # Tipo, enteros y rangos
+        for field_name in self.ranges:
+            values = columns[field_name]
+            
+            bad_type = type_errors[field_name]
+            record(f"tipo:{field_name}", bad_type)
+            field_ok &= ~bad_type
+            
+            # Enteros por valor (10.0 vale; 10.5 no), como en la validación escalar
+            not_integer = self.schema.integer_mask(field_name, values)
+            if self.schema.fields[field_name].kind == 'int':
+                record(f"entero:{field_name}", not_integer)
+                field_ok &= ~not_integer
+            
+            out_of_range = ~not_integer & self.schema.range_mask(field_name, values, dist)
+            record(f"rango:{field_name}", out_of_range)
+            field_ok &= ~out_of_range
+        
+        # Consistencia sobre valores sanitizados
+        sanitized = {
+            name: self.schema.coerce_array(name, columns[name]) for name in self.ranges
+        }
+        consistency = self.schema.consistency_masks(sanitized, dist)
+        
+        # Igual que en la validación escalar, la consistencia solo se evalúa
+        # en registros que superaron las reglas por campo
+        consistency_ok = np.ones(n, dtype=bool)
+        for rule, mask in consistency.items():
+            mask &= field_ok
+            record(rule, mask)
+            consistency_ok &= ~mask
+        
+        return BatchValidationResult(
+            total_records=n,
+            valid_mask=field_ok & consistency_ok,
+            failures=failures
+        )
+    
+    def _to_columns(self, data: ColumnarInput):
+        """
+        Convierte la entrada a columnas float64 (NaN = campo ausente).
+        
+        Returns:
+            (columnas, máscaras de error de tipo, número de registros)
+        """
+        fields = list(self.ranges) + ['distance']
+        columns: Dict[str, np.ndarray] = {}
+        type_errors: Dict[str, np.ndarray] = {}
+        
+        if isinstance(data, Mapping) or hasattr(data, 'columns'):
+            # Entrada columnar: dict de arrays o DataFrame
+            n = len(next(iter(data.values()))) if isinstance(data, Mapping) and data else len(data)
+            for name in fields:
+                raw = np.asarray(data[name]) if name in data else None
+                if raw is not None and raw.dtype.kind not in 'biuf':
+                    columns[name], type_errors[name] = self._coerce_column(raw.tolist())
+                    continue
+                columns[name] = raw.astype(np.float64) if raw is not None else np.full(n, np.nan)
+                type_errors[name] = np.zeros(n, dtype=bool)
+            return columns, type_errors, n
+        
+        n = len(data)
+        for name in fields:
+            columns[name], type_errors[name] = self._coerce_column([r.get(name) for r in data])
+        return columns, type_errors, n
+    
+    @staticmethod
+    def _coerce_column(values: List[Any]):
+        """Convierte una lista heterogénea a float64 marcando valores no numéricos"""
+        n = len(values)
+        out = np.full(n, np.nan)
+        bad = np.zeros(n, dtype=bool)
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            if isinstance(value, (int, float)):
+                out[i] = value
+            else:
+                bad[i] = True
+        return out, bad
+
+
+def _is_missing(value: Any) -> bool:
+    """None o NaN: campo ausente (la entrada columnar no distingue ambos)"""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
 
 # Funciones helper
 def validate_swimming_metrics(data: Dict[str, Any]) -> ValidationResult:
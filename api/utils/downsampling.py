@@ -0,0 +1,184 @@
+"""
+Downsampling - AquaLytics API
+Reducción de series temporales para gráficas: Largest-Triangle-Three-Buckets
+(conserva la forma visual eligiendo puntos reales) y min/max/media por bucket
+de tiempo (un bucket por píxel). Acota el payload independientemente de la
+longitud del historial.
+"""
+
+import os
+from typing import Dict, List, Optional, Any, Callable, Hashable
+
+import numpy as np
+
+DOWNSAMPLE_MODES = ('lttb', 'minmax')
+
+# Mínimo de LTTB (primer punto, último y al menos un bucket intermedio)
+MIN_POINTS = 3
+MAX_POINTS = int(os.getenv('AQUALYTICS_MAX_CHART_POINTS', '5000'))
+
+
+def parse_downsampling(max_points: Optional[str], mode: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Valida `max_points` y `downsample` de la query string; None si no se
+    pidió reducción. Lanza ValueError con el mensaje para el cliente.
+    """
+    if max_points in (None, ''):
+        return None
+    try:
+        points = int(max_points)
+    except (TypeError, ValueError):
+        raise ValueError("max_points debe ser un entero.")
+    if not MIN_POINTS <= points <= MAX_POINTS:
+        raise ValueError(f"max_points debe estar entre {MIN_POINTS} y {MAX_POINTS}.")
+    mode = mode or 'lttb'
+    if mode not in DOWNSAMPLE_MODES:
+        raise ValueError(f"downsample debe ser uno de: {', '.join(DOWNSAMPLE_MODES)}.")
+    return {'max_points': points, 'mode': mode}
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Índices de los puntos elegidos por LTTB (x ordenado ascendente).
+
+    El primer y el último punto se conservan; el resto se reparte en
+    `max_points - 2` buckets de igual número de puntos y de cada uno se
+    elige el que forma el triángulo de mayor área con el punto elegido en el
+    bucket anterior y la media del siguiente. Las medias salen de sumas
+    acumuladas y el área se calcula vectorizada por bucket; solo el
+    encadenamiento entre buckets es secuencial.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.diff(edges)
+    mean_x = (cx[edges[1:]] - cx[edges[:-1]]) / counts
+    mean_y = (cy[edges[1:]] - cy[edges[:-1]]) / counts
+    # El "siguiente" del último bucket es el último punto
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _time_buckets(x: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Bucket de cada punto: `n_buckets` intervalos de igual ancho en x (píxeles)"""
+    x = np.asarray(x, dtype=np.float64)
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.zeros(len(x), dtype=np.int64)
+    return np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Índices del mínimo y el máximo de cada bucket de tiempo (x ordenado),
+    en orden ascendente: a lo sumo `max_points` puntos reales que conservan
+    los picos de la serie.
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = _time_buckets(x, max_points // 2)
+    # Con x ordenado cada bucket es un tramo contiguo: extremos con reduceat
+    changed = np.r_[True, buckets[1:] != buckets[:-1]]
+    starts = np.flatnonzero(changed)
+    segment = np.cumsum(changed) - 1
+    selected = []
+    for extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        hits = np.flatnonzero(y == extreme[segment])
+        # Primera aparición del extremo en cada bucket
+        selected.append(hits[np.r_[True, segment[hits][1:] != segment[hits][:-1]]])
+    return np.unique(np.concatenate(selected))
+
+
+def bucket_stats(x: np.ndarray, y: np.ndarray, max_points: int) -> Dict[str, np.ndarray]:
+    """
+    Mínimo, máximo, media y conteo de y por bucket de tiempo (x ordenado),
+    con la x del primer punto de cada bucket. Los buckets vacíos se omiten.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    buckets = _time_buckets(x, max_points)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(y)])
+    return {
+        'x': np.asarray(x)[starts],
+        'min': np.minimum.reduceat(y, starts),
+        'max': np.maximum.reduceat(y, starts),
+        'mean': np.add.reduceat(y, starts) / counts,
+        'count': counts
+    }
+
+
+def select_indices(x: np.ndarray, y: np.ndarray, max_points: int, mode: str) -> np.ndarray:
+    """Índices de puntos reales a conservar según el modo (x ordenado)"""
+    if mode == 'minmax':
+        return minmax_indices(x, y, max_points)
+    return lttb_indices(x, y, max_points)
+
+
+def dates_to_days(dates: List[Any]) -> np.ndarray:
+    """Fechas 'YYYY-MM-DD' (o ISO con hora) como días desde la época"""
+    return np.array([str(d)[:10] for d in dates], dtype='datetime64[D]').astype(np.int64)
+
+
+def downsample_series(x: np.ndarray, y: np.ndarray, keys: List[np.ndarray],
+                      max_points: int, mode: str) -> np.ndarray:
+    """
+    Índices (ascendentes) a conservar de varias series mezcladas: cada
+    combinación de `keys` es una serie que se reduce a `max_points` por
+    separado, ordenada por x. Los puntos con y NaN se descartan solo en las
+    series que hay que reducir.
+    """
+    n = len(x)
+    if n == 0:
+        return np.arange(0)
+    order = np.lexsort((x,) + tuple(reversed(keys)))
+    changed = np.zeros(n, dtype=bool)
+    changed[0] = True
+    for key in keys:
+        sorted_key = key[order]
+        changed[1:] |= sorted_key[1:] != sorted_key[:-1]
+    starts = np.flatnonzero(changed)
+    ends = np.r_[starts[1:], n]
+
+    keep = []
+    for lo, hi in zip(starts.tolist(), ends.tolist()):
+        members = order[lo:hi]
+        if hi - lo > max_points:
+            members = members[~np.isnan(y[members])]
+            members = members[select_indices(x[members], y[members], max_points, mode)]
+        keep.append(members)
+    return np.sort(np.concatenate(keep))
+
+
+def downsample_rows(rows: List[Dict[str, Any]], max_points: int, mode: str,
+                    series: Callable[[Dict[str, Any]], Hashable],
+                    x_key: str = 'fecha', y_key: str = 'valor') -> List[Dict[str, Any]]:
+    """
+    Reduce filas con fecha y valor a `max_points` filas reales por serie
+    (p. ej. por métrica y prueba), conservando el orden original.
+    """
+    if len(rows) <= max_points:
+        return rows
+    series_ids: Dict[Hashable, int] = {}
+    keys = np.array([series_ids.setdefault(series(row), len(series_ids)) for row in rows], dtype=np.int64)
+    x = dates_to_days([row[x_key] for row in rows])
+    y = np.array([np.nan if row[y_key] is None else row[y_key] for row in rows], dtype=np.float64)
+    return [rows[i] for i in downsample_series(x, y, [keys], max_points, mode).tolist()]
@@ -0,0 +1,133 @@
+"""
+ID Loader - AquaLytics API
+Cargador por lotes de IDs con alcance de request: las llamadas a `load(key)`
+hechas en la misma vuelta del event loop se deduplican y se resuelven juntas
+con una consulta `in_()` por tabla. Los resultados quedan en cache hasta que
+termina el request, así el código fila a fila no se traduce en una consulta
+por fila.
+"""
+
+import asyncio
+import functools
+import contextvars
+import logging
+from typing import Dict, List, Any, Callable, Hashable, Iterable
+
+from utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+id_loader_batches_total = registry.counter(
+    'aqualytics_id_loader_batches_total',
+    'Lotes de IDs resueltos por el cargador de requests',
+    ('table',)
+)
+id_loader_keys_total = registry.counter(
+    'aqualytics_id_loader_keys_total',
+    'Claves resueltas por el cargador de requests (load = llamadas, batched = claves únicas consultadas)',
+    ('table', 'kind')
+)
+
+
+class BatchLoader:
+    """
+    Al estilo DataLoader: `load(key)` devuelve un future del loop actual. La
+    primera clave pendiente programa el despacho con `call_soon`, que corre
+    después de todas las tareas listas en esa vuelta; el despacho ejecuta
+    `batch_fn` (síncrona, consulta la BD) una vez con las claves únicas
+    acumuladas en el executor del loop, con el contexto del request, y
+    resuelve los futures al terminar. Las claves sin valor se resuelven a None.
+
+    Las claves de un lote fallido se olvidan para que un `load` posterior
+    vuelva a intentarlo.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]]):
+        self.name = name
+        self.batch_fn = batch_fn
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        self.loads = 0
+        self.batches = 0
+
+    def load(self, key: Hashable) -> 'asyncio.Future':
+        self.loads += 1
+        id_loader_keys_total.inc(table=self.name, kind='load')
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            if not self._queue:
+                loop.call_soon(self._dispatch)
+            self._queue.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, value: Any) -> None:
+        """Guarda un valor conocido sin consultar (no pisa uno ya cargado)"""
+        if key not in self._futures:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._futures[key] = future
+
+    def _dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        if not keys:
+            return
+        self.batches += 1
+        id_loader_batches_total.inc(table=self.name)
+        id_loader_keys_total.inc(len(keys), table=self.name, kind='batched')
+        context = contextvars.copy_context()
+        batch = asyncio.get_running_loop().run_in_executor(None, context.run, self.batch_fn, keys)
+        batch.add_done_callback(functools.partial(self._resolve, keys))
+
+    def _resolve(self, keys: List[Hashable], batch: 'asyncio.Future') -> None:
+        error = asyncio.CancelledError() if batch.cancelled() else batch.exception()
+        if error is not None:
+            logger.error(f"Error resolviendo lote de {self.name} ({len(keys)} claves): {str(error)}")
+            for key in keys:
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(error)
+            return
+        values = batch.result()
+        for key in keys:
+            future = self._futures[key]
+            if not future.done():
+                future.set_result(values.get(key))
+
+    def stats(self) -> Dict[str, int]:
+        return {'loads': self.loads, 'batches': self.batches, 'keys': len(self._futures)}
+
+
+class IdLoader:
+    """
+    Cargadores de IDs de un request sobre un SupabaseClient: nombres de
+    nadadores y competencias (creados si faltan), pruebas por nombre o por
+    (distancia, estilo, curso), métricas y fases. Debe crearse por request:
+    la cache vive lo que vive la instancia.
+    """
+
+    def __init__(self, supabase_client: Any):
+        self.client = supabase_client
+        self.nadadores = self._by_name('nadadores')
+        self.pruebas = self._by_name('pruebas')
+        self.metricas = self._by_name('metricas')
+        self.competencias = self._by_name('competencias')
+        self.fases = self._by_name('fases')
+        self.pruebas_por_detalle = BatchLoader('pruebas_por_detalle', self.client.get_prueba_ids_by_details)
+
+    def _by_name(self, table: str) -> BatchLoader:
+        return BatchLoader(table, lambda names: self.client.get_ids_by_name(table, names))
+
+    def _loaders(self) -> List[BatchLoader]:
+        return [self.nadadores, self.pruebas, self.pruebas_por_detalle,
+                self.metricas, self.competencias, self.fases]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {loader.name: loader.stats() for loader in self._loaders()}
+
+    def queries(self) -> int:
+        return sum(loader.batches for loader in self._loaders())
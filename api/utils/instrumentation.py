@@ -0,0 +1,409 @@
+"""
+Instrumentation - AquaLytics API
+Métricas en formato de texto Prometheus: latencias por ruta, consultas a la base
+de datos por tabla y contadores de caché, expuestas en /metrics.
+"""
+
+import time
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Callable, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base de las métricas con etiquetas"""
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Contador monótono"""
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in items]
+
+
+class Gauge(Counter):
+    """Valor instantáneo que puede subir y bajar"""
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[LabelValues, List[float]] = {}  # [conteos por bucket..., suma, total]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names + ('le',), key + (_format_value(bound),))
+                out.append((f"{self.name}_bucket", labels, cumulative))
+            base = _format_labels(self.label_names, key)
+            out.append((f"{self.name}_sum", base, series[-2]))
+            out.append((f"{self.name}_count", base, series[-1]))
+        return out
+
+
+Collector = Callable[[], Iterable[_Metric]]
+
+
+class MetricsRegistry:
+    """Registro de métricas y colectores que se renderizan en formato Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def register_collector(self, collector: Collector) -> None:
+        """Colector invocado en cada render (métricas derivadas de otro estado)"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logger.error(f"Error en colector de métricas: {str(e)}")
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Registro global
+registry = MetricsRegistry()
+
+# === Métricas HTTP ===
+
+http_request_duration = registry.histogram(
+    'aqualytics_http_request_duration_seconds', 'Latencia de requests HTTP por ruta',
+    labels=('method', 'route')
+)
+http_requests_total = registry.counter(
+    'aqualytics_http_requests_total', 'Requests HTTP por ruta y status',
+    labels=('method', 'route', 'status')
+)
+http_requests_in_flight = registry.gauge(
+    'aqualytics_http_requests_in_flight', 'Requests HTTP en curso'
+)
+
+# === Métricas de base de datos ===
+
+db_queries_total = registry.counter(
+    'aqualytics_db_queries_total', 'Consultas a Supabase por tabla y operación',
+    labels=('table', 'operation')
+)
+db_query_errors_total = registry.counter(
+    'aqualytics_db_query_errors_total', 'Consultas a Supabase fallidas',
+    labels=('table', 'operation')
+)
+db_query_duration = registry.histogram(
+    'aqualytics_db_query_duration_seconds', 'Latencia de consultas a Supabase',
+    labels=('table', 'operation')
+)
+db_rows_returned_total = registry.counter(
+    'aqualytics_db_rows_returned_total', 'Filas devueltas por Supabase',
+    labels=('table', 'operation')
+)
+
+# === Métricas de caché ===
+
+id_cache_lookups_total = registry.counter(
+    'aqualytics_id_cache_lookups_total', 'Búsquedas en la caché de IDs de SupabaseClient',
+    labels=('table', 'result')
+)
+
+
+# === Instrumentación del cliente de Supabase ===
+
+@dataclass
+class QueryEvent:
+    """Una consulta ejecutada contra Supabase"""
+    table: str
+    operation: str
+    ops: List[Tuple[str, tuple]] = field(default_factory=list)  # cadena de métodos del builder
+    duration: float = 0.0
+    rows: int = 0
+    error: Optional[str] = None
+
+
+QueryObserver = Callable[[QueryEvent], None]
+_query_observers: List[QueryObserver] = []
+
+_OPERATIONS = ('select', 'insert', 'upsert', 'update', 'delete')
+
+
+def add_query_observer(observer: QueryObserver) -> None:
+    """Registra un observador que recibe cada QueryEvent"""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def _record_query_metrics(event: QueryEvent) -> None:
+    labels = {'table': event.table, 'operation': event.operation}
+    db_queries_total.inc(**labels)
+    db_query_duration.observe(event.duration, **labels)
+    db_rows_returned_total.inc(event.rows, **labels)
+    if event.error:
+        db_query_errors_total.inc(**labels)
+
+
+add_query_observer(_record_query_metrics)
+
+ExecuteGuard = Callable[[str], None]
+_execute_guards: List[ExecuteGuard] = []
+
+
+def add_execute_guard(guard: ExecuteGuard) -> None:
+    """
+    Registra una comprobación que corre antes de cada execute() con el nombre
+    de la tabla; si lanza una excepción la consulta no se ejecuta (p. ej.
+    porque el request ya agotó su plazo).
+    """
+    if guard not in _execute_guards:
+        _execute_guards.append(guard)
+
+
+def _notify(event: QueryEvent) -> None:
+    for observer in _query_observers:
+        try:
+            observer(event)
+        except Exception as e:
+            logger.error(f"Error en observador de consultas: {str(e)}")
+
+
+class _InstrumentedBuilder:
+    """Proxy de un request builder de postgrest que mide execute()"""
+
+    def __init__(self, builder: Any, table: str, ops: List[Tuple[str, tuple]]):
+        self._builder = builder
+        self._table = table
+        self._ops = ops
+
+    def execute(self):
+        operation = next((name for name, _ in self._ops if name in _OPERATIONS or name == 'rpc'), 'select')
+        for guard in _execute_guards:
+            guard(self._table)
+        event = QueryEvent(table=self._table, operation=operation, ops=list(self._ops))
+        start = time.perf_counter()
+        try:
+            result = self._builder.execute()
+        except Exception as e:
+            event.duration = time.perf_counter() - start
+            event.error = str(e)
+            _notify(event)
+            raise
+        event.duration = time.perf_counter() - start
+        data = getattr(result, 'data', None)
+        event.rows = len(data) if isinstance(data, list) else int(data is not None)
+        _notify(event)
+        return result
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _InstrumentedBuilder(result, self._table, self._ops + [(name, args)])
+            return result
+        return wrapper
+
+
+class InstrumentedClient:
+    """Proxy del cliente de Supabase que instrumenta table(), from_() y rpc()"""
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def table(self, name: str) -> _InstrumentedBuilder:
+        return _InstrumentedBuilder(self._client.table(name), name, [])
+
+    def from_(self, name: str) -> _InstrumentedBuilder:
+        return _InstrumentedBuilder(self._client.from_(name), name, [])
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None, *args, **kwargs) -> _InstrumentedBuilder:
+        builder = self._client.rpc(fn, params or {}, *args, **kwargs)
+        return _InstrumentedBuilder(builder, f"rpc:{fn}", [('rpc', (fn,))])
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def instrument_client(client: Any) -> InstrumentedClient:
+    """Envuelve un cliente de Supabase para registrar sus consultas"""
+    return InstrumentedClient(client)
+
+
+# === Middleware HTTP ===
+
+class MetricsMiddleware:
+    """Middleware ASGI que registra latencia, status y requests en curso por ruta"""
+
+    def __init__(self, app):
+        self.app = app
+        self._route_cache: Dict[Tuple[str, str], str] = {}
+
+    def _route_template(self, scope) -> str:
+        """Plantilla de ruta (p. ej. /query/swimmer/{swimmer_id:int}) para acotar la cardinalidad"""
+        key = (scope['method'], scope['path'])
+        template = self._route_cache.get(key)
+        if template is not None:
+            return template
+
+        from starlette.routing import Match
+
+        template = 'unmatched'
+        app = scope.get('app')
+        for route in getattr(app, 'routes', []):
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                template = getattr(route, 'path', template)
+                if match == Match.FULL:
+                    break
+        if len(self._route_cache) < 4096:
+            self._route_cache[key] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route_template(scope)
+        method = scope['method']
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            http_request_duration.observe(time.perf_counter() - start, method=method, route=route)
+            http_requests_total.inc(method=method, route=route, status=status['code'])
+
+
+def stats_collector(prefix: str, help_text: str,
+                    stats: Callable[[], Dict[str, Any]]) -> Collector:
+    """Colector que expone como gauges los valores numéricos de un dict de estadísticas"""
+    def collect() -> List[_Metric]:
+        metrics = []
+        for key, value in stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            gauge = Gauge(f"{prefix}_{key}", f"{help_text}: {key}")
+            gauge.set(value)
+            metrics.append(gauge)
+        return metrics
+    return collect
+
+
+def render_metrics() -> str:
+    """Texto Prometheus de todas las métricas registradas"""
+    return registry.render()
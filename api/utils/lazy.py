@@ -0,0 +1,87 @@
+"""
+Lazy Loading - AquaLytics API
+Importación diferida de dependencias pesadas (pandas, NumPy, SDK de Supabase)
+y reporte de tiempos de arranque por módulo.
+"""
+
+import sys
+import time
+import importlib
+import logging
+from types import ModuleType
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Referencia aproximada del inicio del proceso (primer import de este módulo)
+_PROCESS_START = time.perf_counter()
+
+_startup_imports: Dict[str, float] = {}
+_lazy_imports: Dict[str, float] = {}
+_ready: Dict[str, float] = {}
+
+# Dependencias que no deberían cargarse durante el arranque
+HEAVY_MODULES = ['pandas', 'numpy', 'chardet', 'supabase', 'postgrest', 'httpx']
+
+
+def _import(module_name: str, registry: Dict[str, float]) -> ModuleType:
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    registry[module_name] = round(elapsed_ms, 2)
+    logger.debug(f"Import de {module_name}: {elapsed_ms:.1f}ms")
+    return module
+
+
+def timed_import(module_name: str) -> ModuleType:
+    """Importa un módulo durante el arranque registrando su tiempo de importación"""
+    return _import(module_name, _startup_imports)
+
+
+def lazy_import(module_name: str) -> ModuleType:
+    """Importa un módulo en su primer uso registrando el tiempo de importación"""
+    return _import(module_name, _lazy_imports)
+
+
+class LazyModule:
+    """
+    Proxy de módulo que difiere la importación hasta el primer acceso a un atributo.
+
+    Uso: `pd = LazyModule('pandas')` y luego `pd.read_csv(...)` como siempre.
+    """
+
+    def __init__(self, module_name: str):
+        self.__dict__['_module_name'] = module_name
+        self.__dict__['_module'] = None
+
+    def _load(self) -> ModuleType:
+        if self.__dict__['_module'] is None:
+            self.__dict__['_module'] = lazy_import(self.__dict__['_module_name'])
+        return self.__dict__['_module']
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __repr__(self) -> str:
+        state = 'cargado' if self.__dict__['_module'] is not None else 'diferido'
+        return f"<LazyModule {self.__dict__['_module_name']} ({state})>"
+
+
+def mark_ready(name: str) -> float:
+    """Registra el instante en que un componente quedó listo (ms desde el arranque)"""
+    elapsed_ms = round((time.perf_counter() - _PROCESS_START) * 1000, 2)
+    _ready[name] = elapsed_ms
+    return elapsed_ms
+
+
+def startup_report() -> Dict[str, Any]:
+    """Reporte de arranque: imports por módulo, imports diferidos y dependencias cargadas"""
+    return {
+        'ready_ms': dict(_ready),
+        'startup_imports_ms': dict(_startup_imports),
+        'lazy_imports_ms': dict(_lazy_imports),
+        'heavy_modules_loaded': {name: name in sys.modules for name in HEAVY_MODULES}
+    }
@@ -0,0 +1,324 @@
+"""
+Leaderboard Index - AquaLytics API
+Índice en memoria con la mejor marca de cada nadador por (prueba_id, metrica_id)
+en contenedores ordenados: top-K, posición y percentil en O(log n) sin consultar la BD.
+"""
+
+import os
+import sys
+import time
+import threading
+import logging
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+
+from sortedcontainers import SortedList
+
+from utils.db_constants import TIEMPO_15M_ID
+
+logger = logging.getLogger(__name__)
+
+# Clave de prueba para los rankings que agregan todas las pruebas de una métrica
+ALL_PRUEBAS = 0
+
+# Métricas donde un valor mayor es mejor (por prefijo del nombre en 'metricas');
+# el resto (tiempos, brazadas) se ordena de menor a mayor
+_HIGHER_IS_BETTER_PREFIXES = ('Velocidad', 'Distancia')
+
+PAGE_SIZE = 1000
+
+Entry = Tuple[float, Optional[int]]  # (valor, competencia_id)
+
+
+class Leaderboard:
+    """Mejor marca por nadador ordenada; empates por id_nadador"""
+
+    def __init__(self, higher_is_better: bool = False):
+        self.higher_is_better = higher_is_better
+        self._sorted = SortedList()  # (clave de orden, id_nadador)
+        self._best: Dict[int, Entry] = {}
+
+    def _key(self, value: float) -> float:
+        return -value if self.higher_is_better else value
+
+    def _improves(self, value: float, current: float) -> bool:
+        return value > current if self.higher_is_better else value < current
+
+    def offer(self, swimmer_id: int, value: float, competencia_id: Optional[int] = None) -> bool:
+        """Registra una marca; devuelve True si es la nueva mejor del nadador"""
+        current = self._best.get(swimmer_id)
+        if current is not None:
+            if not self._improves(value, current[0]):
+                return False
+            self._sorted.remove((self._key(current[0]), swimmer_id))
+        self._best[swimmer_id] = (value, competencia_id)
+        self._sorted.add((self._key(value), swimmer_id))
+        return True
+
+    def top(self, k: int) -> List[Tuple[int, float, Optional[int]]]:
+        """Los k mejores: (id_nadador, valor, competencia_id)"""
+        return [
+            (swimmer_id, *self._best[swimmer_id])
+            for _, swimmer_id in self._sorted.islice(0, k)
+        ]
+
+    def rank(self, swimmer_id: int) -> Optional[int]:
+        """Posición (1 = mejor) del nadador"""
+        entry = self._best.get(swimmer_id)
+        if entry is None:
+            return None
+        return self._sorted.index((self._key(entry[0]), swimmer_id)) + 1
+
+    def percentile(self, swimmer_id: int) -> Optional[float]:
+        """Porcentaje de nadadores con marca igual o peor"""
+        position = self.rank(swimmer_id)
+        if position is None:
+            return None
+        return round(100.0 * (len(self._sorted) - position + 1) / len(self._sorted), 2)
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado (dicts, listas internas y tuplas)"""
+        size = sys.getsizeof(self._best) + sys.getsizeof(self._sorted._lists)
+        size += sum(sys.getsizeof(entry) for entry in self._best.values())
+        size += sum(sys.getsizeof(sub) for sub in self._sorted._lists)
+        size += sum(sys.getsizeof(item) for item in self._sorted)
+        return size
+
+
+BoardKey = Tuple[int, int, bool]  # (prueba_id | ALL_PRUEBAS, metrica_id, higher_is_better)
+
+
+class LeaderboardIndex:
+    """
+    Leaderboards de todas las pruebas y métricas.
+
+    Se construye con una carga masiva de `registros` y se mantiene con
+    `apply_records` desde la ingesta. Cada proceso tiene su propio índice:
+    con varios workers, AQUALYTICS_LEADERBOARD_TTL fuerza reconstrucciones
+    periódicas para recoger lo insertado por otros procesos.
+    """
+
+    def __init__(self, max_age: float = 0.0, extra_directions: Optional[Dict[int, bool]] = None):
+        self.max_age = max_age
+        # Órdenes adicionales al natural de la métrica (metrica_id -> higher_is_better)
+        self.extra_directions = extra_directions or {}
+        self._boards: Dict[BoardKey, Leaderboard] = {}
+        self._higher_is_better: Dict[int, bool] = {}
+        self._swimmer_names: Dict[int, str] = {}
+        self._competition_names: Dict[int, str] = {}
+        self._client = None
+        self._lock = threading.Lock()
+        # Serializa las reconstrucciones (se toma antes que _lock, nunca dentro)
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._pending: List[Any] = []
+        self._built_at: Optional[float] = None
+        self._stats: Dict[str, Any] = {}
+
+    # === Construcción ===
+
+    @property
+    def is_built(self) -> bool:
+        return self._built_at is not None
+
+    def _needs_build(self) -> bool:
+        expired = self.max_age > 0 and self._built_at is not None \
+            and time.time() - self._built_at > self.max_age
+        return not self.is_built or expired
+
+    def ensure_built(self, supabase_client) -> None:
+        """
+        Construye el índice en el primer uso o cuando supera max_age. Con
+        llamadas concurrentes solo una reconstruye; las demás esperan y
+        vuelven a comprobar antes de repetir la carga.
+        """
+        if not self._needs_build():
+            return
+        with self._build_lock:
+            if self._needs_build():
+                self._rebuild(supabase_client)
+
+    def rebuild(self, supabase_client) -> Dict[str, Any]:
+        """Recarga todos los registros y reemplaza los leaderboards de forma atómica"""
+        with self._build_lock:
+            return self._rebuild(supabase_client)
+
+    def _rebuild(self, supabase_client) -> Dict[str, Any]:
+        start = time.perf_counter()
+        client = supabase_client.client
+        with self._lock:
+            self._building = True
+            self._pending = []
+        try:
+            metricas = client.table('metricas').select('metrica_id, nombre').execute().data or []
+            higher = {
+                m['metrica_id']: str(m.get('nombre') or '').startswith(_HIGHER_IS_BETTER_PREFIXES)
+                for m in metricas
+            }
+            swimmers = {
+                n['id_nadador']: n['nombre']
+                for n in client.table('nadadores').select('id_nadador, nombre').execute().data or []
+            }
+            competitions = {
+                c['competencia_id']: c['competencia']
+                for c in client.table('competencias').select('competencia_id, competencia').execute().data or []
+            }
+
+            boards: Dict[BoardKey, Leaderboard] = {}
+            rows = 0
+            offset = 0
+            while True:
+                page = client.table('registros') \
+                    .select('id_nadador, prueba_id, metrica_id, valor, competencia_id') \
+                    .order('registro_id') \
+                    .range(offset, offset + PAGE_SIZE - 1) \
+                    .execute().data or []
+                for r in page:
+                    self._offer(boards, higher, r['prueba_id'], r['metrica_id'],
+                                r['id_nadador'], r['valor'], r.get('competencia_id'))
+                rows += len(page)
+                if len(page) < PAGE_SIZE:
+                    break
+                offset += PAGE_SIZE
+        except Exception:
+            with self._lock:
+                self._building = False
+            raise
+
+        with self._lock:
+            # Registros ingeridos durante la carga
+            for record in self._pending:
+                self._offer(boards, higher, record.prueba_id, record.metrica_id,
+                            record.id_nadador, record.valor, record.competencia_id)
+            self._boards = boards
+            self._higher_is_better = higher
+            self._swimmer_names = swimmers
+            self._competition_names = competitions
+            self._client = supabase_client
+            self._building = False
+            self._pending = []
+            self._built_at = time.time()
+            self._stats = {'rows_loaded': rows, 'build_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+        logger.info(f"Leaderboards construidos: {len(boards)} desde {rows} registros en {self._stats['build_ms']}ms")
+        return self.stats()
+
+    def _offer(self, boards: Dict[BoardKey, Leaderboard], higher: Dict[int, bool],
+               prueba_id: int, metrica_id: int, swimmer_id: int,
+               value: Any, competencia_id: Optional[int]) -> None:
+        if value is None or swimmer_id is None:
+            return
+        value = float(value)
+        directions = {higher.get(metrica_id, False)}
+        if metrica_id in self.extra_directions:
+            directions.add(self.extra_directions[metrica_id])
+        for direction in directions:
+            for prueba_key in (prueba_id, ALL_PRUEBAS):
+                board = boards.get((prueba_key, metrica_id, direction))
+                if board is None:
+                    board = boards[(prueba_key, metrica_id, direction)] = Leaderboard(direction)
+                board.offer(swimmer_id, value, competencia_id)
+
+    def apply_records(self, records: Iterable[Any]) -> None:
+        """Actualiza los leaderboards con MetricRecord recién insertados"""
+        with self._lock:
+            if self._building:
+                self._pending.extend(records)
+                return
+            if not self.is_built:
+                return
+            for record in records:
+                self._offer(self._boards, self._higher_is_better, record.prueba_id, record.metrica_id,
+                            record.id_nadador, record.valor, record.competencia_id)
+
+    # === Consultas ===
+
+    def board(self, prueba_id: Optional[int], metrica_id: int,
+              higher_is_better: Optional[bool] = None) -> Optional[Leaderboard]:
+        """Leaderboard de una prueba (o de todas con prueba_id=None)"""
+        if higher_is_better is None:
+            higher_is_better = self._higher_is_better.get(metrica_id, False)
+        return self._boards.get((prueba_id or ALL_PRUEBAS, metrica_id, higher_is_better))
+
+    def _resolve_names(self, swimmer_ids: Iterable[int], competition_ids: Iterable[int]) -> None:
+        """Completa en una sola consulta por tabla los nombres de nadadores/competencias nuevos"""
+        missing = [i for i in set(swimmer_ids) if i not in self._swimmer_names]
+        if missing and self._client is not None:
+            for n in self._client.client.table('nadadores').select('id_nadador, nombre') \
+                    .in_('id_nadador', missing).execute().data or []:
+                self._swimmer_names[n['id_nadador']] = n['nombre']
+        missing = [i for i in set(competition_ids) if i is not None and i not in self._competition_names]
+        if missing and self._client is not None:
+            for c in self._client.client.table('competencias').select('competencia_id, competencia') \
+                    .in_('competencia_id', missing).execute().data or []:
+                self._competition_names[c['competencia_id']] = c['competencia']
+
+    def top(self, prueba_id: Optional[int], metrica_id: int, k: int,
+            higher_is_better: Optional[bool] = None) -> List[Dict[str, Any]]:
+        """Top-K con nombres de nadador y competencia"""
+        board = self.board(prueba_id, metrica_id, higher_is_better)
+        if board is None:
+            return []
+        # apply_records modifica los leaderboards bajo el mismo lock
+        with self._lock:
+            entries = board.top(k)
+        self._resolve_names((e[0] for e in entries), (e[2] for e in entries))
+        return [
+            {
+                'posicion': i + 1,
+                'id_nadador': swimmer_id,
+                'nadador': self._swimmer_names.get(swimmer_id, 'N/A'),
+                'valor': value,
+                'competencia_id': competencia_id,
+                'competencia': self._competition_names.get(competencia_id, 'N/A')
+            }
+            for i, (swimmer_id, value, competencia_id) in enumerate(entries)
+        ]
+
+    def swimmer_position(self, prueba_id: Optional[int], metrica_id: int,
+                         swimmer_id: int) -> Optional[Dict[str, Any]]:
+        """Posición, percentil y mejor marca de un nadador"""
+        board = self.board(prueba_id, metrica_id)
+        if board is None:
+            return None
+        with self._lock:
+            position = board.rank(swimmer_id)
+            if position is None:
+                return None
+            value, competencia_id = board._best[swimmer_id]
+            return {
+                'id_nadador': swimmer_id,
+                'posicion': position,
+                'percentil': board.percentile(swimmer_id),
+                'total_nadadores': len(board),
+                'valor': value,
+                'competencia_id': competencia_id
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            boards = list(self._boards.values())
+            entries = sum(len(b) for b in boards)
+            memory = sum(b.memory_bytes() for b in boards)
+        return {
+            'built': self.is_built,
+            'built_at': self._built_at,
+            'age_seconds': round(time.time() - self._built_at, 1) if self._built_at else None,
+            'boards': len(boards),
+            'entries': entries,
+            'memory_bytes': memory,
+            **self._stats
+        }
+
+
+def leaderboard_enabled() -> bool:
+    return os.getenv('AQUALYTICS_LEADERBOARD') == '1'
+
+
+leaderboard_index = LeaderboardIndex(
+    max_age=float(os.getenv('AQUALYTICS_LEADERBOARD_TTL', '0')),
+    # /query/rankings ordena Tiempo 15m de mayor a menor
+    extra_directions={TIEMPO_15M_ID: True}
+)
@@ -0,0 +1,263 @@
+"""
+Loop Monitor - AquaLytics API
+Detector de bloqueos del event loop: un latido asíncrono mide el retraso del
+loop y un hilo vigía captura la pila del hilo del loop mientras está bloqueado.
+Los bloqueos se agregan por punto de llamada (la corrutina que ejecutaba el
+paso bloqueante) con conteo y tiempo bloqueado total, para /debug/loop-blocks.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import Counter as TallyCounter, deque
+from typing import Dict, List, Optional, Any, Deque, Tuple
+
+from utils.instrumentation import registry
+from utils.profiling import _folded_stack, _IDLE_FILES
+
+logger = logging.getLogger(__name__)
+
+# Raíz del código de la aplicación (api/): las demás pilas son de librerías
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+_COROUTINE_FLAGS = inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+# Sitio de un bloqueo que terminó antes de que el vigía tomara una muestra
+UNSAMPLED_SITE = '<sin muestra>'
+# Sitio que agrupa los bloqueos cuando se alcanza el máximo de sitios
+OTHER_SITE = '<otros>'
+
+loop_lag_seconds = registry.histogram(
+    'aqualytics_event_loop_lag_seconds',
+    'Retraso del event loop medido por el latido',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+loop_blocks_total = registry.counter(
+    'aqualytics_event_loop_blocks_total',
+    'Bloqueos del event loop por encima del umbral'
+)
+
+
+def loop_block_threshold_ms() -> float:
+    """Umbral de bloqueo en ms (AQUALYTICS_LOOP_BLOCK_MS); 0 deshabilita el monitor"""
+    return float(os.getenv('AQUALYTICS_LOOP_BLOCK_MS', '0'))
+
+
+def _relative(filename: str) -> str:
+    return filename[len(APP_ROOT):] if filename.startswith(APP_ROOT) else os.path.basename(filename)
+
+
+def _call_site(frame) -> Tuple[str, str]:
+    """
+    (sitio, hoja) de una pila del hilo del loop.
+
+    El sitio es la corrutina más interna del código de la aplicación, con la
+    línea que estaba ejecutando: el `async def` que hace trabajo síncrono. Sin
+    corrutinas de la aplicación, el frame más interno de la aplicación.
+    """
+    leaf = f"{_relative(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+    fallback = None
+    current = frame
+    while current is not None:
+        code = current.f_code
+        if code.co_filename.startswith(APP_ROOT) and code.co_filename != __file__:
+            site = f"{_relative(code.co_filename)}:{current.f_lineno} {code.co_name}"
+            if code.co_flags & _COROUTINE_FLAGS:
+                return site, leaf
+            fallback = fallback or site
+        current = current.f_back
+    return fallback or leaf, leaf
+
+
+class LoopMonitor:
+    """
+    Latido en el loop + hilo vigía.
+
+    El latido duerme `interval` y registra el retraso con que despierta; si
+    supera el umbral, el loop estuvo bloqueado ese tiempo. Mientras el latido
+    llega con más de medio umbral de retraso, el vigía muestrea cada
+    `threshold/4` la pila del hilo del loop (descartando el loop en espera);
+    al despertar, el latido atribuye el bloqueo al sitio más muestreado.
+    """
+
+    def __init__(self, threshold_ms: Optional[float] = None, interval: float = 0.01,
+                 max_sites: int = 200, max_events: int = 100):
+        if threshold_ms is None:
+            threshold_ms = loop_block_threshold_ms()
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.max_sites = max_sites
+        self._lock = threading.Lock()
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        # Muestras (sitio, hoja, pila) del bloqueo en curso
+        self._pending: List[Tuple[str, str, Optional[str]]] = []
+        self._last_beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started_at: Optional[float] = None
+        self._beats = 0
+        self._max_lag = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    @property
+    def running(self) -> bool:
+        # Un loop cerrado deja la tarea pendiente para siempre
+        return (self._task is not None and not self._task.done()
+                and self._loop is not None and not self._loop.is_closed())
+
+    def ensure_started(self) -> None:
+        """Arranca el monitor en el loop actual (idempotente; debe llamarse desde el loop)"""
+        if not self.enabled or self.running:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._started_at = time.time()
+        self._stop.clear()
+        self._task = loop.create_task(self._heartbeat())
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name='aqualytics-loop-watchdog', daemon=True)
+            self._watchdog.start()
+        logger.info(f"Monitor del event loop activo (bloqueos > {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            with self._lock:
+                self._last_beat = now
+                samples, self._pending = self._pending, []
+                self._beats += 1
+                self._max_lag = max(self._max_lag, lag)
+            loop_lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                self._record(lag, samples)
+
+    def _watch(self) -> None:
+        poll = max(self.threshold / 4, 0.001)
+        while not self._stop.wait(poll):
+            with self._lock:
+                stalled = time.perf_counter() - self._last_beat > self.interval + self.threshold / 2
+            if not stalled:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                continue
+            site, leaf = _call_site(frame)
+            stack = _folded_stack(frame)
+            del frame
+            with self._lock:
+                self._pending.append((site, leaf, stack))
+
+    def _record(self, lag: float, samples: List[Tuple[str, str, Optional[str]]]) -> None:
+        blocked_ms = lag * 1000
+        if samples:
+            site = TallyCounter(s for s, _, _ in samples).most_common(1)[0][0]
+            leaf, stack = next((l, st) for s, l, st in reversed(samples) if s == site)
+        else:
+            site, leaf, stack = UNSAMPLED_SITE, None, None
+        loop_blocks_total.inc()
+        now = time.time()
+        with self._lock:
+            if site not in self._sites and len(self._sites) >= self.max_sites:
+                site = OTHER_SITE
+            entry = self._sites.get(site)
+            if entry is None:
+                entry = self._sites[site] = {
+                    'call_site': site, 'count': 0, 'total_blocked_ms': 0.0,
+                    'max_blocked_ms': 0.0, 'leaf': leaf, 'stack': stack, 'last_seen': now
+                }
+            entry['count'] += 1
+            entry['total_blocked_ms'] += blocked_ms
+            entry['last_seen'] = now
+            if blocked_ms >= entry['max_blocked_ms']:
+                # La pila de ejemplo es la del peor bloqueo del sitio
+                entry['max_blocked_ms'] = blocked_ms
+                entry['leaf'], entry['stack'] = leaf or entry['leaf'], stack or entry['stack']
+            self._events.append({
+                'at': now, 'blocked_ms': round(blocked_ms, 2), 'call_site': site,
+                'leaf': leaf, 'samples': len(samples)
+            })
+
+    def sites(self, limit: int = 50, full: bool = False) -> List[Dict[str, Any]]:
+        """Sitios ordenados por tiempo bloqueado total; sin `full`, sin la pila completa"""
+        with self._lock:
+            entries = sorted(self._sites.values(), key=lambda e: e['total_blocked_ms'], reverse=True)
+            out = []
+            for entry in entries[:limit]:
+                item = dict(entry)
+                item['total_blocked_ms'] = round(item['total_blocked_ms'], 2)
+                item['max_blocked_ms'] = round(item['max_blocked_ms'], 2)
+                item['mean_blocked_ms'] = round(entry['total_blocked_ms'] / entry['count'], 2)
+                if not full:
+                    item.pop('stack')
+                out.append(item)
+            return out
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._events)[-limit:][::-1]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+            self._events.clear()
+            self._pending = []
+            self._max_lag = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'running': self.running,
+                'threshold_ms': self.threshold * 1000,
+                'started_at': self._started_at,
+                'heartbeats': self._beats,
+                'blocks': sum(e['count'] for e in self._sites.values()),
+                'blocked_ms_total': round(sum(e['total_blocked_ms'] for e in self._sites.values()), 2),
+                'max_lag_ms': round(self._max_lag * 1000, 2),
+                'sites': len(self._sites)
+            }
+
+
+loop_monitor = LoopMonitor()
+
+
+class LoopMonitorMiddleware:
+    """Arranca el monitor en el loop que sirve el primer request (con AQUALYTICS_LOOP_BLOCK_MS)"""
+
+    def __init__(self, app, monitor: LoopMonitor = loop_monitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.monitor.enabled and not self.monitor.running:
+            self.monitor.ensure_started()
+        await self.app(scope, receive, send)
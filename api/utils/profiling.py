@@ -0,0 +1,354 @@
+"""
+Profiling - AquaLytics API
+Perfilado bajo demanda de un request (cProfile o muestreo de pilas) y muestreo
+continuo de requests lentos, con almacenamiento acotado en disco.
+"""
+
+import os
+import io
+import sys
+import json
+import hmac
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import tempfile
+import threading
+from collections import Counter as TallyCounter, deque
+from typing import Dict, List, Optional, Any, Deque, Tuple
+from urllib.parse import parse_qs, urlencode
+
+from utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_MODE_HEADER = b'x-profile-mode'
+PROFILE_QUERY_PARAM = '_profile'
+
+# Hojas de pila que corresponden a hilos en espera (no aportan al perfil)
+_IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py')
+
+profiles_captured_total = registry.counter(
+    'aqualytics_profiles_captured_total',
+    'Perfiles capturados por tipo y motivo',
+    ('kind', 'reason')
+)
+
+
+def profile_token() -> Optional[str]:
+    """Token privilegiado que habilita el perfilado (AQUALYTICS_PROFILE_TOKEN)"""
+    return os.getenv('AQUALYTICS_PROFILE_TOKEN') or None
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    expected = profile_token()
+    return bool(expected and token and hmac.compare_digest(token, expected))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _folded_stack(frame, max_depth: int = 64) -> Optional[str]:
+    """Pila en formato 'collapsed' (raíz primero, separada por ';')"""
+    if os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+        return None
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Muestreador de pilas de todos los hilos vía sys._current_frames().
+
+    Cada muestra es (instante, pila colapsada); el buffer es acotado para que
+    el muestreo continuo tenga memoria constante.
+    """
+
+    def __init__(self, interval: float = 0.01, maxlen: int = 20000,
+                 active_only: bool = False):
+        self.interval = interval
+        self.active_only = active_only
+        self.samples: Deque[Tuple[float, str]] = deque(maxlen=maxlen)
+        self.in_flight = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'StackSampler':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='aqualytics-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.active_only and self.in_flight <= 0:
+                continue
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _folded_stack(frame)
+                if stack:
+                    self.samples.append((now, stack))
+
+    def collapse(self, start: float = 0.0, end: float = float('inf')) -> TallyCounter:
+        """Cuenta de muestras por pila en la ventana [start, end]"""
+        return TallyCounter(stack for ts, stack in list(self.samples) if start <= ts <= end)
+
+
+def _top_functions(stacks: TallyCounter, limit: int = 25) -> List[Dict[str, Any]]:
+    """Funciones con más muestras propias (hoja) e inclusivas"""
+    own, inclusive = TallyCounter(), TallyCounter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for label in set(frames):
+            inclusive[label] += count
+    return [
+        {'function': label, 'own_samples': own[label], 'inclusive_samples': count}
+        for label, count in inclusive.most_common(limit)
+    ]
+
+
+class ProfileStore:
+    """Perfiles en disco con un máximo de archivos (se borran los más antiguos)"""
+
+    def __init__(self, directory: str, max_profiles: int = 50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def _paths(self, profile_id: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, profile_id)
+        return f"{base}.json", base
+
+    def save(self, meta: Dict[str, Any], payload: bytes, extension: str) -> str:
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        meta = dict(meta, id=profile_id, file=f"{profile_id}.{extension}")
+        meta_path, base = self._paths(profile_id)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{base}.{extension}", 'wb') as f:
+                f.write(payload)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            self._prune()
+        profiles_captured_total.inc(kind=meta['kind'], reason=meta['reason'])
+        logger.info(f"Perfil {profile_id} guardado ({meta['kind']}, {meta['reason']}): {meta['path']}")
+        return profile_id
+
+    def _prune(self) -> None:
+        metas = sorted(f for f in os.listdir(self.directory) if f.endswith('.json'))
+        for name in metas[:max(0, len(metas) - self.max_profiles)]:
+            profile_id = name[:-5]
+            for f in os.listdir(self.directory):
+                if f.startswith(profile_id + '.'):
+                    os.remove(os.path.join(self.directory, f))
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith('.json'):
+                meta = self.get(name[:-5])
+                if meta:
+                    meta.pop('top', None)
+                    out.append(meta)
+        return out
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        meta_path, _ = self._paths(os.path.basename(profile_id))
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def raw(self, profile_id: str) -> Optional[Tuple[str, bytes]]:
+        meta = self.get(profile_id)
+        if meta is None:
+            return None
+        with open(os.path.join(self.directory, meta['file']), 'rb') as f:
+            return meta['file'], f.read()
+
+
+profile_store = ProfileStore(
+    directory=os.getenv('AQUALYTICS_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'aqualytics-profiles')),
+    max_profiles=int(os.getenv('AQUALYTICS_PROFILE_MAX', '50'))
+)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _query_param(scope, name: str) -> Optional[str]:
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get(name)
+    return values[0] if values else None
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI de perfilado.
+
+    - Bajo demanda: `X-Profile: <token>` (o `?_profile=<token>`) perfila ese
+      request con cProfile; `X-Profile-Mode: sampling` usa muestreo de pilas.
+      El request salta la caché de respuestas y devuelve `X-Profile-Id`.
+    - Continuo: con AQUALYTICS_SLOW_PROFILE_MS, un muestreador de baja
+      frecuencia guarda la ventana de muestras de los requests más lentos.
+    """
+
+    def __init__(self, app, store: ProfileStore = profile_store,
+                 slow_threshold_ms: Optional[float] = None,
+                 sample_interval: Optional[float] = None,
+                 exclude_prefixes: Tuple[str, ...] = ('/debug/', '/metrics')):
+        self.app = app
+        self.store = store
+        self.exclude_prefixes = exclude_prefixes
+        if slow_threshold_ms is None:
+            slow_threshold_ms = float(os.getenv('AQUALYTICS_SLOW_PROFILE_MS', '0'))
+        if sample_interval is None:
+            sample_interval = float(os.getenv('AQUALYTICS_SAMPLE_INTERVAL_MS', '20')) / 1000
+        self.slow_threshold_ms = slow_threshold_ms
+        self.sample_interval = sample_interval
+        self._background: Optional[StackSampler] = None
+        self._profiler_lock = threading.Lock()
+
+    def _background_sampler(self) -> Optional[StackSampler]:
+        if self.slow_threshold_ms <= 0:
+            return None
+        if self._background is None:
+            self._background = StackSampler(self.sample_interval, active_only=True).start()
+            logger.info(f"Muestreo de requests lentos activo (> {self.slow_threshold_ms:.0f}ms)")
+        return self._background
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        token = _header(scope, PROFILE_HEADER) or _query_param(scope, PROFILE_QUERY_PARAM)
+        if token and is_authorized(token):
+            await self._profile_request(scope, receive, send)
+            return
+
+        sampler = self._background_sampler()
+        if sampler is None:
+            await self.app(scope, receive, send)
+            return
+
+        sampler.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            end = time.perf_counter()
+            sampler.in_flight -= 1
+            elapsed_ms = (end - start) * 1000
+            if elapsed_ms >= self.slow_threshold_ms:
+                stacks = sampler.collapse(start, end)
+                if stacks:
+                    self._save_sampled(scope, stacks, elapsed_ms, 'slow')
+
+    async def _profile_request(self, scope, receive, send):
+        mode = _header(scope, PROFILE_MODE_HEADER) or 'cprofile'
+        # Perfilar el trabajo real, no un acierto de la caché de respuestas
+        scope = dict(scope, headers=[
+            (k, v) for k, v in scope['headers'] if k != b'cache-control'
+        ] + [(b'cache-control', b'no-cache')])
+
+        # cProfile admite un solo perfilador activo; si está ocupado, muestrear
+        use_cprofile = mode != 'sampling' and self._profiler_lock.acquire(blocking=False)
+        profiler = cProfile.Profile() if use_cprofile else None
+        sampler = None if use_cprofile else StackSampler(interval=0.002).start()
+        profile_id: Dict[str, str] = {}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                # El perfil se cierra al empezar la respuesta para poder devolver su id
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if profiler is not None:
+                    profiler.disable()
+                    profile_id['id'] = self._save_cprofile(scope, profiler, elapsed_ms)
+                    self._profiler_lock.release()
+                else:
+                    sampler.stop()
+                    profile_id['id'] = self._save_sampled(scope, sampler.collapse(), elapsed_ms, 'on_demand')
+                message = dict(message)
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-profile-id', profile_id['id'].encode('latin-1'))
+                ]
+            await send(message)
+
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if 'id' not in profile_id:
+                # La app falló antes de responder: cerrar el perfilador sin guardar
+                if profiler is not None:
+                    profiler.disable()
+                    self._profiler_lock.release()
+                else:
+                    sampler.stop()
+
+    def _meta(self, scope, elapsed_ms: float, kind: str, reason: str) -> Dict[str, Any]:
+        return {
+            'method': scope['method'],
+            'path': scope['path'],
+            # Sin el token privilegiado
+            'query': urlencode([
+                (k, v) for k, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()
+                for v in values if k != PROFILE_QUERY_PARAM
+            ]),
+            'duration_ms': round(elapsed_ms, 2),
+            'kind': kind,
+            'reason': reason,
+            'created_at': time.time()
+        }
+
+    def _save_cprofile(self, scope, profiler: cProfile.Profile, elapsed_ms: float) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(30)
+        meta = self._meta(scope, elapsed_ms, 'cprofile', 'on_demand')
+        meta['top'] = stream.getvalue()
+        # Formato binario de pstats: se abre con pstats/snakeviz
+        fd, tmp_path = tempfile.mkstemp(suffix='.prof')
+        os.close(fd)
+        try:
+            stats.dump_stats(tmp_path)
+            with open(tmp_path, 'rb') as f:
+                payload = f.read()
+        finally:
+            os.remove(tmp_path)
+        return self.store.save(meta, payload, 'prof')
+
+    def _save_sampled(self, scope, stacks: TallyCounter, elapsed_ms: float, reason: str) -> str:
+        meta = self._meta(scope, elapsed_ms, 'sampling', reason)
+        meta['samples'] = sum(stacks.values())
+        meta['top'] = _top_functions(stacks)
+        # Formato 'collapsed' (flamegraph.pl, speedscope)
+        payload = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()).encode('utf-8')
+        return self.store.save(meta, payload, 'folded')
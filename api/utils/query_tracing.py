@@ -0,0 +1,254 @@
+"""
+Query Tracing - AquaLytics API
+Traza por request de cada consulta a Supabase (tabla, filtros, duración, filas)
+con detección de patrones N+1 y un buffer circular consultable en /debug/traces.
+"""
+
+import os
+import time
+import uuid
+import logging
+import contextvars
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Deque, Tuple
+
+from utils.instrumentation import QueryEvent, add_query_observer
+
+logger = logging.getLogger(__name__)
+
+# Métodos del builder que filtran (su primer argumento es la columna)
+_FILTER_METHODS = {
+    'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'is_', 'in_',
+    'contains', 'contained_by', 'match', 'filter', 'or_', 'not_'
+}
+_SHAPE_METHODS = _FILTER_METHODS | {'select', 'order', 'limit', 'range', 'insert', 'upsert', 'update', 'delete', 'rpc'}
+
+
+def _describe_arg(value: Any) -> Any:
+    """Resume argumentos largos (p. ej. listas de in_) para la traza"""
+    if isinstance(value, (list, tuple, set)):
+        return f"[{len(value)} valores]" if len(value) > 5 else list(value)
+    if isinstance(value, dict):
+        return f"{{{len(value)} campos}}"
+    return value
+
+
+@dataclass
+class TracedQuery:
+    """Consulta registrada dentro de una traza"""
+    table: str
+    operation: str
+    shape: str
+    filters: List[Tuple[str, List[Any]]]
+    duration_ms: float
+    rows: int
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'table': self.table,
+            'operation': self.operation,
+            'shape': self.shape,
+            'filters': [[name, args] for name, args in self.filters],
+            'duration_ms': self.duration_ms,
+            'rows': self.rows,
+            'error': self.error
+        }
+
+
+@dataclass
+class RequestTrace:
+    """Traza de las consultas de un request"""
+    method: str
+    path: str
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: float = field(default_factory=time.time)
+    queries: List[TracedQuery] = field(default_factory=list)
+    duration_ms: float = 0.0
+    status: Optional[int] = None
+
+    def n_plus_one(self, threshold: int) -> List[Dict[str, Any]]:
+        """Formas de consulta repetidas al menos `threshold` veces (probables N+1)"""
+        groups: Dict[str, List[TracedQuery]] = {}
+        for query in self.queries:
+            if _is_paginated(query.shape):
+                # Lectura paginada: la repetición es intencional
+                continue
+            groups.setdefault(query.shape, []).append(query)
+        return [
+            {
+                'shape': shape,
+                'count': len(queries),
+                'total_ms': round(sum(q.duration_ms for q in queries), 2)
+            }
+            for shape, queries in groups.items() if len(queries) >= threshold
+        ]
+
+    def summary(self, threshold: int) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'queries': len(self.queries),
+            'db_time_ms': round(sum(q.duration_ms for q in self.queries), 2),
+            'rows': sum(q.rows for q in self.queries),
+            'n_plus_one': self.n_plus_one(threshold)
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = \
+    contextvars.ContextVar('aqualytics_request_trace', default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """Traza del request en curso (None fuera de un request)"""
+    return _current_trace.get()
+
+
+def _query_shape(event: QueryEvent) -> str:
+    """Forma de la consulta: tabla, operación y columnas filtradas, sin valores"""
+    parts = [event.table]
+    for name, args in event.ops:
+        if name not in _SHAPE_METHODS:
+            continue
+        if name in _FILTER_METHODS or name == 'order':
+            parts.append(f"{name}({args[0] if args else ''})")
+        elif name == 'select':
+            parts.append(f"select({args[0] if args else '*'})")
+        else:
+            parts.append(name)
+    return ' '.join(parts)
+
+
+def _is_paginated(shape: str) -> bool:
+    """Páginas por offset (range) o por clave (gt/gte + order + limit)"""
+    tokens = shape.split(' ')[1:]
+    if 'range' in tokens:
+        return True
+    return 'limit' in tokens and any(t.startswith('order(') for t in tokens) \
+        and any(t.startswith(('gt(', 'gte(')) for t in tokens)
+
+
+def _trace_observer(event: QueryEvent) -> None:
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.queries.append(TracedQuery(
+        table=event.table,
+        operation=event.operation,
+        shape=_query_shape(event),
+        filters=[
+            (name, [_describe_arg(a) for a in args])
+            for name, args in event.ops if name in _FILTER_METHODS
+        ],
+        duration_ms=round(event.duration * 1000, 3),
+        rows=event.rows,
+        error=event.error
+    ))
+
+
+add_query_observer(_trace_observer)
+
+
+class TraceStore:
+    """Buffer circular de las trazas más recientes"""
+
+    def __init__(self, size: int = 100, n_plus_one_threshold: int = 3):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._traces: Deque[RequestTrace] = deque(maxlen=size)
+
+    def add(self, trace: RequestTrace) -> None:
+        self._traces.append(trace)
+
+    def recent(self, limit: int = 50, only_n_plus_one: bool = False,
+               full: bool = False) -> List[Dict[str, Any]]:
+        out = []
+        for trace in reversed(self._traces):
+            summary = trace.summary(self.n_plus_one_threshold)
+            if only_n_plus_one and not summary['n_plus_one']:
+                continue
+            if full:
+                summary['query_log'] = [q.to_dict() for q in trace.queries]
+            out.append(summary)
+            if len(out) >= limit:
+                break
+        return out
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        for trace in self._traces:
+            if trace.request_id == request_id:
+                summary = trace.summary(self.n_plus_one_threshold)
+                summary['query_log'] = [q.to_dict() for q in trace.queries]
+                return summary
+        return None
+
+
+trace_store = TraceStore(
+    size=int(os.getenv('AQUALYTICS_TRACE_BUFFER', '100')),
+    n_plus_one_threshold=int(os.getenv('AQUALYTICS_N_PLUS_ONE_THRESHOLD', '3'))
+)
+
+
+class QueryTraceMiddleware:
+    """
+    Middleware ASGI que abre una traza por request.
+
+    Siempre guarda la traza en el buffer circular; si el request trae
+    `X-Debug-Trace: 1` (o AQUALYTICS_TRACE_HEADERS=1) añade a la respuesta
+    el resumen en `X-DB-Trace` y el tiempo de BD en `Server-Timing`.
+    """
+
+    def __init__(self, app, store: TraceStore = trace_store,
+                 always_headers: Optional[bool] = None,
+                 exclude_prefixes: Tuple[str, ...] = ('/debug/', '/metrics')):
+        self.app = app
+        self.store = store
+        self.exclude_prefixes = exclude_prefixes
+        self.always_headers = always_headers if always_headers is not None \
+            else os.getenv('AQUALYTICS_TRACE_HEADERS') == '1'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(method=scope['method'], path=scope['path'])
+        token = _current_trace.set(trace)
+        debug = self.always_headers or any(
+            k == b'x-debug-trace' and v not in (b'', b'0') for k, v in scope['headers']
+        )
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                trace.status = message['status']
+                if debug:
+                    summary = trace.summary(self.store.n_plus_one_threshold)
+                    header = (
+                        f"id={trace.request_id}; queries={summary['queries']}; "
+                        f"db_ms={summary['db_time_ms']}; rows={summary['rows']}; "
+                        f"n_plus_one={len(summary['n_plus_one'])}"
+                    )
+                    message = dict(message)
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-db-trace', header.encode('latin-1')),
+                        (b'server-timing', f"db;dur={summary['db_time_ms']};desc=\"{summary['queries']} queries\"".encode('latin-1'))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            trace.duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            self.store.add(trace)
+            repeated = trace.n_plus_one(self.store.n_plus_one_threshold)
+            if repeated:
+                logger.warning(
+                    f"Probable N+1 en {trace.method} {trace.path}: " +
+                    ', '.join(f"{r['count']}x {r['shape']}" for r in repeated)
+                )
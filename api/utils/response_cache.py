@@ -0,0 +1,289 @@
+"""
+Response Cache - AquaLytics API
+Caché de respuestas para los endpoints /query/* con TTL por ruta, invalidación
+por etiquetas desde la ingesta y soporte de ETag / If-None-Match.
+"""
+
+import re
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, Callable, Iterable, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+TagBuilder = Callable[[Dict[str, str], Dict[str, str]], List[str]]
+
+
+@dataclass
+class CachePolicy:
+    """Política de caché para una ruta"""
+    path: str  # Plantilla de ruta, p. ej. '/query/swimmer/{swimmer_id}'
+    ttl: float  # Segundos
+    tags: Optional[TagBuilder] = None  # (path_params, query_params) -> etiquetas base
+
+    def __post_init__(self):
+        pattern = re.sub(r'\{(\w+)(?::\w+)?\}', r'(?P<\1>[^/]+)', self.path)
+        self._regex = re.compile(f'^{pattern}$')
+
+    def match(self, path: str) -> Optional[Dict[str, str]]:
+        m = self._regex.match(path)
+        return m.groupdict() if m else None
+
+
+@dataclass
+class CacheEntry:
+    """Respuesta almacenada"""
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+    etag: str
+    expires_at: float
+    tags: Set[str] = field(default_factory=set)
+
+
+class ResponseCache:
+    """Almacén LRU de respuestas con índice de etiquetas"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        # Las invalidaciones también llegan desde hilos en segundo plano (refresco de vistas)
+        self._lock = threading.RLock()
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._tag_index: Dict[str, Set[str]] = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'stores': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'bytes_saved': 0
+        }
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            self._stats['stores'] += 1
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Elimina todas las entradas asociadas a alguna de las etiquetas"""
+        tags = list(tags)
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tag_index.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+        if keys:
+            logger.info(f"Caché invalidada: {len(keys)} entradas ({', '.join(sorted(tags))})")
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+
+    def record(self, stat: str, amount: int = 1) -> None:
+        self._stats[stat] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        """Estadísticas de uso (ratio de aciertos y bytes ahorrados)"""
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'entries': len(self._entries),
+            'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else 0.0
+        }
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+
+# === Etiquetas ===
+
+def registro_tags(nadador_id: Any, prueba_id: Any, metrica_id: Any) -> List[str]:
+    """Etiquetas afectadas por la inserción de un registro"""
+    return [
+        'registros',
+        f'swimmer:{nadador_id}',
+        f'metrica:{metrica_id}',
+        f'prueba:{prueba_id}:metrica:{metrica_id}'
+    ]
+
+
+def invalidate_for_records(records: Iterable[Any]) -> int:
+    """Invalida las entradas afectadas por una lista de MetricRecord insertados"""
+    tags: Set[str] = {'nadadores', 'competencias'}
+    for record in records:
+        tags.update(registro_tags(record.id_nadador, record.prueba_id, record.metrica_id))
+    return response_cache.invalidate_tags(tags)
+
+
+def add_cache_tags(request: Any, *tags: str) -> None:
+    """Permite a un handler añadir etiquetas a la respuesta que genera"""
+    request.state.cache_tags = list(getattr(request.state, 'cache_tags', [])) + list(tags)
+
+
+def skip_cache(request: Any) -> None:
+    """Marca la respuesta del request como no cacheable"""
+    request.state.cache_skip = True
+
+
+# === Middleware ===
+
+def _normalize_query(query_string: bytes) -> str:
+    """Ordena los parámetros y descarta los vacíos para que la clave sea estable"""
+    params = [(k.strip(), v.strip()) for k, v in parse_qsl(query_string.decode('latin-1'))]
+    return urlencode(sorted((k, v) for k, v in params if v))
+
+
+def _compute_etag(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+class ResponseCacheMiddleware:
+    """Middleware ASGI que sirve respuestas GET desde la caché según la política de la ruta"""
+
+    def __init__(self, app, cache: 'ResponseCache', policies: List[CachePolicy]):
+        self.app = app
+        self.cache = cache
+        self.policies = policies
+
+    def _match(self, path: str) -> Tuple[Optional[CachePolicy], Dict[str, str]]:
+        for policy in self.policies:
+            params = policy.match(path)
+            if params is not None:
+                return policy, params
+        return None, {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+
+        policy, path_params = self._match(scope['path'])
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        if_none_match = headers.get('if-none-match')
+        query = _normalize_query(scope.get('query_string', b''))
+        # La representación negociada (JSON / MessagePack) forma parte de la clave
+        variant = 'msgpack' if 'application/msgpack' in headers.get('accept', '') else 'json'
+        key = f"{scope['path']}?{query}#{variant}"
+
+        if 'no-cache' not in headers.get('cache-control', ''):
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.record('hits')
+                self.cache.record('bytes_saved', len(entry.body))
+                await self._send_entry(entry, if_none_match, send)
+                return
+        self.cache.record('misses')
+
+        state = scope.setdefault('state', {})
+        state['cache_tags'] = []
+        state['cache_skip'] = False
+
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+
+        async def capture(message):
+            if message['type'] == 'http.response.start':
+                start.update(message)
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, receive, capture)
+
+        body = b''.join(chunks)
+        status = start.get('status', 500)
+        response_headers = [
+            (k, v) for k, v in start.get('headers', [])
+            if k.lower() not in (b'etag', b'cache-control', b'vary')
+        ]
+        # La clave incluye la variante negociada por Accept: los caches intermedios deben saberlo
+        vary = [v for k, v in start.get('headers', []) if k.lower() == b'vary']
+        if not any(b'accept' in [part.strip().lower() for part in v.split(b',')] for v in vary):
+            vary.append(b'Accept')
+        response_headers.append((b'vary', b', '.join(vary)))
+        entry = CacheEntry(
+            status=status,
+            headers=response_headers,
+            body=body,
+            etag=_compute_etag(body),
+            expires_at=time.monotonic() + policy.ttl,
+            tags=set(policy.tags(path_params, dict(parse_qsl(query))) if policy.tags else [])
+                 | set(state.get('cache_tags', []))
+        )
+
+        if status == 200 and not state.get('cache_skip'):
+            self.cache.set(key, entry)
+            if await self._send_entry(entry, if_none_match, send):
+                self.cache.record('bytes_saved', len(body))
+        else:
+            await send({'type': 'http.response.start', 'status': status, 'headers': start.get('headers', [])})
+            await send({'type': 'http.response.body', 'body': body})
+
+    async def _send_entry(self, entry: CacheEntry, if_none_match: Optional[str], send) -> bool:
+        """Envía la entrada; responde 304 si el ETag coincide (retorna True en ese caso)"""
+        etag_header = (b'etag', entry.etag.encode('latin-1'))
+        if _etag_matches(if_none_match, entry.etag):
+            self.cache.record('not_modified')
+            headers = [(k, v) for k, v in entry.headers if k.lower() != b'content-length']
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers + [etag_header]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return True
+        await send({
+            'type': 'http.response.start',
+            'status': entry.status,
+            'headers': entry.headers + [etag_header, (b'cache-control', b'no-cache')]
+        })
+        await send({'type': 'http.response.body', 'body': entry.body})
+        return False
+
+
+# Instancia global de la caché (compartida por el servidor unificado)
+response_cache = ResponseCache()
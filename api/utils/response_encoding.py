@@ -0,0 +1,109 @@
+"""
+Response Encoding - AquaLytics API
+Serialización rápida de respuestas: JSON con orjson (fallback a json estándar)
+y MessagePack opcional para los endpoints de datos de gráficas.
+"""
+
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    # Fallback a json estándar si orjson no está instalado
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def _default(obj: Any) -> Any:
+    """Convierte tipos no serializables de forma nativa (fechas, Decimal, NumPy)"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'tolist'):
+        # Escalares y arrays de NumPy
+        return obj.tolist() if orjson is not None else _nan_to_none(obj.tolist())
+    raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+
+
+def _nan_to_none(obj: Any) -> Any:
+    """NaN e infinitos como None (null), igual que orjson; solo para el fallback"""
+    if isinstance(obj, float):
+        return None if obj != obj or obj in (float('inf'), float('-inf')) else obj
+    if isinstance(obj, dict):
+        return {k: _nan_to_none(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_nan_to_none(v) for v in obj]
+    return obj
+
+
+def dumps_json(content: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(
+            content, default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+    return json.dumps(
+        _nan_to_none(content), default=_default, ensure_ascii=False,
+        allow_nan=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    """Serializa a MessagePack"""
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse con serialización orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+class MsgPackResponse(Response):
+    """Respuesta MessagePack para clientes que la soliciten"""
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return dumps_msgpack(content)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """El cliente pide MessagePack vía Accept o ?format=msgpack"""
+    if msgpack is None:
+        return False
+    if request.query_params.get('format') == 'msgpack':
+        return True
+    return MSGPACK_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def negotiated_response(request: Request, content: Any, status_code: int = 200,
+                        binary: bool = False) -> Response:
+    """
+    Construye la respuesta en el formato negociado.
+
+    Args:
+        binary: El endpoint admite MessagePack (datos de gráficas)
+    """
+    if binary and wants_msgpack(request):
+        return MsgPackResponse(content, status_code=status_code, headers={'vary': 'Accept'})
+    return FastJSONResponse(content, status_code=status_code)
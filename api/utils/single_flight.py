@@ -0,0 +1,183 @@
+"""
+Single Flight - AquaLytics API
+Coalescencia de consultas idénticas concurrentes: la primera llamada con unos
+argumentos ejecuta la consulta y las que llegan mientras está en curso esperan
+su resultado. Una ventana corta de stale-while-revalidate sirve el último
+resultado mientras una sola llamada lo renueva (activo con AQUALYTICS_SINGLE_FLIGHT=1).
+"""
+
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Any, Callable, Awaitable, Hashable
+
+from utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+single_flight_calls_total = registry.counter(
+    'aqualytics_single_flight_calls_total',
+    'Llamadas coalescidas por resultado (leader, coalesced, fresh, stale)',
+    ('result',)
+)
+
+
+def single_flight_enabled() -> bool:
+    return os.getenv('AQUALYTICS_SINGLE_FLIGHT') == '1'
+
+
+@dataclass
+class _Result:
+    value: Any
+    produced_at: float
+
+
+class SingleFlight:
+    """
+    Ejecuciones compartidas por clave.
+
+    Los métodos de DataQueryService son async pero llaman a la BD de forma
+    síncrona: ejecutados en el loop no se solaparían nunca. El líder corre en
+    un pool de hilos propio (con su propio event loop y el contexto del
+    request) y todos los que esperan, en cualquier loop o hilo, comparten su
+    concurrent.futures.Future.
+
+    Un resultado exitoso se sirve sin más durante `fresh_ttl` y, durante los
+    `stale_ttl` segundos siguientes, se sirve igual pero lanza una sola
+    revalidación en segundo plano.
+    """
+
+    def __init__(self, fresh_ttl: float = 0.0, stale_ttl: Optional[float] = None,
+                 max_workers: Optional[int] = None, max_entries: int = 256):
+        if stale_ttl is None:
+            stale_ttl = float(os.getenv('AQUALYTICS_SWR_SECONDS', '2'))
+        if max_workers is None:
+            max_workers = int(os.getenv('AQUALYTICS_QUERY_THREADS', '8'))
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._results: 'OrderedDict[Hashable, _Result]' = OrderedDict()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Las invalidaciones descartan los resultados de ejecuciones que ya estaban en curso
+        self._generation = 0
+        self._stats = {'leaders': 0, 'coalesced': 0, 'fresh_hits': 0, 'stale_hits': 0,
+                       'revalidations': 0, 'errors': 0, 'invalidations': 0}
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='aqualytics-query')
+        return self._executor
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Resultado de `fn()` para `key`, compartido con las llamadas concurrentes"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                age = now - cached.produced_at
+                if age <= self.fresh_ttl:
+                    self._stats['fresh_hits'] += 1
+                    single_flight_calls_total.inc(result='fresh')
+                    return cached.value
+                if age <= self.fresh_ttl + self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    single_flight_calls_total.inc(result='stale')
+                    if key not in self._in_flight:
+                        self._stats['revalidations'] += 1
+                        self._start(key, fn)
+                    return cached.value
+                del self._results[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                single_flight_calls_total.inc(result='coalesced')
+            else:
+                self._stats['leaders'] += 1
+                single_flight_calls_total.inc(result='leader')
+                future = self._start(key, fn)
+        # Cancelar a un solo cliente no debe cancelar la ejecución compartida
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _start(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Future:
+        """Lanza la ejecución en el pool (con el lock tomado)"""
+        context = contextvars.copy_context()
+        future = self._pool().submit(context.run, self._execute, key, fn, self._generation)
+        self._in_flight[key] = future
+        return future
+
+    def _execute(self, key: Hashable, fn: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        try:
+            value = asyncio.run(fn())
+        except BaseException:
+            with self._lock:
+                self._stats['errors'] += 1
+                self._release(key, generation)
+            raise
+        with self._lock:
+            self._release(key, generation)
+            # Solo se guardan respuestas exitosas producidas tras la última invalidación
+            if generation == self._generation and self.stale_ttl + self.fresh_ttl > 0 \
+                    and isinstance(value, dict) and value.get('success'):
+                self._results[key] = _Result(value, time.monotonic())
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return value
+
+    def _release(self, key: Hashable, generation: int) -> None:
+        """
+        Quita la ejecución de `_in_flight` (con el lock tomado). Tras una
+        invalidación la entrada puede ser ya de un líder más reciente: solo
+        el de la generación vigente la retira.
+        """
+        if generation == self._generation:
+            self._in_flight.pop(key, None)
+
+    def invalidate(self) -> None:
+        """Descarta los resultados guardados; las llamadas nuevas no se unen a las ejecuciones en curso"""
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
+            self._in_flight.clear()
+            self._stats['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': single_flight_enabled(),
+                'stale_ttl': self.stale_ttl,
+                **self._stats,
+                'in_flight': len(self._in_flight),
+                'entries': len(self._results)
+            }
+
+
+# Instancia global compartida por los servicios de consulta
+query_flights = SingleFlight()
+
+
+def single_flight(method: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Decorador para métodos async de servicio: con AQUALYTICS_SINGLE_FLIGHT=1,
+    las llamadas concurrentes con los mismos argumentos (en la misma instancia)
+    comparten una ejecución a través de `query_flights`.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if not single_flight_enabled():
+            return await method(self, *args, **kwargs)
+        key = (id(self), method.__name__, repr(args), repr(sorted(kwargs.items())))
+        return await query_flights.do(key, lambda: method(self, *args, **kwargs))
+    return wrapper
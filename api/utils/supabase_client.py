@@ -9,11 +9,11 @@ from dataclasses import dataclass, asdict
 import logging
 from datetime import datetime, date
 
-from supabase import create_client, Client
-from supabase.client import ClientOptions
-from postgrest import APIError
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+
+from utils.lazy import lazy_import
+from utils.instrumentation import instrument_client, id_cache_lookups_total
 try:
     from calculations.swimming_metrics import SwimmingMetrics
 except ImportError:
@@ -62,8 +62,8 @@ def _apply_httpx_compatibility_patch():
     
     logger.debug("Parche de compatibilidad httpx aplicado exitosamente")
 
-# Aplicar el parche al importar el módulo
-_apply_httpx_compatibility_patch()
+# El parche se aplica al crear el primer cliente (ver SupabaseClient.__init__),
+# así importar este módulo no carga httpx ni el SDK de Supabase
 
 @dataclass
 class DatabaseConfig:
@@ -148,15 +148,26 @@ class SupabaseClient:
         'records': 'registros'
     }
     
-    def __init__(self):
-        """Inicializa el cliente de Supabase"""
-        url = os.getenv('SUPABASE_URL')
-        key = os.getenv('SUPABASE_ANON_KEY')
-        
-        if not url or not key:
-            raise ValueError("SUPABASE_URL y SUPABASE_ANON_KEY deben estar configurados")
-        
-        self.client: Client = create_client(url, key)
+    def __init__(self, client: Any = None, service_role: bool = False):
+        """
+        Inicializa el cliente de Supabase. `client` permite usar otro cliente con
+        la misma API (p. ej. el backend en memoria de benchmarks/); `service_role`
+        usa SUPABASE_SERVICE_ROLE_KEY en lugar de la clave anónima.
+        """
+        if client is None:
+            key_name = 'SUPABASE_SERVICE_ROLE_KEY' if service_role else 'SUPABASE_ANON_KEY'
+            url = os.getenv('SUPABASE_URL')
+            key = os.getenv(key_name)
+            
+            if not url or not key:
+                raise ValueError(f"SUPABASE_URL y {key_name} deben estar configurados")
+            
+            # SDK de Supabase y parche httpx diferidos hasta el primer cliente
+            _apply_httpx_compatibility_patch()
+            supabase = lazy_import('supabase')
+            client = supabase.create_client(url, key)
+        # Cliente instrumentado: cada consulta se registra en /metrics
+        self.client = instrument_client(client)
         self._cache = {
             'nadadores': {},
             'pruebas': {},
@@ -165,14 +176,21 @@ class SupabaseClient:
             'fases': {}
         }
     
+    def _cache_get(self, table: str, key: str) -> Optional[int]:
+        """Busca un ID en la cache interna registrando acierto/fallo"""
+        value = self._cache[table].get(key)
+        id_cache_lookups_total.inc(table=table, result='hit' if value is not None else 'miss')
+        return value
+    
     # === Métodos para Nadadores ===
     
     def get_or_create_nadador(self, nombre: str, edad: Optional[int] = None, 
                               peso: Optional[int] = None) -> int:
         """Obtiene o crea un nadador y retorna su ID"""
         # Verificar cache
-        if nombre in self._cache['nadadores']:
-            return self._cache['nadadores'][nombre]
+        cached = self._cache_get('nadadores', nombre)
+        if cached is not None:
+            return cached
         
         # Buscar en DB
         result = self.client.table('nadadores').select('*').eq('nombre', nombre).execute()
@@ -199,8 +217,9 @@ class SupabaseClient:
     def get_prueba_by_name(self, nombre_prueba: str) -> Optional[int]:
         """Busca una prueba por nombre y retorna su ID"""
         # Verificar cache
-        if nombre_prueba in self._cache['pruebas']:
-            return self._cache['pruebas'][nombre_prueba]
+        cached = self._cache_get('pruebas', nombre_prueba)
+        if cached is not None:
+            return cached
         
         # Buscar en DB
         result = self.client.table('pruebas').select('*').eq('nombre', nombre_prueba).execute()
@@ -217,8 +236,9 @@ class SupabaseClient:
         cache_key = f"{distancia}m_{estilo}_{curso}"
         
         # Verificar cache
-        if cache_key in self._cache['pruebas']:
-            return self._cache['pruebas'][cache_key]
+        cached = self._cache_get('pruebas', cache_key)
+        if cached is not None:
+            return cached
         
         # Primero obtener IDs de distancia y estilo
         dist_result = self.client.table('distancias').select('*').eq('distancia', distancia).execute()
@@ -250,8 +270,9 @@ class SupabaseClient:
     def get_metrica_id(self, nombre_metrica: str) -> Optional[int]:
         """Obtiene el ID de una métrica por su nombre"""
         # Verificar cache
-        if nombre_metrica in self._cache['metricas']:
-            return self._cache['metricas'][nombre_metrica]
+        cached = self._cache_get('metricas', nombre_metrica)
+        if cached is not None:
+            return cached
         
         # Buscar en DB
         result = self.client.table('metricas').select('*').eq('nombre', nombre_metrica).execute()
@@ -273,8 +294,9 @@ class SupabaseClient:
     def get_or_create_competencia(self, nombre_competencia: str) -> int:
         """Obtiene o crea una competencia y retorna su ID"""
         # Verificar cache
-        if nombre_competencia in self._cache['competencias']:
-            return self._cache['competencias'][nombre_competencia]
+        cached = self._cache_get('competencias', nombre_competencia)
+        if cached is not None:
+            return cached
         
         # Buscar en DB
         result = self.client.table('competencias').select('*').eq('competencia', nombre_competencia).execute()
@@ -297,8 +319,9 @@ class SupabaseClient:
     def get_fase_id(self, nombre_fase: str) -> Optional[int]:
         """Obtiene el ID de una fase por su nombre"""
         # Verificar cache
-        if nombre_fase in self._cache['fases']:
-            return self._cache['fases'][nombre_fase]
+        cached = self._cache_get('fases', nombre_fase)
+        if cached is not None:
+            return cached
         
         # Buscar en DB
         result = self.client.table('fases').select('*').eq('nombre', nombre_fase).execute()
@@ -309,7 +332,95 @@ class SupabaseClient:
             return fase_id
         
         return None
-    
+
+    # === Métodos por lotes ===
+
+    # tabla de la cache -> (columna del nombre, columna del ID, crear si falta)
+    ID_LOOKUPS = {
+        'nadadores': ('nombre', 'id_nadador', True),
+        'pruebas': ('nombre', 'id', False),
+        'metricas': ('nombre', 'metrica_id', False),
+        'competencias': ('competencia', 'competencia_id', True),
+        'fases': ('nombre', 'fase_id', False)
+    }
+
+    def get_ids_by_name(self, table: str, names: List[str]) -> Dict[str, int]:
+        """
+        Resuelve varios nombres de una tabla con un solo `in_()` para los que
+        no están en cache. En nadadores y competencias los que faltan se crean
+        con un único insert, como get_or_create_*. Los nombres sin ID no
+        aparecen en el resultado.
+        """
+        name_column, id_column, create = self.ID_LOOKUPS[table]
+        ids: Dict[str, int] = {}
+        missing = []
+        for name in dict.fromkeys(names):
+            cached = self._cache_get(table, name)
+            if cached is not None:
+                ids[name] = cached
+            else:
+                missing.append(name)
+
+        if missing:
+            result = self.client.table(table).select('*').in_(name_column, missing).execute()
+            for row in result.data or []:
+                ids.setdefault(row[name_column], row[id_column])
+
+            to_create = [name for name in missing if name not in ids] if create else []
+            if to_create:
+                insert_result = self.client.table(table).insert(
+                    [{name_column: name} for name in to_create]
+                ).execute()
+                for row in insert_result.data or []:
+                    ids[row[name_column]] = row[id_column]
+
+            for name in missing:
+                if name in ids:
+                    self._cache[table][name] = ids[name]
+        return ids
+
+    def get_prueba_ids_by_details(self, details: List[tuple]) -> Dict[tuple, int]:
+        """
+        Versión por lotes de get_prueba_by_details para tuplas
+        (distancia, estilo, curso): una consulta por tabla en lugar de tres
+        por prueba.
+        """
+        ids: Dict[tuple, int] = {}
+        missing = []
+        for detail in dict.fromkeys(details):
+            distancia, estilo, curso = detail
+            cached = self._cache_get('pruebas', f"{distancia}m_{estilo}_{curso}")
+            if cached is not None:
+                ids[detail] = cached
+            else:
+                missing.append(detail)
+        if not missing:
+            return ids
+
+        distancias = {row['distancia']: row['distancia_id'] for row in self.client.table('distancias')
+                      .select('*').in_('distancia', list({d for d, _, _ in missing})).execute().data or []}
+        estilos = {row['nombre']: row['estilo_id'] for row in self.client.table('estilos')
+                   .select('*').in_('nombre', list({e for _, e, _ in missing})).execute().data or []}
+        if not distancias or not estilos:
+            return ids
+
+        result = self.client.table('pruebas').select('*') \
+            .in_('distancia_id', list(distancias.values())) \
+            .in_('estilo_id', list(estilos.values())) \
+            .in_('curso', list({c for _, _, c in missing})) \
+            .execute()
+        pruebas = {}
+        for row in result.data or []:
+            pruebas.setdefault((row['distancia_id'], row['estilo_id'], row['curso']), row['id'])
+
+        for detail in missing:
+            distancia, estilo, curso = detail
+            prueba_id = pruebas.get((distancias.get(distancia), estilos.get(estilo), curso))
+            if prueba_id is not None:
+                ids[detail] = prueba_id
+                self._cache['pruebas'][f"{distancia}m_{estilo}_{curso}"] = prueba_id
+        return ids
+
     # === Métodos para Registros ===
     
     def insert_metric_records(self, records: List[MetricRecord]) -> Dict[str, Any]:
@@ -0,0 +1,261 @@
+"""
+Validation Schema - AquaLytics API
+Esquema declarativo único para las métricas de natación, compilado una sola vez
+al importar el módulo y compartido por CSVProcessor y SwimmingDataValidator.
+"""
+
+from typing import Dict, List, Optional, Any, Callable, Tuple, Union
+from dataclasses import dataclass
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Number = Union[int, float, np.ndarray]
+
+
+@dataclass(frozen=True)
+class FieldRule:
+    """Regla declarativa de un campo numérico"""
+    name: str
+    kind: str  # 'float' o 'int'
+    min: Number
+    max: Number
+    decimals: Optional[int] = None  # Redondeo al sanitizar (solo 'float')
+    required: bool = False  # Requerido para cálculo automático
+    metric: bool = True  # Métrica manual (False para campos de contexto)
+    per_distance: bool = False  # `max` es el de 50m y escala con la distancia de la prueba
+
+
+@dataclass(frozen=True)
+class CrossFieldRule:
+    """
+    Regla de consistencia entre campos.
+
+    `fails` recibe los valores sanitizados (0 si el campo falta) y la distancia,
+    y usa solo operadores que funcionan igual sobre escalares y arrays NumPy,
+    de modo que la misma definición sirve para un registro o para un batch.
+    """
+    name: str
+    description: str
+    fails: Callable[[Dict[str, Number], Number], Any]
+    message: Callable[[Dict[str, Any], float], str]
+
+
+def _safe_div(a: Number, b: Number) -> Number:
+    """División que devuelve 0 cuando el divisor es 0 (escalares o arrays)"""
+    if isinstance(b, np.ndarray) or isinstance(a, np.ndarray):
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+        return np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+    return a / b if b else 0.0
+
+
+def _speed_diff(v: Dict[str, Number]) -> Number:
+    """Diferencia relativa de velocidad entre los dos tramos de 25m"""
+    speed1 = _safe_div(25, v['t25_1'])
+    speed2 = _safe_div(25, v['t25_2'])
+    return _safe_div(abs(speed2 - speed1), speed1)
+
+
+# ===== ESQUEMA =====
+
+FIELDS: List[FieldRule] = [
+    # Tiempos (segundos)
+    FieldRule('t15_1', 'float', 3.0, 30.0, decimals=2),
+    FieldRule('t15_2', 'float', 3.0, 30.0, decimals=2),
+    FieldRule('t25_1', 'float', 5.0, 60.0, decimals=2, required=True, per_distance=True),
+    FieldRule('t25_2', 'float', 5.0, 60.0, decimals=2, required=True, per_distance=True),
+    FieldRule('t_total', 'float', 10.0, 120.0, decimals=2, required=True, per_distance=True),
+    # Brazadas
+    FieldRule('brz_1', 'int', 1, 50, per_distance=True),
+    FieldRule('brz_2', 'int', 1, 50, per_distance=True),
+    FieldRule('brz_total', 'int', 2, 100, required=True, per_distance=True),
+    # Flechas (metros)
+    FieldRule('f1', 'float', 0.0, 15.0, decimals=2, required=True),
+    FieldRule('f2', 'float', 0.0, 15.0, decimals=2, required=True),
+    # Contexto
+    FieldRule('distancia', 'int', 25, 1500, metric=False),
+]
+
+# Las tolerancias superiores entre total y tramos solo valen en 50m, donde los
+# dos tramos de 25m cubren la prueba completa; en distancias mayores los tramos
+# no suman el total y solo se exige que el total no sea menor.
+RULES: List[CrossFieldRule] = [
+    CrossFieldRule(
+        'consistencia:t_total_menor', "tiempo total menor que la suma de tramos",
+        lambda v, d: (v['t_total'] > 0) & (v['t25_1'] > 0) & (v['t25_2'] > 0)
+                     & (v['t_total'] < v['t25_1'] + v['t25_2']),
+        lambda v, d: f"Tiempo total ({v['t_total']}s) menor que suma de segmentos ({v['t25_1'] + v['t25_2']:.2f}s)"
+    ),
+    CrossFieldRule(
+        'consistencia:t_total_excesivo', "tiempo total más de 10% mayor que la suma de tramos (50m)",
+        lambda v, d: (d == 50) & (v['t_total'] > 0) & (v['t25_1'] > 0) & (v['t25_2'] > 0)
+                     & (v['t_total'] > (v['t25_1'] + v['t25_2']) * 1.1),
+        lambda v, d: f"Tiempo total ({v['t_total']}s) excesivamente mayor que suma de segmentos ({v['t25_1'] + v['t25_2']:.2f}s)"
+    ),
+    CrossFieldRule(
+        'consistencia:brz_total_menor', "brazadas totales menores que la suma de tramos",
+        lambda v, d: (v['brz_total'] > 0) & (v['brz_1'] > 0) & (v['brz_2'] > 0)
+                     & (v['brz_total'] < v['brz_1'] + v['brz_2']),
+        lambda v, d: f"Total brazadas ({v['brz_total']}) menor que suma de segmentos ({v['brz_1'] + v['brz_2']})"
+    ),
+    CrossFieldRule(
+        'consistencia:brz_total_excesivo', "brazadas totales excesivas respecto a los tramos (50m)",
+        lambda v, d: (d == 50) & (v['brz_total'] > 0) & (v['brz_1'] > 0) & (v['brz_2'] > 0)
+                     & (v['brz_total'] > v['brz_1'] + v['brz_2'] + 5),
+        lambda v, d: f"Total brazadas ({v['brz_total']}) excesivamente mayor que suma de segmentos ({v['brz_1'] + v['brz_2']})"
+    ),
+    CrossFieldRule(
+        'consistencia:t15_1', "T15(1) mayor o igual que T25(1)",
+        lambda v, d: (v['t15_1'] > 0) & (v['t25_1'] > 0) & (v['t15_1'] >= v['t25_1']),
+        lambda v, d: f"T15(1) ({v['t15_1']}s) debe ser menor que T25(1) ({v['t25_1']}s)"
+    ),
+    CrossFieldRule(
+        'consistencia:t15_2', "T15(2) mayor o igual que T25(2)",
+        lambda v, d: (v['t15_2'] > 0) & (v['t25_2'] > 0) & (v['t15_2'] >= v['t25_2']),
+        lambda v, d: f"T15(2) ({v['t15_2']}s) debe ser menor que T25(2) ({v['t25_2']}s)"
+    ),
+    CrossFieldRule(
+        'consistencia:velocidad', "diferencia de velocidad entre tramos mayor a 50%",
+        lambda v, d: (v['t25_1'] > 0) & (v['t25_2'] > 0) & (_speed_diff(v) > 0.5),
+        lambda v, d: f"Diferencia de velocidad entre segmentos excesiva ({_speed_diff(v)*100:.1f}%). Verificar tiempos."
+    ),
+    CrossFieldRule(
+        'consistencia:diferencia_flechas', "diferencia entre flechas mayor a 10m",
+        lambda v, d: (v['f1'] > 0) & (v['f2'] > 0) & (abs(v['f1'] - v['f2']) > 10),
+        lambda v, d: f"Diferencia entre flechas muy alta: F1={v['f1']}m, F2={v['f2']}m"
+    ),
+    CrossFieldRule(
+        'consistencia:suma_flechas', "suma de flechas mayor o igual que la distancia",
+        lambda v, d: (v['f1'] + v['f2']) >= d,
+        lambda v, d: f"Suma de flechas ({v['f1'] + v['f2']}m) debe ser < distancia total ({d}m)"
+    ),
+]
+
+# Campos que intervienen en las reglas de consistencia
+CONSISTENCY_FIELDS = ['t15_1', 't15_2', 't25_1', 't25_2', 't_total', 'brz_1', 'brz_2', 'brz_total', 'f1', 'f2']
+
+
+# ===== COMPILACIÓN =====
+
+FieldValidator = Callable[..., Tuple[Any, Optional[str]]]
+
+
+def distance_scale(distance: Number) -> Number:
+    """
+    Factor de los límites `per_distance` respecto a 50m (nunca menor que 1,
+    así 25m conserva los límites de 50m). Distancia desconocida (NaN) = 50m.
+    """
+    if isinstance(distance, np.ndarray):
+        return np.maximum(np.nan_to_num(distance, nan=50.0), 50.0) / 50.0
+    if not isinstance(distance, (int, float)) or not distance or np.isnan(distance):
+        return 1.0
+    return max(distance, 50.0) / 50.0
+
+
+def _compile_field(rule: FieldRule) -> FieldValidator:
+    """Genera la función de validación escalar de un campo con sus límites ligados"""
+    name, lo, hi, decimals = rule.name, rule.min, rule.max, rule.decimals
+    per_distance = rule.per_distance
+
+    if rule.kind == 'int':
+        def validate_int(value: Any, distance: float = 50.0) -> Tuple[Any, Optional[str]]:
+            # Entero por valor: 10 y 10.0 valen, 10.5 no (igual que integer_mask)
+            if not isinstance(value, (int, float)) or not float(value).is_integer():
+                return None, f"'{name}' debe ser un número entero"
+            top = hi * distance_scale(distance) if per_distance else hi
+            if value < lo or value > top:
+                return None, f"'{name}' debe estar entre {lo} y {top:g}"
+            return int(value), None
+        return validate_int
+
+    def validate_float(value: Any, distance: float = 50.0) -> Tuple[Any, Optional[str]]:
+        if not isinstance(value, (int, float)):
+            return None, f"'{name}' debe ser numérico"
+        top = hi * distance_scale(distance) if per_distance else hi
+        if value < lo or value > top:
+            return None, f"'{name}' debe estar entre {lo} y {top}"
+        return (round(float(value), decimals) if decimals is not None else float(value)), None
+    return validate_float
+
+
+class CompiledSchema:
+    """Esquema compilado: validadores escalares por campo y máscaras vectoriales"""
+
+    def __init__(self, fields: List[FieldRule], rules: List[CrossFieldRule]):
+        self.fields: Dict[str, FieldRule] = {f.name: f for f in fields}
+        self.rules = rules
+        self.validators: Dict[str, FieldValidator] = {f.name: _compile_field(f) for f in fields}
+        self.metric_validators: Dict[str, FieldValidator] = {
+            f.name: self.validators[f.name] for f in fields if f.metric
+        }
+        self.ranges: Dict[str, Tuple[Number, Number]] = {f.name: (f.min, f.max) for f in fields}
+        self.required_fields: List[str] = [f.name for f in fields if f.required]
+        self.numeric_fields: List[str] = [f.name for f in fields]
+
+    def metric_ranges(self) -> Dict[str, Dict[str, Number]]:
+        """Rangos de las métricas manuales en formato {'campo': {'min', 'max'}}"""
+        return {
+            name: {'min': rule.min, 'max': rule.max}
+            for name, rule in self.fields.items() if rule.metric
+        }
+
+    # === Validación escalar ===
+
+    def consistency_errors(self, data: Dict[str, Any], distance: float = 50.0) -> List[str]:
+        """Evalúa las reglas de consistencia sobre un registro sanitizado"""
+        values = {name: data.get(name, 0) for name in CONSISTENCY_FIELDS}
+        return [
+            rule.message(values, distance)
+            for rule in self.rules if rule.fails(values, distance)
+        ]
+
+    # === Validación vectorial ===
+
+    def coerce_array(self, field_name: str, values: np.ndarray) -> np.ndarray:
+        """Convierte una columna a float64 aplicando el redondeo del campo"""
+        values = np.asarray(values, dtype=np.float64)
+        decimals = self.fields[field_name].decimals
+        return np.round(values, decimals) if decimals is not None else values
+
+    def range_mask(self, field_name: str, values: np.ndarray,
+                   distance: Union[float, np.ndarray] = 50.0) -> np.ndarray:
+        """
+        Máscara de valores fuera de rango (los NaN no se marcan). Los campos
+        `per_distance` escalan su máximo con `distance` (escalar o por fila).
+        """
+        lo, hi = self.ranges[field_name]
+        if self.fields[field_name].per_distance:
+            hi = hi * distance_scale(distance)
+        with np.errstate(invalid='ignore'):
+            return (values < lo) | (values > hi)
+
+    def integer_mask(self, field_name: str, values: np.ndarray) -> np.ndarray:
+        """Máscara de valores no enteros en campos enteros (los NaN no se marcan)"""
+        if self.fields[field_name].kind != 'int':
+            return np.zeros(len(values), dtype=bool)
+        return ~np.isnan(values) & (values != np.floor(values))
+
+    def consistency_masks(self, columns: Dict[str, np.ndarray],
+                          distance: Union[float, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Evalúa las reglas de consistencia sobre columnas: regla -> máscara de fallo"""
+        n = len(next(iter(columns.values()))) if columns else 0
+        values = {
+            name: np.nan_to_num(columns[name], nan=0.0) if name in columns else np.zeros(n)
+            for name in CONSISTENCY_FIELDS
+        }
+        with np.errstate(invalid='ignore'):
+            return {
+                rule.name: np.broadcast_to(rule.fails(values, distance), (n,)).copy()
+                for rule in self.rules
+            }
+
+
+def compile_schema(fields: List[FieldRule], rules: List[CrossFieldRule]) -> CompiledSchema:
+    """Compila el esquema declarativo"""
+    return CompiledSchema(fields, rules)
+
+
+# Esquema compilado compartido (una sola vez por proceso)
+SWIMMING_SCHEMA = compile_schema(FIELDS, RULES)
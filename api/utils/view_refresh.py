@@ -0,0 +1,202 @@
+"""
+View Refresh - AquaLytics API
+Refresco en segundo plano de las vistas materializadas de rendimiento
+(`refresh_performance_views`, migración 008). La ingesta notifica cada escritura;
+las ráfagas se agrupan en un único refresco con debounce y un máximo de staleness.
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional, Any, Callable
+
+from utils.instrumentation import registry
+from utils.lazy import lazy_import
+
+logger = logging.getLogger(__name__)
+
+RefreshFn = Callable[[Any], Any]
+
+view_refreshes_total = registry.counter(
+    'aqualytics_view_refreshes_total',
+    'Refrescos de vistas materializadas por resultado',
+    ('result',)
+)
+view_refresh_duration = registry.histogram(
+    'aqualytics_view_refresh_duration_seconds',
+    'Duración de refresh_performance_views',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+
+_service_role_client = None
+
+
+def _service_role(supabase_client):
+    """
+    Cliente con SUPABASE_SERVICE_ROLE_KEY: la migración 008 solo concede
+    EXECUTE de refresh_performance_views a service_role. Sin la clave se usa
+    el cliente recibido (p. ej. el backend en memoria de benchmarks/).
+    """
+    global _service_role_client
+    if not os.getenv('SUPABASE_SERVICE_ROLE_KEY'):
+        return supabase_client
+    if _service_role_client is None:
+        _service_role_client = lazy_import('utils.supabase_client').SupabaseClient(service_role=True)
+    return _service_role_client
+
+
+def refresh_performance_views(supabase_client) -> Any:
+    """Llama a la función SQL con el rol de servicio; devuelve los ms por vista"""
+    return _service_role(supabase_client).client.rpc('refresh_performance_views').execute().data
+
+
+class ViewRefreshScheduler:
+    """
+    Programa refrescos tras escrituras, fuera del camino de los requests.
+
+    Cada `notify` pospone el refresco `debounce` segundos desde la última
+    escritura, pero nunca más de `max_staleness` desde la primera escritura
+    sin refrescar. Un hilo dedicado ejecuta el RPC; las escrituras que llegan
+    durante un refresco dejan otro programado.
+    """
+
+    def __init__(self, refresh_fn: RefreshFn = refresh_performance_views,
+                 debounce: float = 5.0, max_staleness: float = 60.0,
+                 on_refreshed: Optional[Callable[[], None]] = None):
+        self.refresh_fn = refresh_fn
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self.on_refreshed = on_refreshed
+        self._client = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._dirty_since: Optional[float] = None  # primera escritura sin refrescar
+        self._last_write: Optional[float] = None
+        self._pending_writes = 0
+        self._force = False
+        self._running = False
+        self._refreshes = 0
+        self._coalesced_writes = 0
+        self._last: Dict[str, Any] = {}
+
+    # === Notificaciones ===
+
+    def notify(self, supabase_client, writes: int = 1) -> None:
+        """Registra escrituras en `registros` (no bloquea)"""
+        now = time.monotonic()
+        with self._cond:
+            self._client = supabase_client
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_write = now
+            self._pending_writes += writes
+            self._ensure_thread()
+            self._cond.notify()
+
+    def request_refresh(self, supabase_client) -> None:
+        """Refresco inmediato (manual), igualmente en segundo plano"""
+        with self._cond:
+            self._client = supabase_client
+            self._force = True
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='aqualytics-view-refresh', daemon=True)
+            self._thread.start()
+
+    def _due_at(self) -> Optional[float]:
+        if self._dirty_since is None:
+            return None
+        if self._force:
+            return 0.0
+        return min(self._last_write + self.debounce, self._dirty_since + self.max_staleness)
+
+    # === Hilo de refresco ===
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    due = self._due_at()
+                    if due is not None and time.monotonic() >= due:
+                        break
+                    self._cond.wait(None if due is None else due - time.monotonic())
+                if self._stopping:
+                    return
+                client = self._client
+                writes = self._pending_writes
+                staleness = time.monotonic() - self._dirty_since
+                self._dirty_since = self._last_write = None
+                self._pending_writes = 0
+                self._force = False
+                self._running = True
+            self._refresh(client, writes, staleness)
+
+    def _refresh(self, client, writes: int, staleness: float) -> None:
+        start = time.perf_counter()
+        try:
+            views = self.refresh_fn(client)
+            result, error = 'ok', None
+        except Exception as e:
+            views, result, error = None, 'error', str(e)
+            logger.error(f"Error refrescando vistas de rendimiento: {error}")
+        elapsed = time.perf_counter() - start
+        view_refreshes_total.inc(result=result)
+        view_refresh_duration.observe(elapsed)
+        with self._cond:
+            self._running = False
+            self._refreshes += 1
+            self._coalesced_writes += writes
+            self._last = {
+                'success': error is None,
+                'at': time.time(),
+                'duration_ms': round(elapsed * 1000, 2),
+                'writes': writes,
+                'staleness_s': round(staleness, 3),
+                'views_ms': views,
+                'error': error
+            }
+        if error is None:
+            logger.info(f"Vistas de rendimiento refrescadas en {elapsed * 1000:.0f}ms ({writes} escrituras agrupadas)")
+            if self.on_refreshed:
+                self.on_refreshed()
+
+    def close(self) -> None:
+        """Detiene el hilo (lo pendiente se refresca en el próximo arranque o a mano)"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            due = self._due_at()
+            return {
+                'pending_writes': self._pending_writes,
+                'refreshing': self._running,
+                'next_refresh_in_s': round(max(0.0, due - time.monotonic()), 3) if due is not None else None,
+                'debounce_s': self.debounce,
+                'max_staleness_s': self.max_staleness,
+                'refreshes': self._refreshes,
+                'coalesced_writes': self._coalesced_writes,
+                'last_refresh': self._last or None
+            }
+
+
+def view_refresh_enabled() -> bool:
+    return os.getenv('AQUALYTICS_VIEW_REFRESH') == '1'
+
+
+view_refresher = ViewRefreshScheduler(
+    debounce=float(os.getenv('AQUALYTICS_VIEW_REFRESH_DEBOUNCE_S', '5')),
+    max_staleness=float(os.getenv('AQUALYTICS_VIEW_REFRESH_MAX_STALENESS_S', '60'))
+)
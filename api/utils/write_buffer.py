@@ -0,0 +1,438 @@
+"""
+Write Buffer - AquaLytics API
+Buffer de escritura diferida (write-behind) para la ingesta de registros individuales:
+acepta registros validados de inmediato, los agrupa en inserts por lotes y los
+guarda en un journal local append-only (uno por proceso) para no perderlos ante una caída.
+"""
+
+import os
+import re
+import glob
+import json
+import time
+import asyncio
+import logging
+import contextlib
+import tempfile
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Sin flock (Windows) no se pueden adoptar journals de otros procesos
+    fcntl = None
+
+from utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+FlushFn = Callable[[List[Dict[str, Any]]], Dict[str, Any]]
+
+write_behind_queue_depth = registry.gauge(
+    'aqualytics_write_behind_queue_depth',
+    'Registros aceptados pendientes de insertar'
+)
+write_behind_flush_duration = registry.histogram(
+    'aqualytics_write_behind_flush_duration_seconds',
+    'Duración de cada flush del buffer de escritura'
+)
+write_behind_flush_latency = registry.histogram(
+    'aqualytics_write_behind_record_latency_seconds',
+    'Tiempo desde que se acepta un registro hasta que se inserta',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+write_behind_records_total = registry.counter(
+    'aqualytics_write_behind_records_total',
+    'Registros procesados por el buffer de escritura (accepted, inserted, dead_letter)',
+    ('result',)
+)
+write_behind_flushes_total = registry.counter(
+    'aqualytics_write_behind_flushes_total',
+    'Flushes del buffer de escritura por resultado y motivo',
+    ('result', 'reason')
+)
+
+
+def _read_journal(f) -> Tuple[List[Tuple[int, Dict[str, Any]]], int]:
+    """(seq, registro) sin confirmar de un journal abierto y el mayor seq visto"""
+    f.seek(0)
+    records: Dict[int, Dict[str, Any]] = {}
+    acked = 0
+    for line in f:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # Línea truncada por una caída durante la escritura
+            continue
+        if 'ack' in entry:
+            acked = max(acked, entry['ack'])
+        else:
+            records[entry['seq']] = entry['record']
+    pending = [(seq, rec) for seq, rec in sorted(records.items()) if seq > acked]
+    return pending, max([acked] + list(records))
+
+
+def _fsync_directory(directory: str) -> None:
+    """Hace durable un rename dentro de `directory` (no disponible en todas las plataformas)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _try_lock(f) -> bool:
+    """flock exclusivo sin esperar; False si otro proceso vivo lo tiene"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+class WriteBehindBuffer:
+    """
+    Cola de registros con flush por tamaño o por tiempo.
+
+    Cada registro se escribe en el journal como {"seq": n, "record": {...}}
+    antes de confirmarse; tras un flush correcto se escribe {"ack": n}. Los
+    flushes toman siempre los registros más antiguos, así que `ack` es
+    monótono y al arrancar se reencolan los registros con seq > último ack.
+    La entrega es al-menos-una-vez: una caída entre el insert y el ack puede
+    duplicar ese lote.
+
+    Cada proceso escribe su propio journal (`<journal_path>.<pid>`) y lo
+    mantiene bloqueado con flock mientras vive; al abrirse, adopta los
+    journals de procesos terminados (los que se pueden bloquear) y los borra
+    cuando sus registros ya están guardados (fsync) en el journal propio.
+
+    Si un lote falla se reintenta fila a fila: las filas que fallan mientras
+    otras del mismo lote entran, o la primera de la cola tras `max_attempts`
+    reintentos sin que entre ninguna, pasan al fichero de descarte
+    (`<journal_path>.dead-letter`) para no bloquear a las siguientes.
+    """
+
+    # Fallos consecutivos sin ningún insert que se toman como caída de la BD
+    OUTAGE_PROBES = 3
+
+    def __init__(self, flush_fn: FlushFn, journal_path: str,
+                 max_batch: int = 200, max_delay: float = 0.5,
+                 fsync: bool = False, on_flushed: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 max_attempts: int = 10):
+        self.flush_fn = flush_fn
+        self.journal_base = journal_path
+        self.journal_path = f"{journal_path}.{os.getpid()}"
+        self.dead_letter_path = f"{journal_path}.dead-letter"
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.on_flushed = on_flushed
+        self.max_attempts = max_attempts
+        self._pending: List[Tuple[int, float, Dict[str, Any]]] = []  # (seq, aceptado, registro)
+        self._attempts: Dict[int, int] = {}  # seq -> reintentos fallidos como cabeza de la cola
+        self._seq = 0
+        self._journal = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._retry_delay = max_delay
+        self._last_flush: Optional[Dict[str, Any]] = None
+        self._dead_letters = 0
+
+    # === Journal ===
+
+    def open(self) -> None:
+        """Abre el journal del proceso, recupera lo pendiente y programa su flush (idempotente)"""
+        self._open()
+
+    def _open(self) -> None:
+        if self._journal is not None:
+            return
+        # El pid se fija al abrir: el buffer puede haberse creado antes de un fork
+        self.journal_path = f"{self.journal_base}.{os.getpid()}"
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        journal = open(self.journal_path, 'a+', encoding='utf-8')
+        _try_lock(journal)
+        # Un journal con nuestro pid es de un proceso anterior (pid reutilizado)
+        pending, self._seq = _read_journal(journal)
+        now = time.perf_counter()
+        self._pending = [(seq, now, rec) for seq, rec in pending]
+        orphans = self._adopt_orphans()
+        adopted = 0
+        for _, _, records in orphans:
+            for record in records:
+                self._seq += 1
+                self._pending.append((self._seq, now, record))
+            adopted += len(records)
+
+        # Reescribir solo lo pendiente (descarta acks y una posible línea truncada)
+        # en un temporal con fsync que se renombra sobre el journal: los huérfanos
+        # se borran cuando sus registros ya están en disco en nuestro journal
+        try:
+            self._journal = self._rewrite(journal)
+        finally:
+            for path, f, _ in orphans:
+                if self._journal is not None:
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        logger.warning(f"No se pudo borrar el journal adoptado {path}: {str(e)}")
+                # Cerrar libera su lock; si la reescritura falló, otro proceso lo adopta
+                f.close()
+        self._flush_lock = asyncio.Lock()
+        write_behind_queue_depth.set(len(self._pending))
+        if self._pending:
+            logger.warning(f"Recuperados {len(self._pending)} registros sin confirmar del journal "
+                           f"({adopted} de procesos terminados)")
+            self._schedule(0)
+
+    def _rewrite(self, journal):
+        """
+        Escribe lo pendiente en un temporal bloqueado, con fsync, y lo renombra
+        sobre el journal del proceso. Devuelve el nuevo journal abierto (con
+        el lock tomado) y cierra el anterior.
+        """
+        directory = os.path.dirname(self.journal_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.journal_path) + '.', suffix='.tmp',
+                                        dir=directory)
+        new_journal = os.fdopen(fd, 'a+', encoding='utf-8')
+        try:
+            _try_lock(new_journal)
+            for seq, _, record in self._pending:
+                new_journal.write(json.dumps({'seq': seq, 'record': record}, separators=(',', ':')) + '\n')
+            new_journal.flush()
+            os.fsync(new_journal.fileno())
+            if fcntl is None:
+                # Sin flock (Windows) no se puede renombrar sobre un fichero abierto
+                journal.close()
+            os.replace(tmp_path, self.journal_path)
+        except BaseException:
+            new_journal.close()
+            journal.close()
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(directory)
+        journal.close()
+        return new_journal
+
+    def _adopt_orphans(self) -> List[Tuple[str, Any, List[Dict[str, Any]]]]:
+        """
+        Journals de procesos terminados (y el journal compartido antiguo) con
+        sus registros sin confirmar: (ruta, fichero abierto con el lock tomado,
+        registros). Quien llama los borra tras guardar los registros.
+        """
+        if fcntl is None:
+            return []
+        orphans = []
+        prefix = len(self.journal_base)
+        for path in sorted(glob.glob(glob.escape(self.journal_base) + '*')):
+            if path == self.journal_path or not re.fullmatch(r'(\.\d+)?', path[prefix:]):
+                continue
+            f = None
+            try:
+                f = open(path, 'r', encoding='utf-8')
+                # Bloqueado: su proceso sigue vivo. Sin enlaces: otro proceso ya lo adoptó
+                if not _try_lock(f) or os.fstat(f.fileno()).st_nlink == 0:
+                    f.close()
+                    continue
+                pending, _ = _read_journal(f)
+                orphans.append((path, f, [rec for _, rec in pending]))
+            except OSError as e:
+                if f is not None:
+                    f.close()
+                logger.warning(f"No se pudo adoptar el journal {path}: {str(e)}")
+        return orphans
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        self._journal.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _compact(self) -> None:
+        """Vacía el journal cuando no queda nada pendiente (sin cerrarlo: conserva el lock)"""
+        self._journal.seek(0)
+        self._journal.truncate()
+
+    def _dead_letter(self, entries: List[Tuple[int, float, Dict[str, Any]]], errors: Dict[int, Any]) -> None:
+        """Aparta registros que no se pueden insertar (append compartido entre procesos)"""
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            for seq, _, record in entries:
+                f.write(json.dumps({'record': record, 'errors': errors.get(seq), 'at': time.time()},
+                                   separators=(',', ':'), default=str) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._dead_letters += len(entries)
+        write_behind_records_total.inc(len(entries), result='dead_letter')
+        logger.error(f"{len(entries)} registros movidos a {self.dead_letter_path} tras fallar su insert")
+
+    # === Cola ===
+
+    def enqueue(self, record: Dict[str, Any]) -> int:
+        """Acepta un registro validado; devuelve su número de secuencia"""
+        self._open()
+        self._seq += 1
+        self._append({'seq': self._seq, 'record': record})
+        self._pending.append((self._seq, time.perf_counter(), record))
+        write_behind_queue_depth.set(len(self._pending))
+        write_behind_records_total.inc(result='accepted')
+
+        if len(self._pending) >= self.max_batch:
+            self._schedule(0, reason='size')
+        elif self._timer is None:
+            self._schedule(self.max_delay)
+        return self._seq
+
+    def _schedule(self, delay: float, reason: str = 'time') -> None:
+        if self._timer is not None:
+            if delay > 0:
+                return
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(delay, lambda: asyncio.ensure_future(self._flush_due(reason)))
+
+    async def _flush_due(self, reason: str) -> None:
+        self._timer = None
+        await self.flush(reason)
+        if self._pending and self._timer is None:
+            # Solo quedan pendientes si el flush falló: reintento con backoff
+            self._schedule(self._retry_delay)
+
+    async def _insert(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            # El insert es síncrono: fuera del event loop
+            return await asyncio.to_thread(self.flush_fn, records)
+        except Exception as e:
+            return {'success': False, 'errors': [str(e)]}
+
+    async def _insert_rows(self, batch: List[Tuple[int, float, Dict[str, Any]]]) -> Tuple[int, list, list, Dict[int, Any]]:
+        """
+        Reintento fila a fila de un lote fallido. Devuelve cuántas entradas
+        del principio del lote quedan resueltas, las insertadas, las
+        descartadas y los errores por seq. Las filas fallidas antes de la
+        última insertada se descartan; las posteriores siguen en la cola.
+        """
+        inserted, failed = [], []
+        errors: Dict[int, Any] = {}
+        resolved = 0
+        for i, entry in enumerate(batch):
+            result = await self._insert([entry[2]])
+            if result.get('success'):
+                inserted.append(entry)
+                resolved = i + 1
+                continue
+            failed.append(entry)
+            errors[entry[0]] = result.get('errors', [])
+            if not inserted and len(failed) >= min(self.OUTAGE_PROBES, len(batch)):
+                break
+
+        if inserted:
+            dead = [entry for entry in failed if entry[0] < inserted[-1][0]]
+            return resolved, inserted, dead, errors
+        # No entró ninguna: caída de la BD o cabeza defectuosa; se descarta tras max_attempts
+        head = batch[0][0]
+        self._attempts[head] = self._attempts.get(head, 0) + 1
+        if self._attempts[head] >= self.max_attempts:
+            return 1, [], [batch[0]], errors
+        return 0, [], [], errors
+
+    async def flush(self, reason: str = 'manual') -> Dict[str, Any]:
+        """Inserta los registros pendientes en lotes de max_batch"""
+        if self._journal is None:
+            return {'success': True, 'inserted': 0}
+        inserted = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                start = time.perf_counter()
+                result = await self._insert([rec for _, _, rec in batch])
+                if result.get('success'):
+                    resolved, written, dead, errors = len(batch), batch, [], {}
+                else:
+                    write_behind_flushes_total.inc(result='error', reason=reason)
+                    resolved, written, dead, errors = await self._insert_rows(batch)
+                elapsed = time.perf_counter() - start
+                write_behind_flush_duration.observe(elapsed)
+
+                if not resolved:
+                    self._retry_delay = min(self._retry_delay * 2, 30.0)
+                    failures = list(errors.values())[0] if errors else result.get('errors', [])
+                    self._last_flush = {'success': False, 'at': time.time(), 'errors': failures}
+                    logger.error(f"Flush de {len(batch)} registros fallido (reintento en {self._retry_delay:.1f}s): {failures}")
+                    return {'success': False, 'inserted': inserted, 'errors': failures}
+
+                if dead:
+                    self._dead_letter(dead, errors)
+                done = batch[:resolved]
+                del self._pending[:resolved]
+                for seq, _, _ in done:
+                    self._attempts.pop(seq, None)
+                self._append({'ack': done[-1][0]})
+                now = time.perf_counter()
+                for _, accepted_at, _ in written:
+                    write_behind_flush_latency.observe(now - accepted_at)
+                write_behind_records_total.inc(len(written), result='inserted')
+                if result.get('success'):
+                    write_behind_flushes_total.inc(result='ok', reason=reason)
+                write_behind_queue_depth.set(len(self._pending))
+                if written:
+                    self._retry_delay = self.max_delay
+                self._last_flush = {'success': True, 'at': time.time(), 'records': len(written),
+                                    'dead_letter': len(dead), 'duration_ms': round(elapsed * 1000, 2)}
+                inserted += len(written)
+                if self.on_flushed and written:
+                    self.on_flushed([rec for _, _, rec in written])
+            self._compact()
+        return {'success': True, 'inserted': inserted}
+
+    async def close(self) -> None:
+        """Flush final al apagar el servidor"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._journal is not None:
+            await self.flush('shutdown')
+            if not self._pending:
+                # Sin nada pendiente el journal sobra (se borra con el lock aún tomado)
+                os.remove(self.journal_path)
+            self._journal.close()
+            self._journal = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': len(self._pending),
+            'max_batch': self.max_batch,
+            'max_delay_ms': self.max_delay * 1000,
+            'journal': self.journal_path,
+            'dead_letter': self._dead_letters,
+            'dead_letter_path': self.dead_letter_path,
+            'last_flush': self._last_flush
+        }
+
+
+def write_behind_enabled() -> bool:
+    return os.getenv('AQUALYTICS_WRITE_BEHIND') == '1'
+
+
+def create_write_buffer(flush_fn: FlushFn, on_flushed=None) -> WriteBehindBuffer:
+    """Buffer configurado desde variables de entorno (el journal lleva el pid como sufijo)"""
+    return WriteBehindBuffer(
+        flush_fn,
+        journal_path=os.getenv(
+            'AQUALYTICS_WRITE_BEHIND_JOURNAL',
+            os.path.join(tempfile.gettempdir(), 'aqualytics-ingest.journal')
+        ),
+        max_batch=int(os.getenv('AQUALYTICS_WRITE_BEHIND_BATCH', '200')),
+        max_delay=float(os.getenv('AQUALYTICS_WRITE_BEHIND_DELAY_MS', '500')) / 1000,
+        fsync=os.getenv('AQUALYTICS_WRITE_BEHIND_FSYNC') == '1',
+        on_flushed=on_flushed,
+        max_attempts=int(os.getenv('AQUALYTICS_WRITE_BEHIND_MAX_ATTEMPTS', '10'))
+    )
@@ -4,6 +4,11 @@
 
 BEGIN;
 
+-- Drop materialized views (depend on registros)
+DROP MATERIALIZED VIEW IF EXISTS public.mv_mejores_marcas;
+DROP MATERIALIZED VIEW IF EXISTS public.mv_promedio_diario;
+DROP MATERIALIZED VIEW IF EXISTS public.mv_distribucion_estilos;
+
 -- Drop tables in reverse order of dependency
 DROP TABLE IF EXISTS public.registros CASCADE;
 DROP TABLE IF EXISTS public.registros_completos CASCADE;
@@ -0,0 +1,86 @@
+-- Migration: 008_create_performance_views.sql
+-- Description: Creates materialized views with precomputed dashboard aggregates and the
+-- refresh_performance_views() function used by the API refresh scheduler.
+
+BEGIN;
+
+-- Mejor, peor y promedio de cada nadador por prueba y métrica
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.mv_mejores_marcas AS
+SELECT
+    r.id_nadador,
+    r.prueba_id,
+    r.metrica_id,
+    MIN(r.valor) AS valor_min,
+    MAX(r.valor) AS valor_max,
+    AVG(r.valor) AS valor_promedio,
+    COUNT(*) AS total_registros,
+    MAX(r.fecha) AS ultima_fecha
+FROM public.registros r
+GROUP BY r.id_nadador, r.prueba_id, r.metrica_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_mejores_marcas_pk
+    ON public.mv_mejores_marcas (id_nadador, prueba_id, metrica_id);
+CREATE INDEX IF NOT EXISTS mv_mejores_marcas_prueba_metrica
+    ON public.mv_mejores_marcas (prueba_id, metrica_id, valor_min);
+
+-- Promedio diario por métrica (progreso de rendimiento)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.mv_promedio_diario AS
+SELECT
+    r.fecha,
+    r.metrica_id,
+    AVG(r.valor) AS valor_promedio,
+    COUNT(*) AS total_registros
+FROM public.registros r
+GROUP BY r.fecha, r.metrica_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_promedio_diario_pk
+    ON public.mv_promedio_diario (metrica_id, fecha);
+
+-- Registros y nadadores distintos por estilo
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.mv_distribucion_estilos AS
+SELECT
+    e.estilo_id,
+    e.nombre AS estilo,
+    COUNT(*) AS total_registros,
+    COUNT(DISTINCT r.id_nadador) AS nadadores_distintos
+FROM public.registros r
+JOIN public.pruebas p ON p.id = r.prueba_id
+JOIN public.estilos e ON e.estilo_id = p.estilo_id
+GROUP BY e.estilo_id, e.nombre;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_distribucion_estilos_pk
+    ON public.mv_distribucion_estilos (estilo_id);
+
+-- Refresca las vistas sin bloquear lecturas (CONCURRENTLY requiere los índices únicos)
+-- y devuelve la duración de cada una en milisegundos
+CREATE OR REPLACE FUNCTION public.refresh_performance_views()
+RETURNS jsonb AS $$
+DECLARE
+    started TIMESTAMPTZ;
+    result jsonb := '{}'::jsonb;
+BEGIN
+    started := clock_timestamp();
+    REFRESH MATERIALIZED VIEW CONCURRENTLY public.mv_mejores_marcas;
+    result := result || jsonb_build_object('mv_mejores_marcas',
+        round(extract(epoch FROM clock_timestamp() - started)::numeric * 1000, 2));
+
+    started := clock_timestamp();
+    REFRESH MATERIALIZED VIEW CONCURRENTLY public.mv_promedio_diario;
+    result := result || jsonb_build_object('mv_promedio_diario',
+        round(extract(epoch FROM clock_timestamp() - started)::numeric * 1000, 2));
+
+    started := clock_timestamp();
+    REFRESH MATERIALIZED VIEW CONCURRENTLY public.mv_distribucion_estilos;
+    result := result || jsonb_build_object('mv_distribucion_estilos',
+        round(extract(epoch FROM clock_timestamp() - started)::numeric * 1000, 2));
+
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- SECURITY DEFINER corre con los permisos del dueño: solo el rol de servicio
+-- (la API con SUPABASE_SERVICE_ROLE_KEY) puede lanzar el refresco
+REVOKE EXECUTE ON FUNCTION public.refresh_performance_views() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.refresh_performance_views() TO service_role;
+
+COMMIT;